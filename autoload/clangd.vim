@@ -10,21 +10,25 @@ let s:script_folder_path = escape(expand('<sfile>:p:h'), '\')
 let s:old_cursor_position = []
 let s:omnifunc_mode = 0
 let s:cursor_moved = 0
+" 1 once the Python side is imported, -1 if that failed
+let s:python_loaded = 0
+let s:entered = 0
+" seconds spent in clangd#Enable outside of Python
+let s:setup_time = 0.0
 
 " Main Entrance
 fu! clangd#Enable()
   if &diff
     return
   endif
+  let l:start = reltime()
   call s:SetUpFirstRun()
-  try
-    call s:SetUpPython()
-  catch /.*/
-    if v:exception != ""
-        echoerr 'failed to initialize clangd plugin, ' v:exception
-        return
-    endif
-  endtry
+  let s:setup_time = s:Elapsed(l:start)
+  " with lazy start Python is loaded for the first C-family buffer
+  if !g:clangd#lazy_start && !s:LoadPython()
+    return
+  endif
+  let l:start = reltime()
   call s:TurnOffSyntasticForCFamily()
   call s:SetUpSyntasticSigns()
   call s:SetUpSyntasticHl()
@@ -32,18 +36,24 @@ fu! clangd#Enable()
     autocmd!
     "autocmd TabEnter *
     autocmd VimLeave * call s:VimLeave()
-    autocmd BufReadPost * call s:BufferReadPost(expand('<afile>:p'))
-    autocmd FileType * call s:FileType()
-    autocmd BufWritePost * call s:BufferWritePost(expand('<afile>:p'))
-    autocmd BufUnload * call s:BufferUnload(expand('<afile>:p'))
-    autocmd BufDelete * call s:BufferDelete(expand('<afile>:p'))
-    autocmd CursorMoved * call s:CursorMove()
-    autocmd CursorMovedI * call s:CursorMoveInsertMode()
-    autocmd CursorHold,CursorHoldI * call s:CursorHold()
-    autocmd InsertEnter * call s:InsertEnter()
-    autocmd InsertLeave * call s:InsertLeave()
-    autocmd TextChanged,TextChangedI * call s:TextChanged()
+    autocmd BufReadPost * call s:BufferReadPost(expand('<afile>:p'),
+          \ expand('<abuf>'))
+    autocmd FileType * call s:FileType(expand('<abuf>'))
+    autocmd BufEnter * call s:BufferEnter(expand('<abuf>'))
+    autocmd BufFilePost * call s:BufferRegister(expand('<abuf>'))
+    autocmd BufWritePost * call s:BufferWritePost(expand('<afile>:p'),
+          \ expand('<abuf>'))
+    autocmd BufUnload * call s:BufferUnload(expand('<afile>:p'),
+          \ expand('<abuf>'))
+    autocmd BufDelete * call s:BufferDelete(expand('<abuf>'))
+    autocmd BufWipeout * call s:BufferWipeout(expand('<abuf>'))
+  augroup END
+  " per buffer events are only hooked up for C-family buffers, see
+  " s:SetUpBufferAutocmds()
+  augroup clangd_buffer
+    autocmd!
   augroup END
+  let s:setup_time += s:Elapsed(l:start)
   call s:VimEnter()
 endf
 
@@ -54,6 +64,39 @@ fu! s:SetUpPython() abort
   Python from loader import manager, handler
 endf
 
+fu! s:LoadPython()
+  if s:python_loaded
+    return s:python_loaded == 1
+  endif
+  let s:python_loaded = -1
+  try
+    call s:SetUpPython()
+  catch /.*/
+    if v:exception != ""
+        echoerr 'failed to initialize clangd plugin, ' v:exception
+        return 0
+    endif
+  endtry
+  let s:python_loaded = 1
+  return 1
+endf
+
+" loads Python unless it is already, returns whether it is usable
+fu! s:EnsurePython()
+  if !s:LoadPython()
+    return 0
+  endif
+  if !s:entered
+    let s:entered = 1
+    Python handler.OnVimEnter(float(vim.eval('s:setup_time')))
+  endif
+  return 1
+endf
+
+fu! s:Elapsed(start)
+  return str2float(reltimestr(reltime(a:start)))
+endf
+
 fu! s:TurnOffSyntasticForCFamily()
   let g:syntastic_cpp_checkers = []
   let g:syntastic_c_checkers = []
@@ -128,6 +171,39 @@ fu! s:SetUpFirstRun()
     if !exists('g:clangd#autostart')
        let g:clangd#autostart = 1
     endif
+    if !exists('g:clangd#lazy_start')
+       let g:clangd#lazy_start = 0
+    endif
+    if !exists('g:clangd#stats')
+       let g:clangd#stats = 0
+    endif
+    if !exists('g:clangd#trace_dir')
+       let g:clangd#trace_dir = ''
+    endif
+    if !exists('g:clangd#trace_max_size')
+       let g:clangd#trace_max_size = 64
+    endif
+    if !exists('g:clangd#change_delay')
+       let g:clangd#change_delay = 200
+    endif
+    if !exists('g:clangd#use_job')
+       let g:clangd#use_job = 0
+    endif
+    if !exists('g:clangd#diagnostics_interval')
+       let g:clangd#diagnostics_interval = 100
+    endif
+    if !exists('g:clangd#max_servers')
+       let g:clangd#max_servers = 3
+    endif
+    if !exists('g:clangd#standby')
+       let g:clangd#standby = 0
+    endif
+    if !exists('g:clangd#standby_memory_limit')
+       let g:clangd#standby_memory_limit = 1024
+    endif
+    if !exists('g:clangd#completion_timeout')
+       let g:clangd#completion_timeout = 150
+    endif
     if !exists('g:clangd#log_level')
        let g:clangd#log_level = 'warn'
     endif
@@ -154,72 +230,190 @@ endf
 " Watchers
 
 fu! s:VimEnter()
-  Python handler.OnVimEnter()
+  if !g:clangd#lazy_start
+    call s:EnsurePython()
+  endif
   " fix a bug it won't call buffer enter the very first file
-  call s:FileType()
-  func
-  if has('timers')
-      fu! OnTimerCallback(timer)
-        Python handler.OnTimerCallback()
-      endf
-      let s:timer = timer_start(5000, 'OnTimerCallback', { 'repeat': -1 })
+  call s:FileType(bufnr('%'))
+endf
+
+" one-shot timers started from Python, by name
+fu! clangd#OnTimer(name, timer)
+  Python handler.OnTimer(vim.eval('a:name'))
+endf
+
+" Server jobs started from Python, by channel id
+let s:jobs = {}
+
+fu! clangd#JobStart(argv, err_name)
+  let l:options = {
+        \ 'mode': 'raw',
+        \ 'err_io': 'file',
+        \ 'err_name': a:err_name,
+        \ 'out_cb': function('s:OnJobOutput'),
+        \ 'exit_cb': function('s:OnJobExit'),
+        \ }
+  if has('patch-8.1.0350')
+    " buffer writes instead of blocking on a full pipe
+    let l:options.noblock = 1
+  endif
+  let l:job = job_start(a:argv, l:options)
+  if job_status(l:job) !=# 'run'
+    return [-1, -1]
   endif
+  let l:channel = ch_info(job_getchannel(l:job)).id
+  let s:jobs[l:channel] = l:job
+  return [l:channel, job_info(l:job).process]
 endf
 
-fu! s:VimLeave()
-  if has('timers')
-      exec timer_stop(s:timer)
+fu! clangd#JobSend(channel, data)
+  call ch_sendraw(s:jobs[a:channel], a:data)
+endf
+
+" [is open, output], used while Python blocks waiting for a response
+fu! clangd#JobRead(channel, timeout)
+  let l:job = get(s:jobs, a:channel, '')
+  if empty(l:job) || ch_status(l:job) !=# 'open'
+    return [0, '']
   endif
-  Python handler.OnVimLeave()
+  return [1, ch_readraw(l:job, {'timeout': a:timeout})]
 endf
 
-fu! s:BufferRead()
-  if s:PyEval('manager.FilterCurrentFile()')
+fu! clangd#JobStop(channel, how)
+  if has_key(s:jobs, a:channel)
+    call job_stop(s:jobs[a:channel], a:how)
+  endif
+endf
+
+fu! s:OnJobOutput(channel, msg)
+  let l:channel = ch_info(a:channel).id
+  Python handler.OnServerOutput(int(vim.eval('l:channel')),
+        \ vim.bindeval('a:msg'))
+endf
+
+fu! s:OnJobExit(job, status)
+  for [l:channel, l:job] in items(s:jobs)
+    if l:job == a:job
+      call remove(s:jobs, l:channel)
+      Python handler.OnServerExit(int(vim.eval('l:channel')),
+            \ int(vim.eval('a:status')))
+    endif
+  endfor
+endf
+
+fu! s:VimLeave()
+  if s:python_loaded != 1
     return
   endif
-  Python handler.OnBufferRead()
+  Python handler.OnVimLeave()
 endf
 
-fu! s:BufferReadPost(file_name)
-  if s:PyEval('manager.FilterFileName("'. a:file_name . '")')
+fu! s:BufferReadPost(file_name, bufnr)
+  if !s:IsEnabled(a:bufnr)
     return
   endif
   Python handler.OnBufferReadPost(vim.eval('a:file_name'))
 endf
 
-fu! s:FileType()
-  if s:PyEval('manager.FilterCurrentFile()')
+" b:clangd_enabled caches whether the buffer is handled by the plugin, it is
+" computed once per filetype change and read instead of asking Python
+fu! s:IsEnabled(bufnr)
+  return getbufvar(str2nr(a:bufnr), 'clangd_enabled', 0)
+endf
+
+fu! s:IsCFamily(filetype)
+  for l:filetype in split(a:filetype, '\.')
+    if index(['c', 'cpp', 'objc', 'objcpp'], l:filetype) >= 0
+      return 1
+    endif
+  endfor
+  return 0
+endf
+
+fu! s:SetUpBufferAutocmds(bufnr, enabled)
+  let l:buffer = '<buffer=' . a:bufnr . '>'
+  augroup clangd_buffer
+    exe 'autocmd! *' l:buffer
+    if a:enabled
+      exe 'autocmd BufWinEnter,WinEnter' l:buffer
+            \ 'call s:BufferWinEnter(' a:bufnr ')'
+      exe 'autocmd CursorMoved' l:buffer 'call s:CursorMove()'
+      exe 'autocmd CursorMovedI' l:buffer 'call s:CursorMoveInsertMode()'
+      exe 'autocmd CursorHold,CursorHoldI' l:buffer 'call s:CursorHold()'
+      exe 'autocmd InsertEnter' l:buffer 'call s:InsertEnter()'
+      exe 'autocmd InsertLeave' l:buffer 'call s:InsertLeave()'
+      exe 'autocmd TextChanged,TextChangedI' l:buffer 'call s:TextChanged()'
+    endif
+  augroup END
+endf
+
+fu! s:FileType(bufnr)
+  let l:bufnr = str2nr(a:bufnr)
+  let l:enabled = s:IsCFamily(getbufvar(l:bufnr, '&filetype'))
+  if s:python_loaded != 1 && (!l:enabled || !s:EnsurePython())
+    " nothing to register before Python is needed
+    call setbufvar(l:bufnr, 'clangd_enabled', 0)
+    call s:SetUpBufferAutocmds(l:bufnr, 0)
+    return
+  endif
+  call setbufvar(l:bufnr, 'clangd_enabled', l:enabled)
+  call s:SetUpBufferAutocmds(l:bufnr, l:enabled)
+  call s:BufferRegister(l:bufnr)
+  if !l:enabled
     return
   endif
   call s:SetCompletionCallback()
   Python handler.OnFileType()
 endf
 
-fu! s:BufferWritePost(file_name)
-  if s:PyEval('manager.FilterFileName("'. a:file_name . '")')
+fu! s:BufferEnter(bufnr)
+  " buffers loaded before the plugin had no FileType event seen
+  if getbufvar(str2nr(a:bufnr), 'clangd_enabled', -1) == -1
+    call s:FileType(a:bufnr)
+  endif
+endf
+
+fu! s:BufferWritePost(file_name, bufnr)
+  if !s:IsEnabled(a:bufnr)
     return
   endif
   Python handler.OnBufferWritePost(vim.eval('a:file_name'))
 endf
 
-fu! s:BufferUnload(file_name)
-  if s:PyEval('manager.FilterFileName("'. a:file_name . '")')
+fu! s:BufferUnload(file_name, bufnr)
+  if !s:IsEnabled(a:bufnr)
     return
   endif
   Python handler.OnBufferUnload(vim.eval('a:file_name'))
 endf
 
-fu! s:BufferDelete(file_name)
-  if s:PyEval('manager.FilterFileName("'. a:file_name . '")')
+fu! s:BufferDelete(bufnr)
+  if s:python_loaded != 1
     return
   endif
-  Python handler.OnBufferDelete(vim.eval('a:file_name'))
+  " unregisters every buffer, closes C-family ones
+  Python handler.OnBufferDelete(int(vim.eval('a:bufnr')))
 endf
 
-fu! s:CursorMove()
-  if s:PyEval('manager.FilterCurrentFile()')
+fu! s:BufferWipeout(bufnr)
+  if s:python_loaded != 1
+    return
+  endif
+  Python handler.OnBufferWipeout(int(vim.eval('a:bufnr')))
+endf
+
+fu! s:BufferRegister(bufnr)
+  if s:python_loaded != 1
     return
   endif
+  Python handler.OnBufferRegister(int(vim.eval('a:bufnr')))
+endf
+
+fu! s:BufferWinEnter(bufnr)
+  Python handler.OnBufferWinEnter(int(vim.eval('a:bufnr')))
+endf
+
+fu! s:CursorMove()
   let current_position = getpos('.')
   let s:cursor_moved = current_position != s:old_cursor_position
   Python handler.OnCursorMove()
@@ -227,47 +421,32 @@ fu! s:CursorMove()
 endf
 
 fu! s:CursorMoveInsertMode()
-  if s:PyEval('manager.FilterCurrentFile()')
-    return
-  endif
   call s:CursorMove()
   call s:InvokeCompletion()
 endf
 
 fu! s:CursorHold()
-  if s:PyEval('manager.FilterCurrentFile()')
-    return
-  endif
   Python handler.OnCursorHold()
 endf
 
 fu! s:InsertEnter()
-  if s:PyEval('manager.FilterCurrentFile()')
-    return
-  endif
   let s:old_cursor_position = []
   let s:omnifunc_mode = 0
   Python handler.OnInsertEnter()
 endf
 
 fu! s:InsertLeave()
-  if s:PyEval('manager.FilterCurrentFile()')
-    return
-  endif
   Python handler.OnInsertLeave()
 endf
 
 fu! s:TextChanged()
-  if s:PyEval('manager.FilterCurrentFile()')
-    return
-  endif
   Python handler.OnTextChanged()
 endf
 
 " Helpers
 
 fu! s:ShowDiagnostics()
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     return
   endif
   let diags = s:PyEval('manager.GetDiagnosticsForCurrentFile()')
@@ -281,7 +460,7 @@ fu! s:ShowDiagnostics()
 endf
 
 fu! s:ForceCompile()
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     return
   endif
   Python manager.ReparseCurrentFile()
@@ -294,7 +473,7 @@ fu! clangd#CodeCompleteAt(findstart, base)
     return clangd#OmniCompleteAt(a:findstart, a:base)
   endif
   if a:findstart
-    if s:PyEval('manager.FilterCurrentFile()')
+    if !get(b:, 'clangd_enabled', 0)
       return -3
     endif
     if !s:cursor_moved
@@ -307,7 +486,7 @@ fu! clangd#CodeCompleteAt(findstart, base)
     return l:column - 1
   endif
 
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     return []
   endif
   " return completions
@@ -361,7 +540,7 @@ fu! s:SetCompletionCallback()
 endf
 
 fu! s:GotoDefinition()
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     echom 'unsupported file type'
     return
   endif
@@ -370,7 +549,7 @@ fu! s:GotoDefinition()
 endf
 
 fu! s:ShowDetailedDiagnostic()
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     echom 'unsupported file type'
     return
   endif
@@ -378,8 +557,21 @@ fu! s:ShowDetailedDiagnostic()
   Python manager.EchoDetailedErrorMessage()
 endf
 
+fu! s:GotoDiagnostic(forward)
+  if !get(b:, 'clangd_enabled', 0)
+    echom 'unsupported file type'
+    return
+  endif
+
+  if a:forward
+    Python manager.GotoNextDiagnostic()
+  else
+    Python manager.GotoPreviousDiagnostic()
+  endif
+endf
+
 fu! s:ShowCursorDetail()
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     echom 'unsupported file type'
     return
   endif
@@ -388,16 +580,49 @@ fu! s:ShowCursorDetail()
 endf
 
 fu! s:StartServer()
+  if !s:EnsurePython()
+    return
+  endif
   Python manager.startServer(confirmed = True)
 endf
 
 fu! s:StopServer()
+  if s:python_loaded != 1
+    return
+  endif
   Python manager.stopServer(confirmed = True)
 endf
 
 fu! s:RestartServer()
-  Python manager.stopServer(confirmed = True)
-  Python manager.startServer(confirmed = True)
+  if !s:EnsurePython()
+    return
+  endif
+  Python manager.restartServer()
+endf
+
+fu! s:StartupTime()
+  if s:python_loaded != 1
+    echom 'clangd plugin not loaded yet'
+    return
+  endif
+  Python manager.EchoStartupReport()
+endf
+
+fu! s:Stats()
+  if s:python_loaded != 1
+    echom 'clangd plugin not loaded yet'
+    return
+  endif
+  Python manager.EchoStats()
+endf
+
+fu! s:DumpStats(path)
+  if s:python_loaded != 1
+    echom 'clangd plugin not loaded yet'
+    return
+  endif
+  let l:path = empty(a:path) ? g:clangd#log_path . '/stats.json' : a:path
+  Python manager.DumpStats(vim.eval('l:path'))
 endf
 
 fu! s:PyEval(line)
@@ -409,7 +634,7 @@ fu! s:PyEval(line)
 endf
 
 fu! ClangdStatuslineFlag()
-  if s:PyEval('manager.FilterCurrentFile()')
+  if !get(b:, 'clangd_enabled', 0)
     return ''
   endif
   return s:PyEval('manager.ErrorStatusForCurrentLine()')
@@ -420,10 +645,15 @@ command! ClangdCodeComplete call feedkeys("\<C-X>\<C-U>\<C-P>", 'n')
 command! ClangdDiags call s:ShowDiagnostics()
 command! ClangdShowDetailedDiagnostic call s:ShowDetailedDiagnostic()
 command! ClangdForceCompile call s:ForceCompile()
+command! ClangdNextDiagnostic call s:GotoDiagnostic(1)
+command! ClangdPreviousDiagnostic call s:GotoDiagnostic(0)
 " command! ClangdGotoDefinition call s:GotoDefinition()
 " command! ClangdShowCursorDetail call s:ShowCursorDetail()
 command! ClangdStartServer call s:StartServer()
 command! ClangdStopServer call s:StopServer()
 command! ClangdRestartServer call s:RestartServer()
+command! ClangdStartupTime call s:StartupTime()
+command! ClangdStats call s:Stats()
+command! -nargs=? -complete=file ClangdStatsDump call s:DumpStats(<q-args>)
 
 call s:restore_cpo()
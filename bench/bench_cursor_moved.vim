@@ -0,0 +1,44 @@
+" Benchmark for what the plugin adds to CursorMoved in a non C-family buffer.
+"
+"   vim -N -u NONE -i NONE -es --cmd 'set rtp^=.' -S bench/bench_cursor_moved.vim
+"
+" Needs a vim with +python or +python3. clangd is not started. Prints the
+" average cost of one CursorMoved event in a Markdown buffer with the plugin's
+" autocmds and with CursorMoved ignored; run it on two checkouts to compare.
+let s:events = get(g:, 'bench_events', 20000)
+let s:output = get(g:, 'bench_output', '/dev/stdout')
+
+if !has('python') && !has('python3')
+  call writefile(['this vim has no python support'], s:output)
+  cquit
+endif
+
+let g:clangd#autostart = 0
+runtime plugin/clangd.vim
+call clangd#Enable()
+
+enew
+setlocal filetype=markdown
+call setline(1, map(range(1, 200), '"# heading " . v:val'))
+
+fu! s:Measure(events)
+  let l:start = reltime()
+  for l:i in range(a:events)
+    call cursor(l:i % 200 + 1, 1)
+    doautocmd <nomodeline> CursorMoved
+  endfor
+  return reltimefloat(reltime(l:start)) * 1000000.0 / a:events
+endf
+
+let s:with_plugin = s:Measure(s:events)
+set eventignore=CursorMoved
+let s:baseline = s:Measure(s:events)
+set eventignore=
+
+call writefile([
+      \ printf('%d CursorMoved events in a markdown buffer', s:events),
+      \ printf('  with plugin   %8.2f us/event', s:with_plugin),
+      \ printf('  ignored       %8.2f us/event', s:baseline),
+      \ printf('  overhead      %8.2f us/event', s:with_plugin - s:baseline),
+      \ ], s:output)
+qa!
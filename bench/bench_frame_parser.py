@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Microbenchmark for the receive path: compares the legacy byte-at-a-time
+# header parser against FrameBuffer, reporting read syscalls per message and
+# throughput over a real pipe. Both sides stop at the utf-8 decoded body, json
+# decoding is the same for both and left out.
+#
+#   python bench/bench_frame_parser.py [--messages N] [--size BYTES]
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from codecs import utf_8_decode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from frame_buffer import FrameBuffer
+
+
+def MakeFrame(size):
+    item = {'label': 'candidate', 'kind': 3, 'detail': 'int (int, char *)'}
+    count = max(1, size // (len(json.dumps(item)) + 1))
+    body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': [item] * count})
+    body = body.encode('utf-8')
+    return b'Content-Length: ' + str(len(body)).encode('ascii') + \
+        b'\r\n\r\n' + body
+
+
+class LegacyReader(object):
+    """The parser used before FrameBuffer: one os.read per header byte and
+    an immutable bytes accumulator for the body."""
+
+    def __init__(self, fd):
+        self._fd = fd
+        self.reads = 0
+
+    def read_utf8(self, length):
+        msg = bytes()
+        while length:
+            buf = os.read(self._fd, length)
+            self.reads += 1
+            if not buf:
+                raise EOFError()
+            length -= len(buf)
+            msg += buf
+        return msg.decode('utf-8')
+
+    def RecvMsg(self):
+        self.read_utf8(len('Content-Length: '))
+        msg = self.read_utf8(4)
+        while not msg.endswith('\r\n\r\n'):
+            msg += self.read_utf8(1)
+        return self.read_utf8(int(msg[:-4]))
+
+
+class BufferedReader(object):
+    def __init__(self, fd):
+        self._buffer = FrameBuffer(fd)
+
+    @property
+    def reads(self):
+        return self._buffer.reads
+
+    def RecvMsg(self):
+        frame = self._buffer.NextFrame()
+        while frame is None:
+            if not self._buffer.ReadFrom():
+                raise EOFError()
+            frame = self._buffer.NextFrame()
+        return utf_8_decode(frame)[0]
+
+
+def Writer(fd, frame, count):
+    for _ in range(count):
+        view = memoryview(frame)
+        while len(view):
+            view = view[os.write(fd, view):]
+    os.close(fd)
+
+
+def Run(reader_class, frame, count):
+    rfd, wfd = os.pipe()
+    writer = threading.Thread(target=Writer, args=(wfd, frame, count))
+    writer.start()
+    reader = reader_class(rfd)
+    start = time.time()
+    for _ in range(count):
+        reader.RecvMsg()
+    elapsed = time.time() - start
+    writer.join()
+    os.close(rfd)
+    return reader.reads, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--size', type=int, nargs='+',
+                        default=[256, 16 * 1024, 4 * 1024 * 1024])
+    args = parser.parse_args()
+
+    print('%-10s %10s %10s %14s %10s' % ('parser', 'msg size', 'messages',
+                                         'reads/message', 'MB/s'))
+    for size in args.size:
+        frame = MakeFrame(size)
+        count = args.messages
+        if size >= 1024 * 1024:
+            count = max(1, count // 20)
+        for name, reader_class in (('legacy', LegacyReader),
+                                   ('buffered', BufferedReader)):
+            reads, elapsed = Run(reader_class, frame, count)
+            mbps = len(frame) * count / elapsed / (1024 * 1024)
+            print('%-10s %10d %10d %14.2f %10.1f' %
+                  (name, len(frame), count, float(reads) / count, mbps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Benchmark for CandidateIndex: index build time and ranking latency over a
+# synthetic clangd-sized completion result.
+#
+#   python bench/bench_fuzzy_matcher.py [--items N] [--repeat N]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from fuzzy_matcher import CandidateIndex
+
+WORDS = ['get', 'set', 'value', 'buffer', 'string', 'size', 'count', 'read',
+         'write', 'file', 'name', 'impl', 'handler', 'vector', 'map', 'node']
+PATTERNS = ['', 'g', 'gs', 'getVal', 'bufsz', 'rdfl', 'm_', 'xyz']
+
+
+def MakeItems(count, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for _ in range(count):
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(1, 4))]
+        label = rng.choice(['', '_', 'm_']) + parts[0] + ''.join(
+            part.capitalize() for part in parts[1:])
+        items.append({
+            'label': label,
+            'kind': rng.randint(1, 18),
+            'sortText': '%08x%s' % (rng.randint(0, 1 << 30), label)
+        })
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    items = MakeItems(args.items)
+    start = time.time()
+    index = CandidateIndex(items)
+    print('build %d items: %.2f ms' % (len(items),
+                                       (time.time() - start) * 1000))
+    print('%-10s %10s %10s' % ('pattern', 'ms/rank', 'top'))
+    for pattern in PATTERNS:
+        start = time.time()
+        for _ in range(args.repeat):
+            ranked = index.Rank(pattern)
+        elapsed = (time.time() - start) * 1000 / args.repeat
+        top = ranked[0]['label'] if ranked else '-'
+        print('%-10s %10.2f %10s' % (pattern or "''", elapsed, top))
+
+
+if __name__ == '__main__':
+    main()
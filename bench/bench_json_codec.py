@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Compares the json codecs of jsonrpc.py on clangd payloads: encoding to
+# bytes and decoding from a memoryview of the receive buffer, as the client
+# does. Codecs that cannot be imported are skipped.
+#
+#   python bench/bench_json_codec.py [--payloads FILE] [--repeat N]
+#
+# FILE holds Content-Length framed messages as clangd writes them, e.g. its
+# stdout captured with tee. Without it completion results and diagnostics
+# shaped like clangd's are generated.
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from frame_buffer import FrameBuffer
+from jsonrpc import CODECS
+
+
+def MakeCompletion(items):
+    result = []
+    for i in range(items):
+        result.append({
+            'label': ' candidate_%d(int value, const char *name)' % i,
+            'kind': 3,
+            'detail': 'int',
+            'sortText': '%08x' % i,
+            'filterText': 'candidate_%d' % i,
+            'insertText': 'candidate_%d' % i,
+            'insertTextFormat': 1,
+            'textEdit': {
+                'newText': 'candidate_%d' % i,
+                'range': {'start': {'line': 41, 'character': 4},
+                          'end': {'line': 41, 'character': 7}}
+            }
+        })
+    return {'jsonrpc': '2.0', 'id': 7,
+            'result': {'isIncomplete': False, 'items': result}}
+
+
+def MakeDiagnostics(diagnostics):
+    result = []
+    for i in range(diagnostics):
+        result.append({
+            'range': {'start': {'line': i, 'character': 8},
+                      'end': {'line': i, 'character': 19}},
+            'severity': 1 + i % 2,
+            'message': u"use of undeclared identifier 'valué_%d'" % i
+        })
+    return {'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics',
+            'params': {'uri': 'file:///src/project/lib/module.cc',
+                       'version': 3, 'diagnostics': result}}
+
+
+def Generated():
+    for items in (10, 1000, 10000):
+        yield 'completion %d' % items, MakeCompletion(items)
+    for diagnostics in (10, 500):
+        yield 'diagnostics %d' % diagnostics, MakeDiagnostics(diagnostics)
+
+
+def Recorded(path):
+    buf = FrameBuffer()
+    with open(path, 'rb') as f:
+        buf.Feed(f.read())
+    frames = []
+    while True:
+        frame = buf.NextFrame()
+        if frame is None:
+            break
+        frames.append(json.loads(bytes(frame).decode('utf-8')))
+    # one row per method, or per response, with the largest message of each
+    largest = {}
+    for msg in frames:
+        name = msg.get('method', 'response')
+        size = len(json.dumps(msg))
+        if name not in largest or largest[name][0] < size:
+            largest[name] = (size, msg)
+    for name in sorted(largest):
+        yield name, largest[name][1]
+
+
+def Measure(function, arg, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        function(arg)
+    return (time.time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payloads', help='file of framed clangd messages')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    codecs = []
+    for cls in CODECS:
+        try:
+            codecs.append(cls())
+        except ImportError:
+            print('%s: not installed' % cls.name)
+
+    payloads = Recorded(args.payloads) if args.payloads else Generated()
+    print('%-34s %-7s %10s %10s %10s' % ('payload', 'codec', 'bytes',
+                                         'enc MB/s', 'dec MB/s'))
+    for name, payload in payloads:
+        for codec in codecs:
+            body = codec.dumps(payload)
+            view = memoryview(bytearray(body))
+            if codec.loads(view) != payload:
+                print('%s: %s does not round trip' % (name, codec.name))
+                continue
+            size = len(body) / (1024.0 * 1024.0)
+            encode = Measure(codec.dumps, payload, args.repeat)
+            decode = Measure(codec.loads, view, args.repeat)
+            print('%-34s %-7s %10d %10.1f %10.1f' % (
+                name[:34], codec.name, len(body), size / encode,
+                size / decode))
+
+
+if __name__ == '__main__':
+    main()
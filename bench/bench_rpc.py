@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# End-to-end benchmark of LSPClient and JsonRPCClient against
+# bench/fake_clangd.py, no clangd needed. Each scenario starts its own fake
+# server over pipes and reports messages/s, request latency percentiles and
+# what the transport did: read and write calls and bytes moved inside the
+# receive buffer.
+#
+#   python bench/bench_rpc.py [--scenario NAME ...] [--messages N]
+#                             [--latency-ms MS] [--stats]
+#
+# With --stats the clients record rpc_stats, whose report is printed after
+# each scenario, run with and without it to see what recording costs.
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'python'))
+import glog as log
+from lsp_client import LSPClient, Completion_REQUEST
+from rpc_stats import RpcStats
+
+URI = 'file:///bench/main.cc'
+# set by --stats
+STATS = None
+
+
+class Observer(object):
+    def __init__(self):
+        self.diagnostics = 0
+
+    def on_server_connected(self, client):
+        client.onInitialized()
+
+    def on_server_down(self, client):
+        log.warn('fake server went down')
+
+    def onDiagnostics(self, uri, diagnostics, version=None):
+        self.diagnostics += 1
+
+
+def StartClient(server_args):
+    observer = Observer()
+    argv = [sys.executable, os.path.join(HERE, 'fake_clangd.py')]
+    client = LSPClient(argv + server_args, None, observer)
+    # wait as long as it takes, timeouts are not measured here
+    client.setRequestTimeout(Completion_REQUEST, None)
+    client.setStats(STATS)
+    client.initialize()
+    return client, observer
+
+
+def Stop(client):
+    client.shutdown()
+    client.exit()
+
+
+def Percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def Transport(client):
+    rpc = client._rpcclient
+    recv = rpc._recv_buffer
+    return {
+        'received': recv.bytes_read,
+        'reads': recv.reads,
+        'copied': recv.bytes_copied,
+        'writes': rpc._writer.writes,
+    }
+
+
+def Report(name, messages, elapsed, transport, latencies=None):
+    line = '%-14s %8d msgs %10.0f msgs/s' % (name, messages,
+                                             messages / elapsed)
+    if latencies:
+        line += '  p50 %7.2fms p99 %7.2fms' % (
+            Percentile(latencies, 0.5) * 1000,
+            Percentile(latencies, 0.99) * 1000)
+    print(line)
+    print('%14s %8.1f MB in %d reads, %.1f MB copied, %d writes' % (
+        '', transport['received'] / 1048576.0, transport['reads'],
+        transport['copied'] / 1048576.0, transport['writes']))
+    if STATS is not None:
+        print(STATS.Report())
+        STATS.Reset()
+
+
+def Requests(args):
+    """Sequential completion requests."""
+    client, _ = StartClient(['--latency-ms', str(args.latency_ms),
+                             '--completion-items', str(args.items)])
+    client.didOpenTestDocument(URI, 'int main() {}\n', 'cpp')
+    latencies = []
+    start = time.time()
+    for i in range(args.messages):
+        before = time.time()
+        client.completeAt(URI, 0, i % 10)
+        latencies.append(time.time() - before)
+    elapsed = time.time() - start
+    transport = Transport(client)
+    Stop(client)
+    Report('requests', args.messages, elapsed, transport, latencies)
+
+
+def Pipelined(args):
+    """Requests sent back to back, answers collected afterwards."""
+    client, _ = StartClient(['--latency-ms', str(args.latency_ms),
+                             '--completion-items', str(args.items)])
+    rpc = client._rpcclient
+    start = time.time()
+    sent = []
+    for i in range(args.messages):
+        sent.append((time.time(), rpc.sendRequestAsync(
+            Completion_REQUEST, {'textDocument': {'uri': URI},
+                                 'position': {'line': 0,
+                                              'character': i % 10}})))
+    latencies = []
+    for before, future in sent:
+        future.result()
+        latencies.append(time.time() - before)
+    elapsed = time.time() - start
+    transport = Transport(client)
+    Stop(client)
+    Report('pipelined', args.messages, elapsed, transport, latencies)
+
+
+def Notifications(args):
+    """Incremental didChange notifications, a request waits until the
+    server read them all."""
+    client, _ = StartClient(['--storm', '0'])
+    client.didOpenTestDocument(URI, '', 'cpp')
+    text = 'x' * args.change_size
+    start = time.time()
+    for version in range(2, args.messages + 2):
+        client.didChangeTestDocument(URI, version, None, [{
+            'range': {'start': {'line': 0, 'character': 0},
+                      'end': {'line': 0, 'character': 0}},
+            'text': text
+        }])
+    stats = client.sendRequest('fake/stats')
+    elapsed = time.time() - start
+    transport = Transport(client)
+    Stop(client)
+    if stats['received'].get('textDocument/didChange') != args.messages:
+        print('server got %s didChange' %
+              stats['received'].get('textDocument/didChange'))
+    Report('notifications', args.messages, elapsed, transport)
+
+
+def Storm(args):
+    """publishDiagnostics pushed by the server, dispatched the way the
+    refresh timer does."""
+    client, observer = StartClient(['--storm', str(args.messages),
+                                    '--diagnostics', str(args.diagnostics)])
+    start = time.time()
+    client.didOpenTestDocument(URI, 'int main() {}\n', 'cpp')
+    while observer.diagnostics < args.messages:
+        client.handleClientRequests()
+        time.sleep(0.001)
+    elapsed = time.time() - start
+    transport = Transport(client)
+    Stop(client)
+    Report('storm', args.messages, elapsed, transport)
+
+
+SCENARIOS = [
+    ('requests', Requests),
+    ('pipelined', Pipelined),
+    ('notifications', Notifications),
+    ('storm', Storm),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', nargs='+',
+                        choices=[name for name, _ in SCENARIOS])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--items', type=int, default=100,
+                        help='completion items per response')
+    parser.add_argument('--change-size', type=int, default=64,
+                        help='bytes of text per didChange')
+    parser.add_argument('--diagnostics', type=int, default=50,
+                        help='diagnostics per publishDiagnostics')
+    parser.add_argument('--stats', action='store_true',
+                        help='record and print per method statistics')
+    args = parser.parse_args()
+    log.init('warn', os.devnull)
+    if args.stats:
+        global STATS
+        STATS = RpcStats()
+
+    for name, scenario in SCENARIOS:
+        if not args.scenario or name in args.scenario:
+            scenario(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# Replays editing sessions against the plugin outside of vim: EventDispatcher
+# and ClangdManager run on bench/fake_vim.py, clangd is bench/fake_clangd.py.
+# The autocmds autoload/clangd.vim hooks up are fired the way vim would and
+# timers run when they are due.
+#
+#   python bench/bench_session.py [--files N ...] [--chars N] [--rate CPS]
+#                                 [--moves N] [--switches N] [--complete]
+#
+# For every number of files the missing ones are opened, then some of them
+# are switched to, typed in at --rate characters per second, moved around
+# in and saved. Printed per step are the open documents, resident memory,
+# python heap and handler latencies, at the end every handler with its
+# latency and vim round trips per call.
+import argparse
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'python'))
+import fake_vim
+sys.modules['vim'] = fake_vim
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import glog as log
+
+LINES = ['#include <vector>', '', 'namespace bench {', ''] + [
+    'int function_%d(int value) { return value * %d; }' % (i, i)
+    for i in range(200)] + ['', '}  // namespace bench']
+
+
+def Percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class Session(object):
+    def __init__(self, project, handler):
+        self._project = project
+        self._handler = handler
+        # handler name -> latencies in seconds
+        self.latencies = {}
+
+    def Fire(self, name, *args):
+        start = time.time()
+        getattr(self._handler, name)(*args)
+        self.latencies.setdefault(name, []).append(time.time() - start)
+        self.RunTimers()
+
+    def RunTimers(self):
+        for name in fake_vim.DueTimers():
+            self.Fire('OnTimer', name)
+
+    def Idle(self, seconds):
+        """Lets time pass, running timers as they come due."""
+        deadline = time.time() + seconds
+        while True:
+            self.RunTimers()
+            due = fake_vim.NextTimer()
+            now = time.time()
+            if now >= deadline:
+                return
+            time.sleep(max(0, min(deadline, due or deadline) - now))
+
+    def Open(self, index):
+        name = os.path.join(self._project, 'src', 'file_%05d.cc' % index)
+        buf = fake_vim.AddBuffer(name, list(LINES), 'cpp')
+        fake_vim.Show(buf)
+        self.Fire('OnBufferReadPost', name)
+        # s:FileType() registers the buffer, then calls OnFileType
+        buf.vars['clangd_enabled'] = 1
+        self.Fire('OnBufferRegister', buf.number)
+        self.Fire('OnFileType')
+        self.Fire('OnBufferWinEnter', buf.number)
+        return buf
+
+    def Switch(self, buf):
+        fake_vim.Show(buf)
+        self.Fire('OnBufferWinEnter', buf.number)
+
+    def Type(self, chars, rate, complete):
+        window = fake_vim.current.window
+        buf = window.buffer
+        line = len(buf) - 2
+        window.cursor = (line, 0)
+        self.Fire('OnInsertEnter')
+        for i in range(chars):
+            c = 'x' if i % 8 else ' '
+            buf[line - 1] = buf[line - 1][:window.cursor[1]] + c + \
+                buf[line - 1][window.cursor[1]:]
+            window.cursor = (line, window.cursor[1] + 1)
+            buf.options['modified'] = True
+            self.Fire('OnTextChanged')
+            self.Fire('OnCursorMove')
+            if complete and c != ' ':
+                self.Complete()
+            if rate:
+                self.Idle(1.0 / rate)
+        self.Fire('OnInsertLeave')
+
+    def Complete(self):
+        manager = self._handler.manager
+        start = time.time()
+        if manager.CodeCompleteAtCurrent() >= 0:
+            manager.GetCompletions()
+        self.latencies.setdefault('completion', []).append(
+            time.time() - start)
+
+    def Move(self, moves):
+        window = fake_vim.current.window
+        for i in range(moves):
+            window.cursor = (1 + (window.cursor[0] + 7) % len(window.buffer),
+                             0)
+            self.Fire('OnCursorMove')
+        self.Fire('OnCursorHold')
+
+    def Save(self):
+        buf = fake_vim.current.buffer
+        buf.options['modified'] = False
+        self.Fire('OnBufferWritePost', buf.name)
+
+
+def SetUpVim(work_dir, args):
+    server = os.path.join(work_dir, 'clangd')
+    with open(server, 'w') as f:
+        f.write('#!/bin/sh\nexec "%s" "%s" --storm 1 --diagnostics %d '
+                '--completion-items %d --latency-ms %s\n' % (
+                    sys.executable, os.path.join(HERE, 'fake_clangd.py'),
+                    args.diagnostics, args.items, args.latency_ms))
+    os.chmod(server, os.stat(server).st_mode | stat.S_IXUSR)
+    fake_vim.variables.update({
+        'g:clangd#clangd_executable': server,
+        'g:clangd#log_path': work_dir,
+        'g:clangd#log_level': 'warn',
+        'g:clangd#autostart': 1,
+        'g:clangd#use_job': 0,
+        'g:clangd#change_delay': 200,
+        'g:clangd#diagnostics_interval': 100,
+        'g:clangd#completion_timeout': 150,
+        'g:clangd#max_servers': 3,
+        'g:clangd#standby': 0,
+        'g:clangd#standby_memory_limit': 1024,
+    })
+    fake_vim.features.update([
+        'timers', '*win_getid', '*win_gotoid', '*win_findbuf', '*matchaddpos',
+        '*sign_placelist', '*sign_unplacelist', 'patch-8.1.1084'])
+    # the unnamed buffer vim starts with
+    fake_vim.Show(fake_vim.AddBuffer('', [''], ''))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--chars', type=int, default=40,
+                        help='characters typed per step')
+    parser.add_argument('--rate', type=float, default=20,
+                        help='characters per second, 0 for no pause')
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--switches', type=int, default=20)
+    parser.add_argument('--complete', action='store_true',
+                        help='ask for completions while typing')
+    parser.add_argument('--items', type=int, default=100,
+                        help='completion items per response')
+    parser.add_argument('--diagnostics', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=1)
+    args = parser.parse_args()
+
+    random.seed(1)
+    work_dir = tempfile.mkdtemp(prefix='clangd-bench-')
+    project = os.path.join(work_dir, 'project')
+    os.makedirs(os.path.join(project, 'src'))
+    open(os.path.join(project, 'compile_commands.json'), 'w').close()
+    os.chdir(project)
+    SetUpVim(work_dir, args)
+    log.init('warn', os.path.join(work_dir, 'vim-clangd.log'))
+    if tracemalloc:
+        tracemalloc.start()
+
+    from clangd_manager import ClangdManager
+    from event_dispatcher import EventDispatcher
+    from standby_server import ResidentSetSize
+    handler = EventDispatcher(ClangdManager())
+    session = Session(project, handler)
+    session.Fire('OnVimEnter')
+
+    print('%6s %7s %8s %8s %9s %11s %11s' % (
+        'files', 'docs', 'rss MB', 'heap MB', 'open ms', 'key p99 us',
+        'move p99 us'))
+    opened = []
+    try:
+        for files in args.files:
+            start = time.time()
+            count = files - len(opened)
+            while len(opened) < files:
+                opened.append(session.Open(len(opened)))
+            open_ms = (time.time() - start) * 1000 / max(count, 1)
+            session.Idle(0.3)
+
+            for buf in random.sample(opened, min(args.switches,
+                                                 len(opened))):
+                session.Switch(buf)
+            keys = len(session.latencies.get('OnTextChanged', []))
+            session.Type(args.chars, args.rate, args.complete)
+            key = Percentile(session.latencies['OnTextChanged'][keys:], 0.99)
+            moves = len(session.latencies['OnCursorMove'])
+            session.Move(args.moves)
+            move = Percentile(session.latencies['OnCursorMove'][moves:], 0.99)
+            session.Save()
+            session.Idle(0.3)
+
+            heap = tracemalloc.get_traced_memory()[0] if tracemalloc else 0
+            print('%6d %7d %8.1f %8.1f %9.2f %11.0f %11.0f' % (
+                files, len(handler.manager._documents),
+                (ResidentSetSize(os.getpid()) or 0) / 1048576.0,
+                heap / 1048576.0, open_ms, key * 1e6, move * 1e6))
+    finally:
+        session.Fire('OnVimLeave')
+        os.chdir(HERE)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    round_trips = handler.RoundTripStats()
+    print('')
+    print('%-20s %7s %10s %10s %10s %12s' % (
+        'handler', 'calls', 'mean us', 'p50 us', 'p99 us', 'round trips'))
+    for name in sorted(session.latencies):
+        samples = session.latencies[name]
+        trips = round_trips.get(name)
+        print('%-20s %7d %10.0f %10.0f %10.0f %12s' % (
+            name, len(samples), sum(samples) / len(samples) * 1e6,
+            Percentile(samples, 0.5) * 1e6, Percentile(samples, 0.99) * 1e6,
+            '-' if trips is None else '%.2f' % trips))
+    if fake_vim.unknown:
+        print('')
+        print('not emulated: %s' % ', '.join(sorted(fake_vim.unknown)))
+
+
+if __name__ == '__main__':
+    main()
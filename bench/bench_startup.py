@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Startup time of the plugin, eager and with g:clangd#lazy_start, on
+# bench/fake_vim.py against bench/fake_clangd.py.
+#
+#   python bench/bench_startup.py [--runs N] [--latency-ms MS]
+#
+# Every run is a fresh python process, imports are part of the startup. A
+# run goes through VimEnter, then opens one C++ file and waits for its
+# diagnostics. Printed are the medians of how long VimEnter and opening the
+# file blocked, how long the diagnostics took after opening it and the
+# phases of the startup report.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ('eager', 'lazy')
+
+
+def Run(mode, args):
+    import bench_session
+    work_dir = tempfile.mkdtemp(prefix='clangd-bench-')
+    project = os.path.join(work_dir, 'project')
+    os.makedirs(os.path.join(project, 'src'))
+    open(os.path.join(project, 'compile_commands.json'), 'w').close()
+    os.chdir(project)
+    args.items = 100
+    bench_session.SetUpVim(work_dir, args)
+    # [(phase, seconds)]
+    results = []
+    try:
+        # clangd#Enable and VimEnter
+        start = time.time()
+        if mode == 'eager':
+            from loader import handler
+            handler.OnVimEnter()
+        results.append(('vim enter', time.time() - start))
+
+        # FileType of the first C-family buffer
+        start = time.time()
+        from loader import handler
+        if mode == 'lazy':
+            handler.OnVimEnter()
+        session = bench_session.Session(project, handler)
+        buf = session.Open(0)
+        results.append(('first buffer', time.time() - start))
+
+        uri = 'file://' + buf.name
+        documents = handler.manager._documents
+        while 'diagnostics' not in documents.get(uri, {}):
+            session.Idle(0.001)
+        results.append(('first diagnostics', time.time() - start))
+        session.Fire('OnVimLeave')
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    import startup_report
+    phases = [(name, seconds * 1000) for name, seconds in results]
+    print(json.dumps(phases + startup_report.Phases()))
+
+
+def Median(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=20,
+                        help='fake clangd answer delay, initialize included')
+    parser.add_argument('--diagnostics', type=int, default=20)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        Run(args.mode, args)
+        return
+
+    # mode -> phase -> [milliseconds]
+    results = {}
+    order = []
+    for mode in MODES:
+        for _ in range(args.runs):
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), '--mode', mode,
+                '--latency-ms', str(args.latency_ms),
+                '--diagnostics', str(args.diagnostics)])
+            for phase, ms in json.loads(output.decode('utf-8')):
+                results.setdefault(mode, {}).setdefault(phase, []).append(ms)
+                if phase not in order:
+                    order.append(phase)
+
+    print('%-18s %10s %10s' % (('phase',) + MODES))
+    for phase in order:
+        print('%-18s %10s %10s' % ((phase,) + tuple(
+            '%.1f' % Median(results[mode][phase])
+            if phase in results[mode] else '-' for mode in MODES)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Stand-in for clangd speaking LSP over stdio, for benchmarks on machines
+# without clangd.
+#
+#   python bench/fake_clangd.py [--latency-ms MS] [--completion-items N]
+#                               [--item-size BYTES] [--diagnostics N]
+#                               [--storm N] [--canned FILE]
+#
+# Requests are answered after the configured latency, a $/cancelRequest
+# arriving before that turns the answer into a RequestCancelled error.
+# didOpen and didChange are answered with `--storm` publishDiagnostics of
+# `--diagnostics` entries each. FILE is a json object of method -> result
+# replacing the generated results. The fake/stats request returns what was
+# received so far.
+import argparse
+import heapq
+import json
+import sys
+import threading
+import time
+
+RequestCancelled = -32800
+MethodNotFound = -32601
+
+
+def MakeCompletion(items, size):
+    # size pads the detail of every item, for large payloads
+    detail = 'int (int value, const char *name)' + ' ' * size
+    return {'isIncomplete': False, 'items': [{
+        'label': 'candidate_%d' % i,
+        'kind': 3,
+        'detail': detail,
+        'sortText': '%08x' % i,
+        'insertText': 'candidate_%d' % i,
+        'insertTextFormat': 1
+    } for i in range(items)]}
+
+
+def MakeDiagnostics(count):
+    return [{
+        'range': {'start': {'line': i, 'character': 4},
+                  'end': {'line': i, 'character': 9}},
+        'severity': 1 + i % 2,
+        'message': "use of undeclared identifier 'value_%d'" % i
+    } for i in range(count)]
+
+
+class Output(object):
+    """Writes messages, delayed ones from a thread in order of their due
+    time."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._cond = threading.Condition()
+        self._delayed = []
+        # request id -> entry of its pending response
+        self._pending = {}
+        self._sequence = 0
+        self._thread = threading.Thread(target=self._Loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Send(self, message):
+        with self._cond:
+            self._Write(message)
+
+    def SendLater(self, delay, message):
+        with self._cond:
+            self._sequence += 1
+            entry = [time.time() + delay, self._sequence, message]
+            if 'id' in message:
+                self._pending[message['id']] = entry
+            heapq.heappush(self._delayed, entry)
+            self._cond.notify()
+
+    def Cancel(self, request_id):
+        with self._cond:
+            entry = self._pending.pop(request_id, None)
+            if entry is None:
+                return
+            entry[2] = {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': RequestCancelled,
+                                  'message': 'cancelled'}}
+            entry[0] = 0
+            heapq.heapify(self._delayed)
+            self._cond.notify()
+
+    def _Write(self, message):
+        body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        self._stream.write(('Content-Length: %d\r\n\r\n' % len(body))
+                           .encode('ascii') + body)
+        self._stream.flush()
+
+    def _Loop(self):
+        with self._cond:
+            while True:
+                if not self._delayed:
+                    self._cond.wait()
+                    continue
+                wait = self._delayed[0][0] - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, message = heapq.heappop(self._delayed)
+                self._pending.pop(message.get('id'), None)
+                try:
+                    self._Write(message)
+                except (IOError, OSError):
+                    return
+
+
+def ReadBody(stream):
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    return stream.read(length)
+
+
+class FakeServer(object):
+    def __init__(self, args, output):
+        self._args = args
+        self._output = output
+        self._latency = args.latency_ms / 1000.0
+        self._canned = {}
+        if args.canned:
+            with open(args.canned) as f:
+                self._canned = json.load(f)
+        self._completion = MakeCompletion(args.completion_items,
+                                          args.item_size)
+        self._diagnostics = MakeDiagnostics(args.diagnostics)
+        self.received = {}
+        self.received_bytes = 0
+
+    def Result(self, method, params):
+        if method in self._canned:
+            return self._canned[method]
+        if method == 'initialize':
+            return {'capabilities': {'textDocumentSync': 2,
+                                     'completionProvider': {}}}
+        if method == 'textDocument/completion':
+            return self._completion
+        if method == 'shutdown':
+            return None
+        if method == 'fake/stats':
+            return {'received': self.received,
+                    'received_bytes': self.received_bytes}
+        raise KeyError(method)
+
+    def Handle(self, message):
+        method = message.get('method')
+        self.received[method] = self.received.get(method, 0) + 1
+        params = message.get('params') or {}
+        if method == '$/cancelRequest':
+            self._output.Cancel(params['id'])
+            return True
+        if method == 'exit':
+            return False
+        if method in ('textDocument/didOpen', 'textDocument/didChange'):
+            self.Publish(params['textDocument'])
+        if 'id' not in message:
+            return True
+        response = {'jsonrpc': '2.0', 'id': message['id']}
+        try:
+            response['result'] = self.Result(method, params)
+        except KeyError:
+            response['error'] = {'code': MethodNotFound,
+                                 'message': 'unknown method %s' % method}
+        if self._latency and method != 'fake/stats':
+            self._output.SendLater(self._latency, response)
+        else:
+            self._output.Send(response)
+        return True
+
+    def Publish(self, document):
+        for _ in range(self._args.storm):
+            self._output.Send({
+                'jsonrpc': '2.0',
+                'method': 'textDocument/publishDiagnostics',
+                'params': {'uri': document['uri'],
+                           'version': document.get('version'),
+                           'diagnostics': self._diagnostics}
+            })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--completion-items', type=int, default=100)
+    parser.add_argument('--item-size', type=int, default=0,
+                        help='extra bytes per completion item')
+    parser.add_argument('--diagnostics', type=int, default=10)
+    parser.add_argument('--storm', type=int, default=1,
+                        help='publishDiagnostics per didOpen/didChange')
+    parser.add_argument('--canned', help='json file of method -> result')
+    args = parser.parse_args()
+
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    server = FakeServer(args, Output(stdout))
+    while True:
+        body = ReadBody(stdin)
+        if body is None:
+            break
+        server.received_bytes += len(body)
+        if not server.Handle(json.loads(body.decode('utf-8'))):
+            break
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# Stand-in for vim's python module, enough of it to run the plugin outside
+# of vim. Install it before anything imports vim:
+#
+#   import fake_vim
+#   sys.modules['vim'] = fake_vim
+#
+# Buffers, windows and tab pages are plain objects the caller sets up with
+# AddBuffer()/Show(). eval() understands the handful of expressions the
+# plugin uses, everything else evaluates to '0' and is counted in
+# `unknown`. Commands are only recorded, except that timer_stop() cancels a
+# timer started with timer_start().
+import re
+import time
+
+variables = {}
+# has()/exists() arguments which are true
+features = set()
+options = {'columns': '120', 'ruler': '1', 'showcmd': '1'}
+
+evals = 0
+commands = 0
+calls = 0
+unknown = {}
+# timer id -> [due time, name clangd#OnTimer is called with]
+timers = {}
+_next_timer = [1]
+
+
+class error(Exception):
+    pass
+
+
+class Buffer(list):
+    def __init__(self, number, name, lines, filetype):
+        list.__init__(self, lines)
+        self.number = number
+        self.name = name
+        self.valid = True
+        self.loaded = True
+        # string options are bytes, like vim gives them to python 3
+        self.options = {'filetype': filetype.encode('utf-8'),
+                        'modified': False, 'fileencoding': b'utf-8'}
+        self.vars = {}
+
+
+class Window(object):
+    def __init__(self, window_id, buffer):
+        self.id = window_id
+        self.buffer = buffer
+        self.cursor = (1, 0)
+        self.number = 1
+        self.tabpage = None
+
+
+class TabPage(object):
+    def __init__(self, number):
+        self.number = number
+        self.windows = []
+
+
+class _Current(object):
+    def __init__(self):
+        self.tabpage = None
+        self.window = None
+
+    @property
+    def buffer(self):
+        return self.window.buffer
+
+    @property
+    def line(self):
+        return self.window.buffer[self.window.cursor[0] - 1]
+
+    @line.setter
+    def line(self, text):
+        self.window.buffer[self.window.cursor[0] - 1] = text
+
+
+buffers = {}
+tabpages = [TabPage(1)]
+current = _Current()
+current.tabpage = tabpages[0]
+
+
+def AddBuffer(name, lines, filetype):
+    number = max(buffers) + 1 if buffers else 1
+    buffers[number] = Buffer(number, name, lines, filetype)
+    return buffers[number]
+
+
+def Show(buffer, split=False):
+    """Shows buffer in the current window, or in a new one with split."""
+    tab = current.tabpage
+    if split or current.window is None:
+        window = Window(1000 + sum(len(t.windows) for t in tabpages), buffer)
+        window.tabpage = tab
+        tab.windows.append(window)
+        window.number = len(tab.windows)
+        current.window = window
+    else:
+        current.window.buffer = buffer
+        current.window.cursor = (1, 0)
+    return current.window
+
+
+def DueTimers(now=None):
+    """Removes and returns the names of the timers due by now."""
+    now = time.time() if now is None else now
+    due = sorted((timer[0], timer_id) for timer_id, timer in timers.items()
+                 if timer[0] <= now)
+    return [timers.pop(timer_id)[1] for _, timer_id in due]
+
+
+def NextTimer():
+    return min(timer[0] for timer in timers.values()) if timers else None
+
+
+def command(text):
+    global commands
+    commands += 1
+    for timer_id in re.findall(r'timer_stop\((\d+)\)', text):
+        timers.pop(int(timer_id), None)
+
+
+def eval(expression):
+    global evals
+    evals += 1
+    return _Eval(expression.strip())
+
+
+class Function(object):
+    def __init__(self, name):
+        self._name = name
+
+    def __call__(self, *args):
+        global calls
+        calls += 1
+        unknown[self._name] = unknown.get(self._name, 0) + 1
+        return 0
+
+
+def _SplitArguments(text):
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    if text[start:].strip():
+        parts.append(text[start:].strip())
+    return parts
+
+
+def _Unquote(text):
+    if text[:1] in '\'"' and text[-1:] == text[:1]:
+        return text[1:-1]
+    return text
+
+
+def _WindowOf(bufnr):
+    for window in current.tabpage.windows:
+        if window.buffer.number == bufnr:
+            return window
+    return None
+
+
+def _Eval(expression):
+    if expression.startswith('[') and expression.endswith(']'):
+        return [_Eval(part) for part in _SplitArguments(expression[1:-1])]
+    if expression.startswith('g:'):
+        return str(variables.get(expression, '0'))
+    if expression == '&filetype':
+        return current.buffer.options['filetype'].decode('utf-8')
+    if expression.startswith('&'):
+        return options.get(expression[1:], '0')
+    match = re.match(r'^([\w#:]+)\((.*)\)$', expression, re.S)
+    if not match:
+        unknown[expression] = unknown.get(expression, 0) + 1
+        return '0'
+    function = match.group(1)
+    args = _SplitArguments(match.group(2))
+    if function in ('has', 'exists'):
+        return '1' if _Unquote(args[0]) in features else '0'
+    if function == 'bufwinnr':
+        window = _WindowOf(int(args[0]))
+        return str(window.number) if window else '-1'
+    if function == 'bufloaded':
+        buf = buffers.get(int(args[0]))
+        return '1' if buf and buf.loaded else '0'
+    if function == 'bufnr':
+        name = _Unquote(args[0]).replace("''", "'")
+        for number, buf in buffers.items():
+            if buf.name == name:
+                return str(number)
+        return '-1'
+    if function == 'win_getid':
+        return str(current.window.id)
+    if function == 'win_findbuf':
+        return [str(window.id) for tab in tabpages for window in tab.windows
+                if window.buffer.number == int(args[0])]
+    if function == 'len':
+        return str(len(_Eval(args[0])))
+    if function == 'getbufvar':
+        buf = buffers.get(int(args[0]))
+        name = _Unquote(args[1])
+        if not buf:
+            return ''
+        if name.startswith('&'):
+            value = buf.options.get({'ft': 'filetype'}.get(name[1:],
+                                                           name[1:]), '')
+            return value.decode('utf-8') if isinstance(value, bytes) \
+                else str(value)
+        return str(buf.vars.get(name, ''))
+    if function == 'timer_start':
+        timer_id = _next_timer[0]
+        _next_timer[0] += 1
+        # function('clangd#OnTimer', ['name'])
+        name = _SplitArguments(args[1][len('function('):-1])[1]
+        timers[timer_id] = [time.time() + int(args[0]) / 1000.0,
+                            _Unquote(name[1:-1])]
+        return str(timer_id)
+    if function == 'getmatches':
+        return []
+    if function == 'confirm':
+        return '1'
+    unknown[function] = unknown.get(function, 0) + 1
+    return '0'
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# Replays traces recorded with g:clangd#trace_dir against a server and
+# prints the latency of the requests, next to the latency they had when
+# they were recorded.
+#
+#   python bench/replay_trace.py TRACE [TRACE ...] [--speed X]
+#                                [--server CMD] [--timeout S]
+#
+# Rotated traces are replayed in the order given, e.g. clangd-42.trace.1
+# clangd-42.trace. Messages the client sent are sent again, at their
+# original pace scaled by --speed, 0 sends them as fast as possible.
+# Answers the client sent to requests of the server are not replayed, the
+# requests of the replay server are answered with null instead. Without
+# --server the trace is fed into bench/fake_clangd.py, CMD is e.g. the
+# clangd command line of the machine to compare with.
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'python'))
+from traffic_recorder import ReadTrace
+from fake_clangd import ReadBody
+
+# sent by the replay itself once the trace is done
+SKIPPED = ('shutdown', 'exit')
+
+
+def Percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def LoadTraces(paths):
+    """Returns [(time, message)] the client sent and method -> [recorded
+    latency in ms]."""
+    sent = []
+    recorded = {}
+    # request id -> (method, time)
+    requests = {}
+    for path in paths:
+        for direction, timestamp, body in ReadTrace(path):
+            msg = json.loads(body.decode('utf-8'))
+            if direction == '>':
+                if 'method' not in msg or msg['method'] in SKIPPED:
+                    continue
+                sent.append((timestamp, msg))
+                if 'id' in msg:
+                    requests[msg['id']] = (msg['method'], timestamp)
+            elif 'id' in msg and 'method' not in msg:
+                request = requests.pop(msg['id'], None)
+                if request:
+                    recorded.setdefault(request[0], []).append(
+                        (timestamp - request[1]) * 1000)
+    if not sent or sent[0][1]['method'] != 'initialize':
+        # recorded after the handshake, e.g. of a standby server
+        start = sent[0][0] if sent else 0
+        sent[:0] = [(start, {'jsonrpc': '2.0', 'id': 'replay-initialize',
+                             'method': 'initialize',
+                             'params': {'processId': os.getpid(),
+                                        'rootUri': 'file://' + os.getcwd(),
+                                        'capabilities': {}}}),
+                    (start, {'jsonrpc': '2.0', 'method': 'initialized',
+                             'params': {}})]
+    return sent, recorded
+
+
+class Replay(object):
+    def __init__(self, argv):
+        self._server = subprocess.Popen(argv, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+        self._lock = threading.Lock()
+        self._answered = threading.Condition(self._lock)
+        # request id -> (method, time sent)
+        self._pending = {}
+        # method -> [latency in ms]
+        self.latencies = {}
+        self.errors = 0
+        self.notifications = 0
+        self.server_requests = 0
+        self._reader = threading.Thread(target=self._ReadLoop)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def Send(self, msg):
+        with self._lock:
+            if 'id' in msg:
+                self._pending[msg['id']] = (msg['method'], time.time())
+            self._Write(msg)
+
+    def _Write(self, msg):
+        body = json.dumps(msg, separators=(',', ':')).encode('utf-8')
+        self._server.stdin.write(('Content-Length: %d\r\n\r\n' % len(body))
+                                 .encode('ascii') + body)
+        self._server.stdin.flush()
+
+    def Wait(self, timeout):
+        """Waits for the answers, returns how many did not come."""
+        deadline = time.time() + timeout
+        with self._lock:
+            while self._pending and time.time() < deadline:
+                self._answered.wait(max(0, deadline - time.time()))
+            return len(self._pending)
+
+    def Stop(self, timeout):
+        self.Send({'jsonrpc': '2.0', 'id': 'replay-shutdown',
+                   'method': 'shutdown'})
+        self.Wait(timeout)
+        try:
+            self._Write({'jsonrpc': '2.0', 'method': 'exit'})
+            self._server.stdin.close()
+        except (IOError, OSError):
+            pass
+        deadline = time.time() + timeout
+        while self._server.poll() is None and time.time() < deadline:
+            time.sleep(0.01)
+        if self._server.poll() is None:
+            self._server.kill()
+            self._server.wait()
+
+    def _ReadLoop(self):
+        while True:
+            body = ReadBody(self._server.stdout)
+            if body is None:
+                break
+            msg = json.loads(body.decode('utf-8'))
+            now = time.time()
+            with self._lock:
+                if 'method' not in msg:
+                    request = self._pending.pop(msg.get('id'), None)
+                    if request:
+                        self.latencies.setdefault(request[0], []).append(
+                            (now - request[1]) * 1000)
+                        if 'error' in msg:
+                            self.errors += 1
+                        self._answered.notify_all()
+                elif 'id' in msg:
+                    self.server_requests += 1
+                    self._Write({'jsonrpc': '2.0', 'id': msg['id'],
+                                 'result': None})
+                else:
+                    self.notifications += 1
+        with self._lock:
+            self._answered.notify_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('traces', nargs='+')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='pace relative to the recording, 0 for no '
+                        'pauses')
+    parser.add_argument('--server', help='server command line, the fake '
+                        'server by default')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='seconds to wait for outstanding answers')
+    args = parser.parse_args()
+
+    sent, recorded = LoadTraces(args.traces)
+    if args.server:
+        argv = shlex.split(args.server)
+    else:
+        argv = [sys.executable, os.path.join(HERE, 'fake_clangd.py')]
+    replay = Replay(argv)
+
+    start = time.time()
+    first = sent[0][0]
+    for timestamp, msg in sent:
+        if args.speed > 0:
+            delay = start + (timestamp - first) / args.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        replay.Send(msg)
+    missing = replay.Wait(args.timeout)
+    elapsed = time.time() - start
+    replay.Stop(min(args.timeout, 5))
+    replay.latencies.pop('shutdown', None)
+
+    print('%d messages sent in %.2fs (%.2fs recorded), %d notifications '
+          'and %d requests from the server, %d errors, %d unanswered' % (
+              len(sent), elapsed, sent[-1][0] - first, replay.notifications,
+              replay.server_requests, replay.errors, missing))
+    print('')
+    print('%-34s %6s %9s %9s %9s %9s %11s %11s' % (
+        'method', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+        'rec p50 ms', 'rec p99 ms'))
+    for method in sorted(replay.latencies,
+                         key=lambda m: -len(replay.latencies[m])):
+        samples = replay.latencies[method]
+        before = recorded.get(method, [])
+        print('%-34s %6d %9.2f %9.2f %9.2f %9.2f %11s %11s' % (
+            method[:34], len(samples), Percentile(samples, 0.5),
+            Percentile(samples, 0.9), Percentile(samples, 0.99),
+            max(samples),
+            '%.2f' % Percentile(before, 0.5) if before else '-',
+            '%.2f' % Percentile(before, 0.99) if before else '-'))
+
+
+if __name__ == '__main__':
+    main()
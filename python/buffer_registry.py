@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Index over the buffers the plugin has seen.
+#
+# Buffers are registered from autocmds (BufReadPost, BufFilePost, FileType,
+# BufWinEnter) and dropped on BufDelete/BufWipeout, so looking a buffer up
+# by number, path or uri is a dict access instead of a walk over
+# vim.buffers or every window of every tab.
+import os
+
+C_FAMILY_FILETYPES = frozenset(['c', 'cpp', 'objc', 'objcpp'])
+
+
+class BufferEntry(object):
+    __slots__ = ('bufnr', 'name', 'path', 'uri', 'filetypes', 'windows')
+
+    def __init__(self, bufnr, name, uri, filetypes):
+        self.bufnr = bufnr
+        # name as vim has it and with symlinks resolved
+        self.name = name
+        self.path = os.path.realpath(name) if name else name
+        self.uri = uri
+        self.filetypes = filetypes
+        # ids of the windows the buffer was last entered in
+        self.windows = set()
+
+    def isCFamily(self):
+        return any(filetype in C_FAMILY_FILETYPES
+                   for filetype in self.filetypes)
+
+
+def SplitFileTypes(filetype):
+    if isinstance(filetype, bytes) and not isinstance(filetype, str):
+        filetype = filetype.decode('utf-8')
+    return tuple(filetype.split('.')) if filetype else ()
+
+
+class BufferRegistry:
+    def __init__(self, uri_from_path):
+        self._uri_from_path = uri_from_path
+        self._by_number = {}
+        # both the vim name and the resolved path map to the entry
+        self._by_path = {}
+        self._by_uri = {}
+        # window id -> buffer number
+        self._windows = {}
+
+    def __len__(self):
+        return len(self._by_number)
+
+    def Register(self, bufnr, name, filetype):
+        """Adds or refreshes the buffer, a changed name or filetype replaces
+        what was known before."""
+        entry = self._by_number.get(bufnr)
+        filetypes = SplitFileTypes(filetype)
+        if entry and entry.name == name:
+            entry.filetypes = filetypes
+            return entry
+        windows = set()
+        if entry:
+            windows = entry.windows
+            self.Unregister(bufnr)
+        entry = BufferEntry(bufnr, name, self._uri_from_path(name) if name
+                            else None, filetypes)
+        entry.windows = windows
+        for window_id in windows:
+            self._windows[window_id] = bufnr
+        self._by_number[bufnr] = entry
+        if name:
+            self._by_path[name] = entry
+            self._by_path[entry.path] = entry
+            self._by_uri[entry.uri] = entry
+        return entry
+
+    def Unregister(self, bufnr):
+        entry = self._by_number.pop(bufnr, None)
+        if not entry:
+            return None
+        for key in (entry.name, entry.path):
+            if self._by_path.get(key) is entry:
+                del self._by_path[key]
+        if self._by_uri.get(entry.uri) is entry:
+            del self._by_uri[entry.uri]
+        for window_id in entry.windows:
+            if self._windows.get(window_id) == bufnr:
+                del self._windows[window_id]
+        return entry
+
+    def EnterWindow(self, window_id, bufnr):
+        previous = self._by_number.get(self._windows.get(window_id))
+        if previous:
+            previous.windows.discard(window_id)
+        entry = self._by_number.get(bufnr)
+        if entry:
+            entry.windows.add(window_id)
+            self._windows[window_id] = bufnr
+
+    def Entries(self):
+        return list(self._by_number.values())
+
+    def ByNumber(self, bufnr):
+        return self._by_number.get(bufnr)
+
+    def ByPath(self, file_name):
+        entry = self._by_path.get(file_name)
+        if entry is None and file_name:
+            # a symlink or a relative name of a known buffer
+            entry = self._by_path.get(os.path.realpath(file_name))
+        return entry
+
+    def ByUri(self, uri):
+        return self._by_uri.get(uri)
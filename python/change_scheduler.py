@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Coalesces buffer changes into at most one didChange per quiet period.
+#
+# TextChanged/TextChangedI only mark the buffer dirty. The buffer is sent
+# once no change happened for `delay_ms`, or earlier when a request needs
+# fresh state and flushes it explicitly.
+import glog as log
+from event_dispatcher import OneShotTimer
+
+from time import time
+
+
+class ChangeScheduler:
+    def __init__(self, flush_buffer, delay_ms, native_timer):
+        self._flush_buffer = flush_buffer
+        self._delay = delay_ms / 1000.0
+        # buffer number -> time of the last change
+        self._dirty = {}
+        self._timer = OneShotTimer('change', self.OnTimerCallback,
+                                   native_timer)
+        self.scheduled = 0
+        self.flushed = 0
+
+    def coalesced(self):
+        return self.scheduled - self.flushed
+
+    def isDirty(self, bufnr):
+        return bufnr in self._dirty
+
+    def MarkDirty(self, bufnr):
+        self.scheduled += 1
+        self._dirty[bufnr] = time()
+        if not self._timer.isArmed():
+            # fires once the quiet period of the first dirty buffer is over
+            self._timer.Start(self._delay * 1000)
+
+    def Discard(self, bufnr):
+        self._dirty.pop(bufnr, None)
+
+    def Flush(self, bufnr=None):
+        if bufnr is None:
+            numbers = list(self._dirty.keys())
+        elif bufnr in self._dirty:
+            numbers = [bufnr]
+        else:
+            return
+        for number in numbers:
+            del self._dirty[number]
+            self.flushed += 1
+            self._flush_buffer(number)
+        log.debug('flushed %d buffers, %d of %d changes coalesced' %
+                  (len(numbers), self.coalesced(), self.scheduled))
+
+    def OnTimerCallback(self):
+        now = time()
+        for bufnr, changed in list(self._dirty.items()):
+            if now - changed >= self._delay:
+                self.Flush(bufnr)
+        if self._dirty:
+            next_due = min(self._dirty.values()) + self._delay
+            self._timer.Start(max(next_due - now, 0) * 1000)
@@ -2,12 +2,34 @@
 
 import vimsupport, vim
 from signal import signal, SIGINT, SIG_IGN
-from lsp_client import LSPClient
+from buffer_registry import BufferRegistry
+from change_scheduler import ChangeScheduler
+from completion_cache import CompletionCache
+from diagnostic_index import DiagnosticIndex
+from diagnostics_renderer import DiagnosticsRenderer
+from diagnostics_scheduler import DiagnosticsScheduler
+from fuzzy_matcher import CandidateIndex
+from rpc_stats import RpcStats
+from server_handshake import ServerHandshake
+from server_pool import ServerPool
+from server_recovery import ServerRecovery
+from standby_server import StandbyServer
+import startup_report
+from lsp_client import LSPClient, Completion_REQUEST, ComputeContentChanges, DiffLines
+from lsp_client import PublishDiagnostics_NOTIFICATION
+from jsonrpc import RequestCancelledError
+from timeout import TimeoutError
 
 import glog as log
 import os
 from os.path import dirname, abspath, join, isfile
 from subprocess import check_output, CalledProcessError, Popen
+from time import time
+from traffic_recorder import TrafficRecorder
+
+
+# size of the completion popup
+MAX_COMPLETIONS = 20
 
 
 def GetUriFromFilePath(file_path):
@@ -18,6 +40,24 @@ def GetFilePathFromUri(uri):
     return uri[7:]
 
 
+def ParseCompletions(completions):
+    """Returns the CandidateIndex of a completion result and whether the
+    list is incomplete."""
+    incomplete = False
+    if isinstance(completions, dict):
+        # CompletionList
+        incomplete = completions.get('isIncomplete', False)
+        completions = completions.get('items', [])
+    return CandidateIndex(completions), incomplete
+
+
+def CachedCompletions(completions):
+    """Candidates of a completion result to narrow locally, None for an
+    incomplete list, which has to be asked for again as the user types."""
+    candidates, incomplete = ParseCompletions(completions)
+    return None if incomplete else candidates
+
+
 def CompletionItemKind(kind):
     ##export const Text = 1;
     if kind == 1:
@@ -79,100 +119,394 @@ def CompletionItemKind(kind):
 class ClangdManager():
     def __init__(self):
         signal(SIGINT, SIG_IGN)
-        self.lined_diagnostics = {}
         self.last_completions = {}
         self.state = {}
-        self._client = None
-        self._in_shutdown = False
+        # whether clangd should be running, servers start per project
+        self._started = False
+        self.in_shutdown = False
         self._documents = {}
-        autostart = bool(vim.eval('g:clangd#autostart'))
-        if autostart:
+        self._buffers = BufferRegistry(GetUriFromFilePath)
+        self._completion_cache = CompletionCache()
+        self._renderer = DiagnosticsRenderer()
+        # per method traffic statistics, None unless g:clangd#stats is set
+        self._stats = None
+        if vimsupport.GetBoolValue('g:clangd#stats'):
+            self._stats = RpcStats()
+        self._change_scheduler = ChangeScheduler(
+            self._FlushBuffer,
+            vimsupport.GetIntValue('g:clangd#change_delay'),
+            native_timer=vimsupport.GetBoolValue('has("timers")'))
+        self._diagnostics_scheduler = DiagnosticsScheduler(
+            self._PollServer, self._RenderBuffer,
+            vimsupport.GetIntValue('g:clangd#diagnostics_interval'),
+            native_timer=vimsupport.GetBoolValue('has("timers")'))
+        self._recovery = ServerRecovery(
+            self._RestartAfterCrash,
+            native_timer=vimsupport.GetBoolValue('has("timers")'))
+        self._pool = ServerPool(
+            vimsupport.GetIntValue('g:clangd#max_servers'))
+        self._handshake = ServerHandshake(
+            self.on_server_connected, self._HandshakeFailed,
+            native_timer=vimsupport.GetBoolValue('has("timers")'))
+        # roots of servers which went down and wait for a restart
+        self._down_roots = set()
+        self._standby = None
+        if vimsupport.GetBoolValue('g:clangd#standby'):
+            self._standby = StandbyServer(
+                self._SpawnClient, self._ServerPid,
+                vimsupport.GetIntValue('g:clangd#standby_memory_limit'),
+                native_timer=vimsupport.GetBoolValue('has("timers")'))
+        if vimsupport.GetBoolValue('g:clangd#autostart'):
             self.startServer(confirmed=True)
 
     def isAlive(self):
-        return self._client and self._client.isAlive()
+        return self._started and any(client.isAlive()
+                                     for client in self._pool.Clients())
 
-    def startServer(self, confirmed=False):
-        if self._client:
+    def startServer(self, confirmed=False, recovering=False):
+        if not recovering:
+            # started by hand, earlier crashes no longer count
+            self._recovery.Reset()
+        root = self._CurrentRoot()
+        if self._started and self._pool.Get(root):
             vimsupport.EchoMessage(
                 'clangd is connected, please stop it first!')
             return
         if confirmed or vimsupport.PresentYesOrNoDialog(
                 'Should we start clangd?'):
-            clangd_executable = str(vim.eval('g:clangd#clangd_executable'))
-            clangd_executable = os.path.expanduser(clangd_executable)
-            clangd_log_path = os.path.expanduser(
-                vim.eval('g:clangd#log_path') + '/clangd.log')
-            try:
-                self._client = LSPClient(clangd_executable, clangd_log_path, self)
-            except:
-                log.exception('failed to start clangd')
-                vimsupport.EchoMessage('failed to start clangd executable')
+            self._started = True
+            self._StartServerFor(root)
+
+    def _CurrentRoot(self):
+        file_name = vimsupport.CurrentBufferFileName()
+        if file_name:
+            return self._pool.RootFor(file_name)
+        return self._pool.RootForDirectory(os.getcwd())
+
+    def _ClientFor(self, file_name, start=True):
+        """The server of the project of file_name, with start it is
+        started if there is none."""
+        if not self._started:
+            return None
+        root = self._pool.RootFor(file_name)
+        client = self._pool.Get(root)
+        if client and self._handshake.isPending(client):
+            # its documents are opened once it is connected
+            return None
+        if client or not start or root in self._down_roots:
+            return client
+        return self._StartServerFor(root)
+
+    def _DocumentClient(self, uri):
+        document = self._documents.get(uri)
+        if not document:
+            return None
+        return self._pool.Get(document['root'])
+
+    def _StartServerFor(self, root):
+        self._MakeRoom()
+        if self._standby:
+            # refilled after the old one is replaced or when it is
+            # missing, either way in the background
+            self._standby.Refill(root)
+            client = self._standby.Take(root)
+            if client:
+                client.setManager(self)
+                self._SetUpClient(root, client)
+                self.on_server_connected(client)
+                return client
+        try:
+            startup_report.Start('spawn')
+            client = self._SpawnClient(self, root)
+            startup_report.Finish('spawn')
+        except:
+            log.exception('failed to start clangd')
+            vimsupport.EchoMessage('failed to start clangd executable')
+            return None
+        self._SetUpClient(root, client)
+        try:
+            # on_server_connected is called by the handshake
+            startup_report.Start('handshake')
+            self._handshake.Start(client)
+        except:
+            self._handshake.Forget(client)
+            self._HandshakeFailed(client)
+            return None
+        return client
+
+    def _HandshakeFailed(self, client):
+        log.exception('failed to initialize clangd')
+        vimsupport.EchoMessage('failed to initialize clangd')
+        # unless it went down and was cleaned up already
+        root = self._pool.RootOf(client)
+        if root is not None:
+            self._pool.Remove(root)
+            client.CleanUp()
+
+    def _SpawnClient(self, observer, root):
+        clangd_executable = str(
+            vimsupport.GetVariableValue('g:clangd#clangd_executable'))
+        clangd_executable = os.path.expanduser(clangd_executable)
+        clangd_log_path = os.path.expanduser(
+            vimsupport.GetVariableValue('g:clangd#log_path') +
+            '/clangd.log')
+        use_job = (vimsupport.GetBoolValue('g:clangd#use_job') and
+                   vimsupport.HasFeature("has('job') && has('channel')"))
+        return LSPClient(clangd_executable, clangd_log_path, observer,
+                         use_job=use_job, root=root)
+
+    def _SetUpClient(self, root, client):
+        self._pool.Add(root, client)
+        client.setStats(self._stats)
+        client.setRecorder(self._MakeRecorder(client))
+        self._diagnostics_scheduler.SetPushDriven(
+            client.channelId() is not None)
+        client.setRequestTimeout(
+            Completion_REQUEST,
+            vimsupport.GetIntValue('g:clangd#completion_timeout'))
+
+    def _MakeRecorder(self, client):
+        """A recorder of the traffic of client if g:clangd#trace_dir is
+        set, None otherwise."""
+        trace_dir = vimsupport.GetVariableValue('g:clangd#trace_dir')
+        if not trace_dir:
+            return None
+        trace_dir = os.path.expanduser(str(trace_dir))
+        try:
+            if not os.path.exists(trace_dir):
+                os.makedirs(trace_dir)
+        except OSError:
+            log.exception('failed to create %s' % trace_dir)
+            return None
+        path = join(trace_dir, 'clangd-%d.trace' % client.pid())
+        log.info('recording clangd traffic to %s' % path)
+        return TrafficRecorder(
+            path, vimsupport.GetIntValue('g:clangd#trace_max_size') *
+            1024 * 1024)
+
+    def _ServerPid(self, root):
+        # checking the memory of a server is no use of it
+        client = self._pool.Peek(root)
+        return client.pid() if client else None
+
+    def _MakeRoom(self):
+        """Stops the least recently used servers with none of their
+        buffers in a window until another one fits."""
+        if not self._pool.isFull():
+            return
+        for root in self._pool.Roots():
+            if not self._IsIdle(root):
+                continue
+            log.info('stop idle clangd of %s' % root)
+            self._StopServerFor(root)
+            if not self._pool.isFull():
                 return
-            self._client.initialize()
+        log.warn('%d clangd running, none of them idle' % len(self._pool))
+
+    def _IsIdle(self, root):
+        numbers = []
+        for uri, document in self._documents.items():
+            entry = self._buffers.ByUri(uri)
+            if entry and document['root'] == root:
+                numbers.append(entry.bufnr)
+        if not numbers:
+            return True
+        if vimsupport.HasFeature("exists('*win_findbuf')"):
+            # windows of all tab pages
+            expression = 'len(win_findbuf(%d))'
+        else:
+            expression = 'bufwinnr(%d) + 1'
+        windows = vimsupport.EvalMany([expression % bufnr
+                                       for bufnr in numbers])
+        return all(int(count) == 0 for count in windows)
+
+    def _ForgetDocuments(self, root):
+        for uri in [uri for uri, document in self._documents.items()
+                    if document['root'] == root]:
+            del self._documents[uri]
+            self._completion_cache.Invalidate(uri)
+            entry = self._buffers.ByUri(uri)
+            if entry:
+                self._diagnostics_scheduler.Forget(entry.bufnr)
+                self._renderer.ClearBuffer(entry.bufnr)
 
     def stopServer(self, confirmed=False):
         if confirmed or vimsupport.PresentYesOrNoDialog(
                 'Should we stop clangd?'):
-            try:
-                client = self._client
-                self._client = None
-                client.shutdown()
-                client.exit()
-            except:
-                log.exception('failed to stop clangd')
-                return
+            self._started = False
+            self._down_roots.clear()
+            self._recovery.Reset()
+            if self._standby:
+                self._standby.Stop()
+            for root in self._pool.Roots():
+                self._StopServerFor(root)
+
+    def _StopServerFor(self, root):
+        client = self._pool.Remove(root)
+        self._ForgetDocuments(root)
+        if not client:
+            return
+        if self._handshake.isPending(client):
+            # shutdown is not allowed before initialize was answered
+            self._handshake.Forget(client)
+            client.CleanUp()
+            return
+        try:
+            client.shutdown()
+            client.exit()
+        except:
+            log.exception('failed to stop clangd')
 
     def restartServer(self):
         log.info('restart clangd')
-        self.stopServer(confirmed=True)
-        self.startServer(confirmed=True)
+        roots = self._pool.Roots() or [self._CurrentRoot()]
+        self._recovery.Reset()
+        self._down_roots.clear()
+        self._started = True
+        # a standby survives, the restart switches to it
+        for root in roots:
+            self._StopServerFor(root)
+        for root in roots:
+            self._StartServerFor(root)
 
-    def on_server_connected(self):
-        log.info('clangd up')
-        self._client.onInitialized()
+    def on_server_connected(self, client):
+        root = self._pool.RootOf(client)
+        log.info('clangd up for %s' % root)
+        startup_report.Finish('handshake')
+        client.onInitialized()
         # wipe all exist documents
-        self._documents = {}
+        self._ForgetDocuments(root)
+        self._completion_cache.Invalidate()
+        startup_report.Start('open')
+        self._recovery.Recovered(self._ReopenBuffers(root))
+        startup_report.Finish('open')
+        log.info(startup_report.Summary())
 
-    def on_server_down(self):
-        log.warn('clangd down unexceptedly')
+    def on_server_down(self, client):
+        self._handshake.Forget(client)
+        root = self._pool.RootOf(client)
+        if root is None or client.isAlive():
+            # stopped on purpose, or an old server after a restart
+            return
+        log.warn('clangd down unexceptedly for %s' % root)
+        self._pool.Remove(root)
+        self._ForgetDocuments(root)
+        try:
+            client.CleanUp()
+        except:
+            log.exception('failed to clean up after clangd')
 
-        self.lined_diagnostics = {}
-        vimsupport.ClearClangdSyntaxMatches()
-        vimsupport.UnplaceAllSigns()
+        if self.in_shutdown or not self._started:
+            return
+        self._down_roots.add(root)
+        if not self._recovery.ServerDown():
+            vimsupport.EchoMessage(
+                'clangd keeps crashing, start it again with '
+                ':ClangdStartServer')
+
+    def _RestartAfterCrash(self):
+        if self.in_shutdown or not self._started:
+            return
+        roots = self._down_roots
+        self._down_roots = set()
+        for root in roots:
+            if self._pool.Get(root) or self._StartServerFor(root):
+                continue
+            self._down_roots.add(root)
+        if self._down_roots and not self._recovery.isPending():
+            self._recovery.ServerDown()
 
-        if not self._in_shutdown:
-            self.restartServer()
+    def _ReopenBuffers(self, root):
+        """Sends didOpen for the loaded C-family buffers of the project,
+        the ones shown in a window first. Returns how many were opened."""
+        entries = [entry for entry in self._buffers.Entries()
+                   if entry.name and entry.isCFamily() and
+                   self._pool.RootFor(entry.path) == root]
+        if not entries:
+            return 0
+        states = vimsupport.EvalMany(
+            ['[bufloaded(%d), bufwinnr(%d)]' % (entry.bufnr, entry.bufnr)
+             for entry in entries])
+        reopen = sorted(
+            (int(winnr) < 0, entry.bufnr)
+            for entry, (loaded, winnr) in zip(entries, states)
+            if int(loaded))
+        opened = 0
+        for _, bufnr in reopen:
+            try:
+                self.didOpenFile(vim.buffers[bufnr])
+                opened += 1
+            except:
+                log.exception('failed to reopen buffer %d' % bufnr)
+        return opened
 
     def on_bad_message_received(self, wc, message):
         log.info('observer: bad message')
 
-    def FilterFileName(self, file_name):
-        log.info('filter file %s' % file_name)
-        for buf in vim.buffers:
-            if buf.name == file_name:
-                if buf.options['filetype'] in ['c', 'cpp', 'objc', 'objcpp']:
-                    return False
-                return True
-        return True
+    def _ClientForChannel(self, channel_id):
+        for client in self._pool.Clients():
+            if client.channelId() == channel_id:
+                return client
+        if self._standby:
+            return self._standby.ClientForChannel(channel_id)
+        return None
 
-    def FilterCurrentFile(self):
-        file_types = vimsupport.CurrentFileTypes()
-        if not file_types:
-            return True
-        for file_type in file_types:
-            if file_type in ['c', 'cpp', 'objc', 'objcpp']:
-                return False
-        return True
+    def OnServerOutput(self, channel_id, data):
+        client = self._ClientForChannel(channel_id)
+        if not client:
+            return
+        try:
+            # publishDiagnostics is rendered from onDiagnostics
+            client.feedOutput(data)
+            self._handshake.Check()
+        except:
+            log.exception('failed to handle clangd output')
+
+    def OnServerExit(self, channel_id, status):
+        client = self._ClientForChannel(channel_id)
+        if client:
+            client.onJobExit(status)
+
+    def RegisterBuffer(self, bufnr):
+        try:
+            buf = vim.buffers[bufnr]
+        except KeyError:
+            self._buffers.Unregister(bufnr)
+            return None
+        return self._buffers.Register(bufnr, buf.name,
+                                      buf.options['filetype'])
+
+    def UnregisterBuffer(self, bufnr):
+        entry = self._buffers.ByNumber(bufnr)
+        if entry and entry.name and entry.isCFamily():
+            self.CloseFile(entry.name)
+        self._buffers.Unregister(bufnr)
+
+    def EnterWindow(self, bufnr):
+        if not self._buffers.ByNumber(bufnr):
+            self.RegisterBuffer(bufnr)
+        self._buffers.EnterWindow(vimsupport.CurrentWindowId(), bufnr)
+
+    def _LookupBuffer(self, file_name):
+        entry = self._buffers.ByPath(file_name)
+        if entry:
+            return entry
+        # not seen by an autocmd yet, e.g. loaded before the plugin
+        bufnr = vimsupport.GetBufferNumberForFilename(file_name, False)
+        if bufnr < 0:
+            return None
+        return self.RegisterBuffer(bufnr)
 
     def OpenFile(self, file_name):
         if not self.isAlive():
             return True
 
-        uri = GetUriFromFilePath(file_name)
+        entry = self._LookupBuffer(file_name)
+        if not entry:
+            log.info('no buffer for %s' % file_name)
+            return False
         try:
-            buf = vimsupport.GetBufferByName(file_name)
-            self.didOpenFile(buf)
+            self.didOpenFile(vim.buffers[entry.bufnr])
         except:
             log.exception('failed to open %s' % file_name)
             vimsupport.EchoTruncatedText('unable to open %s' % file_name)
@@ -193,8 +527,14 @@ class ClangdManager():
             return True
 
         uri = GetUriFromFilePath(file_name)
+        entry = self._LookupBuffer(file_name)
+        if entry:
+            self.FlushPendingChanges(entry.bufnr)
+        client = self._DocumentClient(uri)
+        if not client:
+            return True
         try:
-            self._client.didSaveTestDocument(uri)
+            client.didSaveTestDocument(uri)
         except:
             log.exception('unable to save %s' % file_name)
             return False
@@ -212,11 +552,20 @@ class ClangdManager():
             return True
 
         uri = GetUriFromFilePath(file_name)
+        entry = self._buffers.ByPath(file_name)
+        if entry:
+            self._change_scheduler.Discard(entry.bufnr)
+            self._diagnostics_scheduler.Forget(entry.bufnr)
+            self._renderer.ClearBuffer(entry.bufnr)
+        self._completion_cache.Invalidate(uri)
+        client = self._DocumentClient(uri)
         if not uri in self._documents:
             return
         version = self._documents.pop(uri)['version']
+        if not client:
+            return True
         try:
-            self._client.didCloseTestDocument(uri)
+            client.didCloseTestDocument(uri)
         except:
             log.exception('failed to close file %s' % file_name)
             return False
@@ -229,11 +578,46 @@ class ClangdManager():
             return True
         return self.CloseFile(file_name)
 
-    def onDiagnostics(self, uri, diagnostics):
+    def onDiagnostics(self, uri, diagnostics, version=None):
         if uri not in self._documents:
             return
         log.info('diagnostics for %s is updated' % uri)
-        self._documents[uri]['diagnostics'] = diagnostics
+        startup_report.Finish('diagnostics')
+        document = self._documents[uri]
+        document['diagnostics'] = diagnostics
+        document['diagnostics_version'] = version
+        # converted lazily, once per publishDiagnostics
+        document.pop('diagnostic_index', None)
+        entry = self._buffers.ByUri(uri)
+        if not entry:
+            return
+        if not vimsupport.IsBufferVisible(entry.bufnr):
+            # rendered when a window shows the buffer, no change waits for
+            # these any more though
+            self._diagnostics_scheduler.DiagnosticsReceived(entry.bufnr,
+                                                            version)
+            return
+        if self._diagnostics_scheduler.DiagnosticsArrived(entry.bufnr,
+                                                          version):
+            self._RenderBuffer(entry.bufnr)
+
+    def _GetDiagnosticIndex(self, file_name):
+        document = self._documents.get(GetUriFromFilePath(file_name))
+        if not document or not 'diagnostics' in document:
+            return None
+        if not 'diagnostic_index' in document:
+            entry = self._LookupBuffer(file_name)
+            document['diagnostic_index'] = DiagnosticIndex(
+                vimsupport.ConvertDiagnosticsToQfList(
+                    file_name, document['diagnostics'],
+                    entry.bufnr if entry else None))
+        return document['diagnostic_index']
+
+    def CurrentDiagnosticIndex(self):
+        file_name = vimsupport.CurrentBufferFileName()
+        if not file_name:
+            return None
+        return self._GetDiagnosticIndex(file_name)
 
     def GetDiagnostics(self, buf):
         if not self.isAlive():
@@ -244,60 +628,123 @@ class ClangdManager():
         needReopen = False
         if not self.OpenFile(file_name):
             return []
+        self.FlushPendingChanges(buf.number)
+        client = self._DocumentClient(uri)
+        if not client:
+            return []
         try:
-            self._client.handleClientRequests()
+            client.handleClientRequests()
         except:
             log.exception('failed to get diagnostics %s' % file_name)
             return []
-        if not uri in self._documents or not 'diagnostics' in self._documents[uri]:
+        index = self._GetDiagnosticIndex(file_name)
+        if not index:
             return []
-        response = self._documents[uri]['diagnostics']
-        return vimsupport.ConvertDiagnosticsToQfList(file_name, response)
+        return index.diagnostics()
 
     def GetDiagnosticsForCurrentFile(self):
         if not self.isAlive():
             return []
 
-        lined_diagnostics = {}
-        diagnostics = self.GetDiagnostics(vimsupport.CurrentBuffer())
-        for diagnostic in diagnostics:
-            if not diagnostic['lnum'] in lined_diagnostics:
-                lined_diagnostics[diagnostic['lnum']] = []
-            lined_diagnostics[diagnostic['lnum']].append(diagnostic)
-
-        # if we hit the cache, simple ignore
-        if lined_diagnostics == self.lined_diagnostics:
-            return diagnostics
-        # clean up current diagnostics
-        self.lined_diagnostics = lined_diagnostics
-        vimsupport.ClearClangdSyntaxMatches()
-        vimsupport.UnplaceAllSigns()
-
-        for diagnostic in diagnostics:
-            vimsupport.AddDiagnosticSyntaxMatch(
-                diagnostic['lnum'],
-                diagnostic['col'],
-                is_error=diagnostic['severity'] >= 3)
-
-        vimsupport.PlaceSignForErrorMessageArray(self.lined_diagnostics)
+        buf = vimsupport.CurrentBuffer()
+        diagnostics = self.GetDiagnostics(buf)
+
+        # only what changed since the last refresh reaches vim
+        self._renderer.Render(buf.number, diagnostics)
+        self._DiagnosticsRendered(buf.number, buf.name)
         return diagnostics
 
-    def NearestDiagnostic(self, line, column):
-        if len(self.lined_diagnostics[line]) == 1:
-            return self.lined_diagnostics[line][0]
+    def RenderCurrentDiagnostics(self):
+        if not self.isAlive():
+            return
+        self._RenderBuffer(vimsupport.CurrentBuffer().number)
+
+    def _RenderBuffer(self, bufnr):
+        entry = self._buffers.ByNumber(bufnr)
+        if not entry or not entry.name or entry.uri not in self._documents:
+            return
+        if self._stats is not None:
+            start = time()
+        index = self._GetDiagnosticIndex(entry.name)
+        diagnostics = index.diagnostics() if index else []
+        if bufnr == vimsupport.CurrentBuffer().number:
+            self._renderer.Render(bufnr, diagnostics)
+        else:
+            # matches are added when one of its windows is entered
+            self._renderer.RenderSigns(bufnr, diagnostics)
+        self._DiagnosticsRendered(bufnr, entry.name)
+        if self._stats is not None:
+            self._stats.Rendered(PublishDiagnostics_NOTIFICATION,
+                                 (time() - start) * 1000)
+
+    def _DiagnosticsRendered(self, bufnr, file_name):
+        document = self._documents.get(GetUriFromFilePath(file_name))
+        if document and 'diagnostics' in document:
+            self._diagnostics_scheduler.Rendered(
+                bufnr, document.get('diagnostics_version'))
 
-        sorted_diagnostics = sorted(
-            self.lined_diagnostics[line],
-            key=lambda diagnostic: abs(diagnostic['col'] - column))
-        return sorted_diagnostics[0]
+    def _PollServer(self):
+        for client in self._pool.Clients():
+            # also notices a server that went down
+            client.handleClientRequests()
+        self._handshake.Check()
+
+    def GetDiagnosticLatencyStats(self):
+        return self._diagnostics_scheduler.LatencyStats()
+
+    def DiagnosticLatencySummary(self):
+        stats = self.GetDiagnosticLatencyStats()
+        if not stats['count']:
+            return 'diagnostics after an edit: none yet'
+        return ('diagnostics after an edit: %(count)d, last %(last).0fms, '
+                'mean %(mean).0fms, p50 %(p50).0fms, p90 %(p90).0fms, '
+                'max %(max).0fms' % stats)
+
+    def EchoStartupReport(self):
+        vimsupport.EchoText(startup_report.Summary())
+
+    def EchoStats(self):
+        lines = [self.ChangeStatsSummary(), self.DiagnosticLatencySummary()]
+        if self._stats is None:
+            lines.append('no rpc statistics, let g:clangd#stats = 1 '
+                         'to record them')
+        else:
+            lines.append(self._stats.Report())
+        vimsupport.EchoText('\n'.join(lines))
+
+    def DumpStats(self, path):
+        if self._stats is None:
+            vimsupport.EchoMessage('no statistics, let g:clangd#stats = 1 '
+                                   'to record them')
+            return
+        path = os.path.expanduser(path)
+        try:
+            self._stats.Dump(path, {
+                'changes': self.GetChangeStats(),
+                'diagnostics': self.GetDiagnosticLatencyStats()
+            })
+        except (IOError, OSError) as e:
+            vimsupport.EchoMessage('failed to write %s: %s' % (path, e))
+            return
+        vimsupport.EchoMessage('clangd statistics written to %s' % path)
+
+    def NearestDiagnostic(self, line, column):
+        index = self.CurrentDiagnosticIndex()
+        if not index:
+            return None
+        return index.Nearest(line, column)
 
     def ErrorStatusForCurrentLine(self):
         if not self.isAlive():
             return ''
-        current_line, current_column = vimsupport.CurrentLineAndColumn()
-        if not current_line in self.lined_diagnostics:
+        index = self.CurrentDiagnosticIndex()
+        if not index:
+            return ''
+        current_line, _ = vimsupport.CurrentLineAndColumn()
+        # the flag is about the line, not the diagnostic under the cursor
+        severity = index.WorstSeverity(current_line)
+        if severity is None:
             return ''
-        diagnostic = self.NearestDiagnostic(current_line, current_column)
         serverity_strings = [
             'ignored',
             'note',
@@ -305,41 +752,80 @@ class ClangdManager():
             'error',
             'fatal',
         ]
-        return serverity_strings[int(diagnostic['severity'])]
+        return serverity_strings[int(severity)]
 
     def EchoErrorMessageForCurrentLine(self):
         vimsupport.EchoText('')
         if not self.isAlive():
             return
         current_line, current_column = vimsupport.CurrentLineAndColumn()
-        if not current_line in self.lined_diagnostics:
-            return ''
         diagnostic = self.NearestDiagnostic(current_line, current_column)
+        if not diagnostic:
+            return ''
         vimsupport.EchoTruncatedText(diagnostic['text'])
 
     def EchoDetailedErrorMessage(self):
         if not self.isAlive():
             return
         current_line, _ = vimsupport.CurrentLineAndColumn()
-        if not current_line in self.lined_diagnostics:
+        index = self.CurrentDiagnosticIndex()
+        if not index or not index.HasLine(current_line):
             return
         full_text = ''
-        for diagnostic in self.lined_diagnostics[current_line]:
+        for diagnostic in index.OnLine(current_line):
             full_text += 'L%d:C%d %s\n' % (diagnostic['lnum'],
                                            diagnostic['col'],
                                            diagnostic['text'])
         vimsupport.EchoText(full_text[:-1])
 
+    def GotoNextDiagnostic(self):
+        self._GotoDiagnostic(forward=True)
+
+    def GotoPreviousDiagnostic(self):
+        self._GotoDiagnostic(forward=False)
+
+    def _GotoDiagnostic(self, forward):
+        if not self.isAlive():
+            return
+        index = self.CurrentDiagnosticIndex()
+        if not index:
+            vimsupport.EchoText('No warnings or errors detected')
+            return
+        line, column = vimsupport.CurrentLineAndColumn()
+        if forward:
+            diagnostic = index.Next(line, column)
+        else:
+            diagnostic = index.Previous(line, column)
+        if not diagnostic:
+            vimsupport.EchoText('No warnings or errors detected')
+            return
+        # columns are compared the way they are highlighted
+        vimsupport.GotoBuffer(vimsupport.CurrentBufferFileName(),
+                              diagnostic['lnum'], max(diagnostic['col'], 1))
+        vimsupport.EchoTruncatedText(diagnostic['text'])
+
     def didOpenFile(self, buf):
         file_name = buf.name
         uri = GetUriFromFilePath(buf.name)
         if uri in self._documents:
             return
+        client = self._ClientFor(file_name)
+        if not client:
+            # its server is not running, e.g. waits for a restart
+            return
+        if uri in self._documents:
+            # opened by the server start
+            return
         file_type = buf.options['filetype'].decode('utf-8')
-        text = vimsupport.ExtractUTF8Text(buf)
+        lines = vimsupport.ExtractUTF8Lines(buf)
         self._documents[uri] = {}
         self._documents[uri]['version'] = 1
-        self._client.didOpenTestDocument(uri, text, file_type)
+        self._documents[uri]['root'] = self._pool.RootOf(client)
+        # snapshot the server has, incremental changes are diffed against it
+        self._documents[uri]['lines'] = lines
+        startup_report.Start('diagnostics')
+        client.didOpenTestDocument(uri, '\n'.join(lines), file_type)
+        self._diagnostics_scheduler.ChangeSent(buf.number, 1)
         log.info('file %s opened' % file_name)
 
     def didChangeFile(self, buf):
@@ -349,10 +835,28 @@ class ClangdManager():
             # not sure why this happens
             self.didOpenFile(buf)
             return
-        version = self._documents[uri][
-            'version'] = self._documents[uri]['version'] + 1
-        textbody = vimsupport.ExtractUTF8Text(buf)
-        self._client.didChangeTestDocument(uri, version, textbody)
+        document = self._documents[uri]
+        client = self._pool.Get(document['root'])
+        if not client:
+            return
+        lines = vimsupport.ExtractUTF8Lines(buf)
+        diff = DiffLines(document['lines'], lines)
+        if diff is None:
+            return
+        if client.supportsIncrementalSync():
+            changes = ComputeContentChanges(document['lines'], lines, diff)
+            textbody = None
+        else:
+            changes = None
+            textbody = '\n'.join(lines)
+        version = document['version'] = document['version'] + 1
+        prefix, suffix = diff
+        self._completion_cache.OnDocumentChanged(
+            uri, version, prefix, len(document['lines']) - suffix,
+            len(lines) - suffix)
+        document['lines'] = lines
+        client.didChangeTestDocument(uri, version, textbody, changes)
+        self._diagnostics_scheduler.ChangeSent(buf.number, version)
 
     def UpdateSpecifiedBuffer(self, buf):
         if not self.isAlive():
@@ -375,6 +879,63 @@ class ClangdManager():
             log.exception('failed to update curent buffer')
             vimsupport.EchoTruncatedText('unable to update curent buffer')
 
+    def ScheduleUpdateCurrentBuffer(self):
+        if not self.isAlive():
+            return
+        bufnr = vimsupport.CurrentBuffer().number
+        self._change_scheduler.MarkDirty(bufnr)
+        self._diagnostics_scheduler.EditMade(bufnr)
+
+    def FlushPendingChanges(self, bufnr=None):
+        self._change_scheduler.Flush(bufnr)
+
+    def _ChangedOffLine(self, uri, buf, line):
+        """Returns whether the buffer has changes not sent yet outside of
+        the 0-based line."""
+        if not self._change_scheduler.isDirty(buf.number):
+            return False
+        document = self._documents.get(uri)
+        if not document:
+            return True
+        sent = document['lines']
+        lines = vimsupport.ExtractUTF8Lines(buf)
+        diff = DiffLines(sent, lines)
+        if diff is None:
+            return False
+        prefix, suffix = diff
+        return (len(sent) != len(lines) or prefix < line or
+                len(lines) - suffix > line + 1)
+
+    def StopSchedulers(self):
+        self._diagnostics_scheduler.Stop()
+        self._handshake.Stop()
+        self._recovery.Stop()
+        if self._standby:
+            self._standby.Stop()
+
+    def GetChangeStats(self):
+        return {
+            'scheduled': self._change_scheduler.scheduled,
+            'sent': self._change_scheduler.flushed,
+            'coalesced': self._change_scheduler.coalesced()
+        }
+
+    def ChangeStatsSummary(self):
+        return ('didChange: %(scheduled)d edits, %(sent)d sent, '
+                '%(coalesced)d coalesced' % self.GetChangeStats())
+
+    def _FlushBuffer(self, bufnr):
+        if not self.isAlive():
+            return
+        try:
+            buf = vim.buffers[bufnr]
+        except KeyError:
+            return
+        try:
+            self.UpdateSpecifiedBuffer(buf)
+        except:
+            log.exception('failed to update buffer %d' % bufnr)
+
 
     def CalculateStartColumn(self):
         current_line = vimsupport.CurrentLine()
@@ -398,23 +959,56 @@ class ClangdManager():
         self.last_completions = {}
         start_column, word = self.CalculateStartColumn()
         uri = GetUriFromFilePath(vimsupport.CurrentBufferFileName())
-        try:
-            completions = self._client.completeAt(uri, line - 1, column - 1)
-        except:
-            log.exception('failed to code complete at %d:%d' % (line, column))
+        current_line = vimsupport.CurrentLine()
+        buf = vimsupport.CurrentBuffer()
+        # a hit is narrowed locally, what was typed on the current line
+        # since the last change sent can wait for the change timer
+        version = self._documents.get(uri, {}).get('version')
+        candidates = self._completion_cache.Lookup(
+            uri, version, line - 1, start_column, current_line, word)
+        if candidates is not None and self._ChangedOffLine(uri, buf,
+                                                           line - 1):
+            # edits elsewhere may change what is in scope here
+            candidates = None
+        if candidates is None:
+            # the server needs to see what was typed so far
+            self.FlushPendingChanges(buf.number)
+            version = self._documents.get(uri, {}).get('version')
+        client = self._DocumentClient(uri)
+        if candidates is None and not client:
             return -2
+        if candidates is None:
+            future = None
+            try:
+                future = client.completeAtAsync(uri, line - 1, column - 1)
+                completions = client.waitRequest(future)
+            except TimeoutError:
+                log.info('code complete at %d:%d timed out' % (line, column))
+                if future is not None:
+                    # clangd may still answer, typing on serves the late
+                    # answer unless a newer completion here cancels it
+                    self._completion_cache.StorePending(
+                        uri, version, line - 1, start_column, current_line,
+                        word, future, CachedCompletions)
+                return -2
+            except RequestCancelledError:
+                log.info('code complete at %d:%d cancelled' % (line, column))
+                return -2
+            except:
+                log.exception('failed to code complete at %d:%d' % (line, column))
+                return -2
+            candidates, incomplete = ParseCompletions(completions)
+            # an incomplete list has to be asked for again as the user types
+            if not incomplete:
+                self._completion_cache.Store(uri, version, line - 1,
+                                             start_column, current_line, word,
+                                             candidates)
+        if self._stats is not None:
+            start = time()
         words = []
-        total_cnt = len(completions)
-        if word == '':
-            completions = sorted(
-                completions, key=lambda completion: completion['kind'] if 'kind' in completion else 1)
-            completions = completions[0:20]
-        else:
-            log.info('start column %d, start prefix %s' % (start_column, word))
-            completions = list(
-                filter(lambda completion: completion['label'].startswith(word),
-                       completions))
-        log.info('%d completions in total, reduced to %d' % (total_cnt, len(completions)))
+        log.info('start column %d, start prefix %s' % (start_column, word))
+        completions = candidates.Rank(word, limit=MAX_COMPLETIONS)
+        log.info('%d completions in total, reduced to %d' % (len(candidates), len(completions)))
         for completion in completions:
             if not 'kind' in completion:
                 completion['kind'] = 1
@@ -428,6 +1022,8 @@ class ClangdManager():
                 'dup': 1 # allow duplicates
             })
         self.last_completions = words
+        if self._stats is not None:
+            self._stats.Rendered(Completion_REQUEST, (time() - start) * 1000)
         return start_column + 1
 
     def GetCompletions(self):
@@ -436,8 +1032,8 @@ class ClangdManager():
         _, column = vimsupport.CurrentLineAndColumn()
         words = self.last_completions
         size = len(words)
-        if size > 20:
-            size = 20
+        if size > MAX_COMPLETIONS:
+            size = MAX_COMPLETIONS
         return {'words': words[0:size], 'refresh': 'always'}
 
     def GotoDefinition(self):
@@ -459,7 +1055,12 @@ class ClangdManager():
         file_name = location.file_name
         line = location.line
         column = location.column
-        vimsupport.GotoBuffer(file_name, line, column)
+        entry = self._LookupBuffer(file_name)
+        if entry:
+            vimsupport.GotoBuffer(file_name, line, column, entry.bufnr,
+                                  entry.windows)
+        else:
+            vimsupport.GotoBuffer(file_name, line, column)
 
     def ShowCursorDetail(self):
         if not self.isAlive():
@@ -488,6 +1089,8 @@ class ClangdManager():
             return
         try:
             for uri in list(self._documents.keys()):
-                self._client.didCloseTestDocument(uri)
+                client = self._DocumentClient(uri)
+                if client:
+                    client.didCloseTestDocument(uri)
         except:
             log.exception('failed to close all files')
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Completion session cache.
+#
+# A textDocument/completion result for the identifier starting at
+# start_column stays valid while the user only types more characters of
+# that identifier, so it is kept and narrowed locally instead of asking
+# clangd again on every CursorMovedI. A request that timed out is kept too,
+# if clangd answers late the answer is used like any other.
+import glog as log
+
+
+class CompletionSession:
+    def __init__(self, uri, version, line, start_column, line_prefix, word,
+                 candidates):
+        self.uri = uri
+        self.version = version
+        self.line = line
+        self.start_column = start_column
+        # text before start_column when the request was made
+        self.line_prefix = line_prefix
+        self.word = word
+        # CandidateIndex over the full server result, None while pending
+        self.candidates = candidates
+        # future of the request that timed out and resolve(result)
+        self.pending = None
+        self.resolve = None
+
+    def key(self):
+        return (self.uri, self.version, self.line, self.start_column)
+
+
+class CompletionCache:
+    def __init__(self):
+        self._session = None
+        self.hits = 0
+        self.misses = 0
+
+    def Invalidate(self, uri=None):
+        if self._session and (uri is None or self._session.uri == uri):
+            self._session = None
+
+    def Store(self, uri, version, line, start_column, current_line, word,
+              candidates):
+        self._session = CompletionSession(uri, version, line, start_column,
+                                          current_line[:start_column], word,
+                                          candidates)
+
+    def StorePending(self, uri, version, line, start_column, current_line,
+                     word, future, resolve):
+        """Keeps the session of a request that timed out. Once its answer
+        arrived resolve(result) returns the candidates, or None if they
+        cannot be kept."""
+        self.Store(uri, version, line, start_column, current_line, word,
+                   None)
+        self._session.pending = future
+        self._session.resolve = resolve
+
+    def Lookup(self, uri, version, line, start_column, current_line, word):
+        """Returns the cached candidates if they still apply to word starting at
+        start_column of current_line, None if the server has to be asked
+        again. Trigger characters such as '.' or '::' are not identifier
+        characters, typing one always moves start_column."""
+        session = self._session
+        if (not session or
+                session.key() != (uri, version, line, start_column) or
+                current_line[:start_column] != session.line_prefix or
+                not word.startswith(session.word) or
+                (session.candidates is None and not self._Resolve(session))):
+            self.misses += 1
+            return None
+        self.hits += 1
+        log.debug('completion cache hit, %d hits %d misses' %
+                  (self.hits, self.misses))
+        return session.candidates
+
+    def _Resolve(self, session):
+        """Returns whether the late answer of a pending session is there,
+        drops the session if it cannot be used."""
+        if not session.pending.done():
+            return False
+        try:
+            session.candidates = session.resolve(session.pending.result(0))
+        except Exception as e:
+            # e.g. cancelled by a newer request
+            log.debug('late completion dropped: %s' % e)
+        session.pending = session.resolve = None
+        if session.candidates is None:
+            self._session = None
+            return False
+        return True
+
+    def OnDocumentChanged(self, uri, version, first_line, old_end, new_end):
+        """Called for every didChange, lines [first_line, old_end) were
+        replaced by [first_line, new_end). Typing within the session line
+        keeps the session, anything else drops it."""
+        session = self._session
+        if not session or session.uri != uri:
+            return
+        if (first_line == session.line and old_end == session.line + 1 and
+                new_end == session.line + 1):
+            session.version = version
+        else:
+            self._session = None
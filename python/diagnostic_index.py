@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Sorted index over the diagnostics of one document.
+#
+# Diagnostics are kept sorted by (line, column) in parallel arrays, so the
+# lookups done on every cursor move and statusline redraw are bisections
+# instead of scans. An index is immutable and built once per
+# publishDiagnostics.
+from bisect import bisect_left
+
+
+class DiagnosticIndex:
+    def __init__(self, diagnostics):
+        """diagnostics are quickfix style dicts with lnum, col and
+        severity, optionally end_lnum and end_col."""
+        entries = sorted(diagnostics,
+                         key=lambda diagnostic: (diagnostic['lnum'],
+                                                 diagnostic['col']))
+        self._diagnostics = entries
+        self._starts = [(diagnostic['lnum'], diagnostic['col'])
+                        for diagnostic in entries]
+        self._ends = [(diagnostic.get('end_lnum', diagnostic['lnum']),
+                       diagnostic.get('end_col', diagnostic['col']))
+                      for diagnostic in entries]
+        # distinct lines and the worst severity found on each
+        self._lines = []
+        self._worst = []
+        for diagnostic in entries:
+            if self._lines and self._lines[-1] == diagnostic['lnum']:
+                self._worst[-1] = max(self._worst[-1],
+                                      diagnostic['severity'])
+            else:
+                self._lines.append(diagnostic['lnum'])
+                self._worst.append(diagnostic['severity'])
+
+    def __len__(self):
+        return len(self._diagnostics)
+
+    def diagnostics(self):
+        return self._diagnostics
+
+    def _LineRange(self, line):
+        begin = bisect_left(self._starts, (line,))
+        end = bisect_left(self._starts, (line + 1,), begin)
+        return begin, end
+
+    def HasLine(self, line):
+        i = bisect_left(self._lines, line)
+        return i < len(self._lines) and self._lines[i] == line
+
+    def OnLine(self, line):
+        begin, end = self._LineRange(line)
+        return self._diagnostics[begin:end]
+
+    def WorstSeverity(self, line):
+        i = bisect_left(self._lines, line)
+        if i < len(self._lines) and self._lines[i] == line:
+            return self._worst[i]
+        return None
+
+    def Nearest(self, line, column):
+        """The diagnostic on line covering column, or else the one starting
+        closest to it, None if the line has none."""
+        begin, end = self._LineRange(line)
+        if begin == end:
+            return None
+        i = bisect_left(self._starts, (line, column), begin, end)
+        if i == begin:
+            return self._diagnostics[i]
+        left = i - 1
+        if self._ends[left] >= (line, column) or i == end:
+            return self._diagnostics[left]
+        if column - self._starts[left][1] <= self._starts[i][1] - column:
+            return self._diagnostics[left]
+        return self._diagnostics[i]
+
+    def Next(self, line, column):
+        """The first diagnostic after (line, column), wrapping around."""
+        if not self._diagnostics:
+            return None
+        i = bisect_left(self._starts, (line, column + 1))
+        return self._diagnostics[i % len(self._diagnostics)]
+
+    def Previous(self, line, column):
+        """The last diagnostic before (line, column), wrapping around."""
+        if not self._diagnostics:
+            return None
+        i = bisect_left(self._starts, (line, column)) - 1
+        return self._diagnostics[i % len(self._diagnostics)]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Diff-based rendering of diagnostics as syntax matches and signs.
+#
+# The renderer remembers what it has put on screen, matches per window
+# (they are window-local in vim) and signs per buffer. A refresh computes
+# the delta against the new diagnostics and only adds or removes what
+# changed, an unchanged set costs no vim round trip at all. Match ids are
+# chosen here, so adding a match never has to wait for vim to return one,
+# and up to vimsupport.MAX_MATCH_POSITIONS positions share one match.
+import vimsupport
+
+# sign ids are per buffer, keep clear of the ones other plugins use
+SIGN_ID_BASE = 0x434c4400
+# match ids are per window, the same reasoning applies
+MATCH_ID_BASE = 0x434c4400
+
+
+def IsError(diagnostic):
+    return diagnostic['severity'] >= 3
+
+
+class DiagnosticsRenderer:
+    def __init__(self):
+        # window id -> (buffer number, {(line, column, is_error): match id},
+        #               {match id: [(line, column, is_error)]})
+        self._matches = {}
+        # buffer number -> {(line, is_error): sign id}
+        self._signs = {}
+        self._next_sign_id = SIGN_ID_BASE
+        self._next_match_id = MATCH_ID_BASE
+
+    def Render(self, bufnr, diagnostics):
+        """Shows diagnostics of the current buffer in the current window."""
+        self._RenderMatches(vimsupport.CurrentWindowId(), bufnr, diagnostics)
+        self.RenderSigns(bufnr, diagnostics)
+
+    def ClearBuffer(self, bufnr):
+        for sign_id in self._signs.pop(bufnr, {}).values():
+            vimsupport.UnplaceSign(sign_id, bufnr)
+        self._ClearMatches(lambda shown_bufnr: shown_bufnr == bufnr)
+
+    def Clear(self):
+        for bufnr in list(self._signs.keys()):
+            self.ClearBuffer(bufnr)
+        self._ClearMatches(lambda shown_bufnr: True)
+
+    def _ClearMatches(self, predicate):
+        if not self._matches:
+            return
+        current_window_id = vimsupport.CurrentWindowId()
+        for window_id, (shown_bufnr, _, groups) in list(
+                self._matches.items()):
+            if not predicate(shown_bufnr):
+                continue
+            if window_id == current_window_id:
+                self._DeleteMatches(None, groups)
+            else:
+                self._DeleteMatches(window_id, groups)
+            del self._matches[window_id]
+
+    def _RenderMatches(self, window_id, bufnr, diagnostics):
+        wanted = set((diagnostic['lnum'], diagnostic['col'],
+                      IsError(diagnostic)) for diagnostic in diagnostics)
+        shown_bufnr, shown, groups = self._matches.get(window_id,
+                                                       (bufnr, {}, {}))
+        if shown_bufnr != bufnr:
+            # the window switched buffers, what it shows is all stale
+            self._DeleteMatches(None, groups)
+            shown, groups = {}, {}
+        # a match can only be deleted as a whole, positions of a deleted
+        # match that are still wanted are added again
+        stale = set(shown[key] for key in shown if key not in wanted)
+        for match_id in stale:
+            vimsupport.DeleteMatch(match_id)
+            for key in groups.pop(match_id):
+                del shown[key]
+        added = sorted(key for key in wanted if key not in shown)
+        for is_error in (True, False):
+            keys = [key for key in added if key[2] == is_error]
+            for i in range(0, len(keys), vimsupport.MAX_MATCH_POSITIONS):
+                group = keys[i:i + vimsupport.MAX_MATCH_POSITIONS]
+                match_id = self._next_match_id
+                self._next_match_id += 1
+                vimsupport.AddDiagnosticMatches(
+                    match_id, [key[:2] for key in group], is_error=is_error)
+                groups[match_id] = group
+                for key in group:
+                    shown[key] = match_id
+        self._matches[window_id] = (bufnr, shown, groups)
+
+    def RenderSigns(self, bufnr, diagnostics):
+        """Signs are per buffer, so any buffer can get them."""
+        # one sign per line, an error wins over a warning
+        wanted = {}
+        for diagnostic in diagnostics:
+            line = diagnostic['lnum']
+            wanted[line] = wanted.get(line, False) or IsError(diagnostic)
+        wanted = set(wanted.items())
+        shown = self._signs.setdefault(bufnr, {})
+        for key in [key for key in shown if key not in wanted]:
+            vimsupport.UnplaceSign(shown.pop(key), bufnr)
+        for key in wanted:
+            if key in shown:
+                continue
+            line, is_error = key
+            sign_id = self._next_sign_id
+            self._next_sign_id += 1
+            sign_name = 'clangdError' if is_error else 'clangdWarning'
+            vimsupport.PlaceSign(sign_id, line, sign_name, bufnr)
+            shown[key] = sign_id
+
+    # window_id None is the current window
+    def _DeleteMatches(self, window_id, groups):
+        for match_id in groups:
+            vimsupport.DeleteMatch(match_id, window_id)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# Decides when diagnostics are rendered and when the refresh timer fires.
+#
+# Diagnostics are rendered when publishDiagnostics arrives for a visible
+# buffer, at most once per `min_interval_ms` per buffer, later arrivals
+# within that interval are rendered by the timer. The timer also polls the
+# server while a change waits for its diagnostics on a transport that does
+# not push, and otherwise backs off to a long interval.
+import glog as log
+from event_dispatcher import OneShotTimer
+
+from collections import deque
+from time import time
+
+# polling interval while diagnostics are expected but not pushed
+BUSY_INTERVAL_MS = 200
+# idle polling starts here and doubles up to the maximum
+IDLE_INTERVAL_MS = 1000
+MAX_IDLE_INTERVAL_MS = 30000
+# edit-to-diagnostic-visible samples kept for percentiles
+LATENCY_SAMPLES = 256
+
+
+class DiagnosticsScheduler:
+    def __init__(self, poll, render, min_interval_ms, native_timer):
+        """poll() dispatches queued server messages, render(bufnr) renders
+        the diagnostics of a buffer and calls Rendered()."""
+        self._poll = poll
+        self._render = render
+        self._min_interval = min_interval_ms / 1000.0
+        self._push_driven = False
+        # buffer number -> time of the last render
+        self._last_render = {}
+        # buffers with diagnostics held back by the rate limit
+        self._pending = set()
+        # buffer number -> version of a change without diagnostics yet
+        self._awaiting = {}
+        # buffer number -> [time of the first edit, version sending it]
+        self._edits = {}
+        self._idle_interval = IDLE_INTERVAL_MS
+        self._timer = OneShotTimer('refresh', self.OnTimerCallback,
+                                   native_timer)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.renders = 0
+        self._Arm(self._idle_interval)
+
+    def SetPushDriven(self, push_driven):
+        """Whether the transport delivers diagnostics without polling."""
+        self._push_driven = push_driven
+
+    def EditMade(self, bufnr):
+        if bufnr not in self._edits:
+            self._edits[bufnr] = [time(), None]
+
+    def ChangeSent(self, bufnr, version):
+        self._awaiting[bufnr] = version
+        edit = self._edits.get(bufnr)
+        if edit:
+            edit[1] = version
+        self._idle_interval = IDLE_INTERVAL_MS
+        if not self._push_driven:
+            self._Arm(BUSY_INTERVAL_MS)
+
+    def DiagnosticsReceived(self, bufnr, version):
+        """Diagnostics came for the buffer, visible or not. Once they are
+        as new as the last change sent polling may back off again."""
+        awaited = self._awaiting.get(bufnr)
+        if awaited is None or version is None or version >= awaited:
+            self._awaiting.pop(bufnr, None)
+        self._idle_interval = IDLE_INTERVAL_MS
+
+    def DiagnosticsArrived(self, bufnr, version):
+        """Diagnostics came for a visible buffer. Returns whether it may
+        be rendered right now, if not it is rendered once the rate limit
+        allows."""
+        self.DiagnosticsReceived(bufnr, version)
+        wait = self._Wait(bufnr, time())
+        if wait <= 0:
+            return True
+        self._pending.add(bufnr)
+        self._Arm(int(wait * 1000) + 1)
+        return False
+
+    def Rendered(self, bufnr, version):
+        now = time()
+        self.renders += 1
+        self._last_render[bufnr] = now
+        self._pending.discard(bufnr)
+        edit = self._edits.get(bufnr)
+        # only count diagnostics computed after the edit was sent
+        if edit and edit[1] is not None and (version is None or
+                                             version >= edit[1]):
+            del self._edits[bufnr]
+            latency = now - edit[0]
+            self.latencies.append(latency)
+            log.info('diagnostics visible %.0fms after the edit' %
+                     (latency * 1000))
+
+    def Forget(self, bufnr):
+        self._last_render.pop(bufnr, None)
+        self._pending.discard(bufnr)
+        self._awaiting.pop(bufnr, None)
+        self._edits.pop(bufnr, None)
+
+    def LatencyStats(self):
+        """edit-to-diagnostic-visible latency in milliseconds"""
+        samples = sorted(self.latencies)
+        if not samples:
+            return {'count': 0}
+        def Percentile(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+        return {
+            'count': len(samples),
+            'last': self.latencies[-1] * 1000,
+            'mean': sum(samples) / len(samples) * 1000,
+            'p50': Percentile(0.5),
+            'p90': Percentile(0.9),
+            'max': samples[-1] * 1000
+        }
+
+    def NextInterval(self):
+        now = time()
+        if self._pending:
+            wait = min(self._Wait(bufnr, now) for bufnr in self._pending)
+            return max(int(wait * 1000) + 1, 1)
+        if self._awaiting and not self._push_driven:
+            return BUSY_INTERVAL_MS
+        interval = self._idle_interval
+        self._idle_interval = min(self._idle_interval * 2,
+                                  MAX_IDLE_INTERVAL_MS)
+        return interval
+
+    def Stop(self):
+        self._timer.Stop()
+
+    def OnTimerCallback(self):
+        try:
+            self._poll()
+            now = time()
+            for bufnr in [bufnr for bufnr in self._pending
+                          if self._Wait(bufnr, now) <= 0]:
+                self._pending.discard(bufnr)
+                self._render(bufnr)
+        except:
+            log.exception('failed to refresh diagnostics')
+        self._Arm(self.NextInterval())
+
+    def _Wait(self, bufnr, now):
+        last = self._last_render.get(bufnr)
+        if last is None:
+            return 0
+        return last + self._min_interval - now
+
+    def _Arm(self, interval_ms):
+        due = time() + interval_ms / 1000.0
+        if self._timer.isArmed() and self._timer.due <= due:
+            # fires early enough already
+            return
+        self._timer.Start(interval_ms)
@@ -1,16 +1,37 @@
 #!/usr/bin/env python
 import glog as log
-import vim, vimsupport
+import vimsupport
+import startup_report
 
+from functools import wraps
 from time import time
 
 
+def BatchedEvent(handler):
+    """Runs an event handler inside vimsupport.Batched() and records how
+    many vim round trips it took."""
+    @wraps(handler)
+    def Wrapper(self, *args, **kwargs):
+        before = vimsupport.RoundTrips()
+        try:
+            with vimsupport.Batched():
+                return handler(self, *args, **kwargs)
+        finally:
+            # the flush of the batch itself is included
+            self._RecordRoundTrips(handler.__name__,
+                                   vimsupport.RoundTrips() - before)
+    return Wrapper
+
+
 class EmulateTimer:
     def __init__(self, observer, interval=5):
         self._interval = interval
         self._observer = observer
+        self._last_timestamp = None
 
-    def start(self):
+    def start(self, interval=None):
+        if interval is not None:
+            self._interval = interval
         self._last_timestamp = time()
 
     def stop(self):
@@ -25,34 +46,107 @@ class EmulateTimer:
             self._observer.OnTimerCallback()
 
 
+# name -> OneShotTimer, vim calls clangd#OnTimer with the name
+_timers = {}
+
+
+class OneShotTimer:
+    """Calls callback() once, delay_ms after Start(). Runs on a vim timer,
+    or without timers support on an EmulateTimer polled by PollTimers()."""
+    def __init__(self, name, callback, native_timer):
+        self._name = name
+        self._callback = callback
+        self._timer_id = None
+        self._emulated = None
+        if not native_timer:
+            self._emulated = EmulateTimer(self)
+        # when it fires, None while stopped
+        self.due = None
+        _timers[name] = self
+
+    def isArmed(self):
+        return self.due is not None
+
+    def Start(self, delay_ms):
+        """Arms the timer, a pending one is replaced."""
+        self.Stop()
+        self.due = time() + delay_ms / 1000.0
+        if self._emulated:
+            self._emulated.start(delay_ms / 1000.0)
+        else:
+            self._timer_id = vimsupport.StartTimer(int(delay_ms), self._name)
+
+    def Stop(self):
+        if self._emulated:
+            self._emulated.stop()
+        elif self._timer_id is not None:
+            vimsupport.StopTimer(self._timer_id)
+        self._timer_id = None
+        self.due = None
+
+    def poll(self):
+        if self._emulated:
+            self._emulated.poll()
+
+    def OnTimerCallback(self):
+        if self.due is None:
+            # stopped in the meantime
+            return
+        self.Stop()
+        self._callback()
+
+
+def PollTimers():
+    """Fires the emulated timers which are due."""
+    for timer in list(_timers.values()):
+        timer.poll()
+
+
+def FireTimer(name):
+    timer = _timers.get(name)
+    if timer:
+        timer.OnTimerCallback()
+
+
 class EventDispatcher:
     def __init__(self, manager):
         self.manager = manager
-        self._native_timer = bool(vim.eval('has("s:timer")'))
-        if self._native_timer:
-            log.info('vim native timer found and used')
-            # FIXME use abstract timer
-            self._timer = None
-        else:
-            self._timer = EmulateTimer(self)
-
-    def OnVimEnter(self):
+        # event name -> [calls, vim round trips]
+        self.round_trips = {}
+
+    def _RecordRoundTrips(self, event, trips):
+        stats = self.round_trips.setdefault(event, [0, 0])
+        stats[0] += 1
+        stats[1] += trips
+        log.debug('%s took %d vim round trips' % (event, trips))
+
+    def RoundTripStats(self):
+        """event name -> average vim round trips per call"""
+        return dict((event, float(trips) / calls)
+                    for event, (calls, trips) in self.round_trips.items())
+
+    def _PollTimers(self):
+        PollTimers()
+
+    @BatchedEvent
+    def OnVimEnter(self, setup_seconds=None):
+        # with g:clangd#lazy_start this is the first C-family buffer
         log.debug('VimEnter')
-        autostart = bool(vim.eval('g:clangd#autostart'))
+        if setup_seconds is not None:
+            startup_report.Add('vimscript', setup_seconds)
+        autostart = vimsupport.GetBoolValue('g:clangd#autostart')
         if autostart and not self.manager.isAlive():
             vimsupport.EchoText('vim-clanged is not running')
             return
 
-        if self._timer:
-            self._timer.start()
-
         log.info('vim-clangd plugin fully loaded')
 
+    @BatchedEvent
     def OnVimLeave(self):
         log.debug('VimLeave')
         self.manager.in_shutdown = True
-        if self._timer:
-            self._timer.stop()
+        self.manager.StopSchedulers()
+        log.info(self.manager.ChangeStatsSummary())
         try:
             # BufUnload won't be called at exit, you need to call it yourself
             self.manager.CloseAllFiles()
@@ -61,67 +155,95 @@ class EventDispatcher:
             log.exception("vim-clangd plugin unload with error")
         log.info('vim-clangd plugin fully unloaded')
 
+    @BatchedEvent
     def OnBufferReadPost(self, file_name):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         log.info('BufferReadPost %s' % file_name)
 
+    @BatchedEvent
     def OnFileType(self):
         log.info('Current FileType Changed To %s' %
                  vimsupport.CurrentFileTypes()[0])
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         self.manager.CloseCurrentFile()
         self.manager.OpenCurrentFile()
         self.manager.GetDiagnosticsForCurrentFile()
 
+    @BatchedEvent
     def OnBufferWritePost(self, file_name):
         # FIXME should we use buffer_number?
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         self.manager.SaveFile(file_name)
         log.info('BufferWritePost %s' % file_name)
 
+    @BatchedEvent
     def OnBufferUnload(self, file_name):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         log.info('BufferUnload %s' % file_name)
         self.manager.CloseFile(file_name)
 
-    def OnBufferDelete(self, file_name):
-        if self._timer:
-            self._timer.poll()
-        log.info('BufferDelete %s' % file_name)
-        self.manager.CloseFile(file_name)
-
+    @BatchedEvent
+    def OnBufferDelete(self, bufnr):
+        self._PollTimers()
+        log.info('BufferDelete %d' % bufnr)
+        self.manager.UnregisterBuffer(bufnr)
+
+    @BatchedEvent
+    def OnBufferWipeout(self, bufnr):
+        log.debug('BufferWipeout %d' % bufnr)
+        self.manager.UnregisterBuffer(bufnr)
+
+    @BatchedEvent
+    def OnBufferRegister(self, bufnr):
+        # the buffer got a name or a filetype
+        self.manager.RegisterBuffer(bufnr)
+
+    @BatchedEvent
+    def OnBufferWinEnter(self, bufnr):
+        self.manager.EnterWindow(bufnr)
+        # matches are per window, the new one may not have them yet
+        self.manager.RenderCurrentDiagnostics()
+
+    @BatchedEvent
     def OnCursorMove(self):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         log.debug('CursorMove')
 
+    @BatchedEvent
     def OnCursorHold(self):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         log.debug('CursorHold')
+        self.manager.EchoErrorMessageForCurrentLine()
 
+    @BatchedEvent
     def OnInsertEnter(self):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         log.debug('InsertEnter')
 
+    @BatchedEvent
     def OnInsertLeave(self):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         log.debug('InsertLeave')
+        # typing is over, no point in waiting for the quiet period
+        self.manager.FlushPendingChanges()
 
+    @BatchedEvent
     def OnTextChanged(self):
-        if self._timer:
-            self._timer.poll()
+        self._PollTimers()
         # After a change was made to the text in the current buffer in Normal mode.
         log.debug('TextChanged')
-        self.manager.UpdateCurrentBuffer()
+        self.manager.ScheduleUpdateCurrentBuffer()
 
-    def OnTimerCallback(self):
-        log.debug('OnTimer')
-        self.manager.GetDiagnosticsForCurrentFile()
-        self.manager.EchoErrorMessageForCurrentLine()
+    @BatchedEvent
+    def OnTimer(self, name):
+        log.debug('OnTimer %s' % name)
+        FireTimer(name)
+
+    @BatchedEvent
+    def OnServerOutput(self, channel_id, data):
+        self.manager.OnServerOutput(channel_id, data)
+
+    @BatchedEvent
+    def OnServerExit(self, channel_id, status):
+        log.info('server job on channel %d exited' % channel_id)
+        self.manager.OnServerExit(channel_id, status)
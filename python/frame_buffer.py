@@ -0,0 +1,133 @@
+# receive buffer for Content-Length framed messages
+# https://github.com/Microsoft/language-server-protocol/blob/master/protocol.md#base-protocol
+#
+# Data is read in large chunks with readinto() into one bytearray which is
+# reused across reads. Frames are handed out as memoryview slices of that
+# bytearray, so one read can yield several frames and the message body is
+# never copied before it is decoded.
+import io
+from errno import EINTR
+
+HEADER_TERMINATOR = b'\r\n\r\n'
+MAX_HEADER_SIZE = 4096
+DEFAULT_CAPACITY = 64 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class FrameBuffer(object):
+    def __init__(self, fd=None, capacity=DEFAULT_CAPACITY):
+        self._chunk = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        # (header start, body start, body length) of a partially read frame
+        self._pending = None
+        self._file = None
+        if fd is not None:
+            self._file = io.FileIO(fd, 'r', closefd=False)
+        self.reads = 0
+        self.bytes_read = 0
+        # unread data moved by compaction or growth of the buffer
+        self.bytes_copied = 0
+        self.frames = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def ReadFrom(self):
+        """Reads once from the fd, returns the number of bytes read, 0 on
+        EOF."""
+        self._Reserve(self._chunk)
+        while True:
+            try:
+                n = self._file.readinto(self._view[self._end:])
+                break
+            except (IOError, OSError) as e:
+                if e.errno != EINTR:
+                    raise
+        self.reads += 1
+        if not n:
+            return 0
+        self._end += n
+        self.bytes_read += n
+        return n
+
+    def Feed(self, data):
+        """Appends data received by other means, e.g. a vim channel."""
+        size = len(data)
+        self._Reserve(size)
+        self._buf[self._end:self._end + size] = data
+        self._end += size
+        self.bytes_read += size
+
+    def NextFrame(self):
+        """Returns the body of the next complete frame as a memoryview, or
+        None if more data is needed. The view is only valid until the next
+        call to ReadFrom or Feed."""
+        if self._pending is None:
+            end = self._buf.find(HEADER_TERMINATOR, self._start, self._end)
+            if end < 0:
+                if self._end - self._start > MAX_HEADER_SIZE:
+                    raise ProtocolError('header too large')
+                return None
+            length = self._ParseHeaders(self._start, end)
+            self._pending = (self._start, end + len(HEADER_TERMINATOR), length)
+
+        header_start, body_start, length = self._pending
+        body_end = body_start + length
+        if body_end > self._end:
+            # make room for the whole body so the next reads can fill it
+            self._Reserve(body_end - self._end)
+            return None
+
+        self._pending = None
+        self._start = body_end
+        if self._start == self._end:
+            self._start = self._end = 0
+        self.frames += 1
+        return self._view[body_start:body_end]
+
+    def _ParseHeaders(self, start, end):
+        length = None
+        header = bytes(self._buf[start:end]).decode('ascii')
+        for line in header.split('\r\n'):
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise ProtocolError('bad header line %r' % line)
+            # Content-Type and any other header are accepted and ignored,
+            # utf-8 is the only charset spoken by clangd
+            if name.strip().lower() == 'content-length':
+                try:
+                    length = int(value.strip())
+                except ValueError:
+                    raise ProtocolError('bad content length %r' % value)
+        if length is None or length < 0:
+            raise ProtocolError('missing content length')
+        return length
+
+    def _Reserve(self, size):
+        """Makes sure at least size bytes are free after the unread data."""
+        if len(self._buf) - self._end >= size:
+            return
+        pending = self._end - self._start
+        offset = self._start
+        self.bytes_copied += pending
+        if pending + size <= len(self._buf):
+            # compact, a partial frame is moved to the front
+            self._buf[0:pending] = bytes(self._buf[self._start:self._end])
+        else:
+            capacity = max(len(self._buf) * 2, pending + size)
+            buf = bytearray(capacity)
+            buf[0:pending] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        self._start = 0
+        self._end = pending
+        if self._pending is not None:
+            header_start, body_start, length = self._pending
+            self._pending = (header_start - offset, body_start - offset,
+                             length)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# Fuzzy matching and ranking of completion candidates.
+#
+# A CandidateIndex is built once per server result. Matching a pattern
+# first runs one precompiled subsequence regex over the lowercased filter
+# texts, which rejects most candidates in C, then scores the survivors and
+# keeps the best ones with a heap. Prefix matches are looked up by bisecting
+# the sorted filter texts.
+import heapq
+import re
+from bisect import bisect_left
+
+# the server ranks by sortText, items without one go last
+_NO_SORT_TEXT = u'\uffff'
+# above any score a non-prefix match can reach
+PREFIX_MATCH_SCORE = 10000
+
+
+def WordBoundaries(text):
+    """Positions of text where a word starts: the first character, after
+    an underscore or other separator and at camelCase humps."""
+    boundaries = []
+    prev = ''
+    for i, c in enumerate(text):
+        if not c.isalnum():
+            prev = c
+            continue
+        if (not prev or not prev.isalnum() or
+                (c.isupper() and not prev.isupper()) or
+                (c.isdigit() and not prev.isdigit())):
+            boundaries.append(i)
+        prev = c
+    return boundaries
+
+
+class Candidate(object):
+    __slots__ = ('item', 'text', 'lower', 'sort_key', '_boundaries')
+
+    def __init__(self, item):
+        self.item = item
+        self.text = item.get('filterText') or item['label']
+        self.lower = self.text.lower()
+        self.sort_key = (item.get('sortText') or _NO_SORT_TEXT,
+                         item.get('kind', 1), item['label'])
+        self._boundaries = None
+
+    @property
+    def boundaries(self):
+        # only needed for candidates that are not prefix matches
+        if self._boundaries is None:
+            self._boundaries = frozenset(WordBoundaries(self.text))
+        return self._boundaries
+
+
+class CandidateIndex:
+    def __init__(self, items):
+        self._candidates = [Candidate(item) for item in items]
+        # joined filter texts, one per line, for the regex prefilter
+        self._lines = u'\n'.join(candidate.lower
+                                 for candidate in self._candidates)
+        self._line_starts = []
+        offset = 0
+        for candidate in self._candidates:
+            self._line_starts.append(offset)
+            offset += len(candidate.lower) + 1
+        self._by_sort_key = None
+        self._sorted_lower = None
+        self._by_lower = None
+
+    def __len__(self):
+        return len(self._candidates)
+
+    def Rank(self, pattern, limit=20):
+        """Returns the best limit items matching pattern as a subsequence,
+        best first. An empty pattern returns the server's order."""
+        if not pattern:
+            if self._by_sort_key is None:
+                self._by_sort_key = sorted(
+                    self._candidates, key=lambda candidate: candidate.sort_key)
+            return [candidate.item for candidate in self._by_sort_key[:limit]]
+
+        lower = pattern.lower()
+        # prefix matches outrank every other match, if there are enough of
+        # them the rest does not need to be scored at all
+        matches = self._PrefixMatches(lower)
+        if len(matches) < limit:
+            matches = self._Prefilter(
+                u'^[^\\n]*?' +
+                u'[^\\n]*?'.join(re.escape(c) for c in lower))
+        scored = []
+        for candidate in matches:
+            score = ScoreMatch(candidate, pattern, lower)
+            if score is not None:
+                scored.append((-score, candidate.sort_key, candidate))
+        best = heapq.nsmallest(limit, scored, key=lambda entry: entry[:2])
+        return [entry[2].item for entry in best]
+
+    def _PrefixMatches(self, lower):
+        if self._sorted_lower is None:
+            self._by_lower = sorted(self._candidates,
+                                    key=lambda candidate: candidate.lower)
+            self._sorted_lower = [candidate.lower
+                                  for candidate in self._by_lower]
+        begin = bisect_left(self._sorted_lower, lower)
+        end = bisect_left(self._sorted_lower, lower + _NO_SORT_TEXT, begin)
+        return self._by_lower[begin:end]
+
+    def _Prefilter(self, pattern):
+        regex = re.compile(pattern, re.MULTILINE)
+        starts = self._line_starts
+        candidates = self._candidates
+        index = 0
+        for match in regex.finditer(self._lines):
+            # line starts are sorted and matches come in order
+            start = match.start()
+            while starts[index] < start:
+                index += 1
+            yield candidates[index]
+
+
+def ScoreMatch(candidate, pattern, lower):
+    """Scores pattern against the candidate, None if it does not match.
+    Prefix, word boundary, consecutive and same case matches score higher,
+    gaps and long candidates lower."""
+    text = candidate.text
+    text_lower = candidate.lower
+    if text_lower.startswith(lower):
+        score = PREFIX_MATCH_SCORE
+        if text.startswith(pattern):
+            score += 10
+        return score - min(len(text) - len(lower), PREFIX_MATCH_SCORE // 2)
+
+    score = _ScoreSubsequence(candidate, pattern, lower, True)
+    if score is None:
+        # jumping ahead to a word start can leave too little text for the
+        # rest of the pattern, a plain greedy match always fits
+        score = _ScoreSubsequence(candidate, pattern, lower, False)
+    if score is None:
+        return None
+    if text_lower[0] == lower[0]:
+        score += 10
+    return score - (len(text) - len(lower)) // 4
+
+
+def _ScoreSubsequence(candidate, pattern, lower, prefer_boundaries):
+    text = candidate.text
+    text_lower = candidate.lower
+    boundaries = candidate.boundaries
+    score = 0
+    pos = 0
+    last = -2
+    for i, c in enumerate(lower):
+        j = text_lower.find(c, pos)
+        if j < 0:
+            return None
+        if prefer_boundaries and j != last + 1:
+            # prefer the start of a later word over a match inside one
+            k = j
+            while k >= 0 and k not in boundaries:
+                k = text_lower.find(c, k + 1)
+            if k >= 0:
+                j = k
+        if j == last + 1:
+            score += 8
+        elif j in boundaries:
+            score += 6
+        else:
+            score -= min(j - pos, 5)
+        if text[j] == pattern[i]:
+            score += 1
+        last = j
+        pos = j + 1
+    return score
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# clangd started by vim's job_start().
+#
+# Vim reads the server's stdout itself and hands it to clangd#OnJobOutput
+# as it arrives, so messages are dispatched right away instead of waiting
+# for the next poll. JobChannel is the transport for ChannelJsonRPCClient
+# and stands in for the Popen object of the pipe based transport.
+import vim
+import vimsupport
+from errno import ENOENT, EPIPE
+
+# read() waits this long per call when asked to wait forever
+_MAX_READ_TIMEOUT_MS = 60 * 1000
+
+
+class JobChannel(object):
+    def __init__(self, argv, stderr_path):
+        self.id, self.pid = vimsupport.StartJob(argv, stderr_path)
+        if self.id < 0:
+            raise OSError(ENOENT, 'failed to start %s' % ' '.join(argv))
+        # set by exited() from the job's exit_cb, asking vim for the job
+        # status on every isAlive() is a round trip
+        self.returncode = None
+
+    def send(self, data):
+        try:
+            vimsupport.JobSend(self.id, data)
+        except vim.error as e:
+            raise OSError(EPIPE, str(e))
+
+    def read(self, timeout_ms):
+        if timeout_ms < 0:
+            timeout_ms = _MAX_READ_TIMEOUT_MS
+        try:
+            return vimsupport.JobRead(self.id, timeout_ms)
+        except vim.error:
+            return None
+
+    def poll(self):
+        return self.returncode
+
+    def exited(self, status):
+        self.returncode = status
+
+    def terminate(self):
+        vimsupport.JobStop(self.id, 'term')
+
+    def kill(self):
+        vimsupport.JobStop(self.id, 'kill')
@@ -11,133 +11,400 @@
 #               }
 #               }
 #
-import json, os
+import json, os, threading
 import glog as log
-from timeout import timeout
-from errno import EINTR
-
-
-def EstimateUnreadBytes(fd):
-    from array import array
-    from fcntl import ioctl
-    from termios import FIONREAD
-    buf = array('i', [0])
-    ioctl(fd, FIONREAD, buf, 1)
-    return buf[0]
-
-@timeout(5)
-def write_utf8(fd, data):
-    msg = data.encode('utf-8')
-    while len(msg):
-        try:
-            written = os.write(fd, msg)
-            msg = msg[written:]
-        except OSError,e:
-          if e.errno != EINTR:
-              raise
-    return msg
-
-@timeout(5)
-def read_utf8(fd, length):
-    msg = bytes()
-    while length:
+from codecs import utf_8_decode
+from fcntl import fcntl, F_GETFL, F_SETFL
+from frame_buffer import FrameBuffer
+from message_writer import MessageWriter
+from timeout import Deadline, TimeoutError
+from errno import EPIPE, ETIME
+from time import time
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+# default deadline for blocking requests, in seconds
+DEFAULT_REQUEST_TIMEOUT = 5
+# a sender blocked this long on a full write queue means a stuck server
+WRITE_TIMEOUT = 5
+
+CancelRequest_NOTIFICATION = '$/cancelRequest'
+
+# ErrorCodes
+MethodNotFound = -32601
+RequestCancelled = -32800
+ContentModified = -32801
+
+# ids of cancelled requests remembered to drop their late responses
+MAX_CANCELLED_IDS = 1024
+
+
+class JsonRPCError(Exception):
+    def __init__(self, code, message='', data=None):
+        Exception.__init__(self, 'error %d: %s' % (code, message))
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+class RequestCancelledError(JsonRPCError):
+    """The request was cancelled by us or dropped by the server."""
+    pass
+
+
+def ErrorFromResponse(error):
+    code = error.get('code', 0)
+    if code in (RequestCancelled, ContentModified):
+        cls = RequestCancelledError
+    else:
+        cls = JsonRPCError
+    return cls(code, error.get('message', ''), error.get('data'))
+
+
+class StdlibCodec(object):
+    name = 'json'
+
+    def __init__(self):
+        # ensure_ascii keeps the output ascii, encoding it is a cheap copy
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj).encode('ascii')
+
+    def loads(self, data):
+        return json.loads(utf_8_decode(data)[0])
+
+
+class OrjsonCodec(object):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.dumps = orjson.dumps
+        # takes the memoryview of the receive buffer as is
+        self.loads = orjson.loads
+
+
+class UjsonCodec(object):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data):
+        return self._ujson.loads(bytes(data))
+
+
+# fastest first
+CODECS = [OrjsonCodec, UjsonCodec, StdlibCodec]
+
+
+def GetCodec(name=None):
+    """Returns the named codec, or the fastest one importable."""
+    for cls in CODECS:
+        if name is not None and cls.name != name:
+            continue
         try:
-            buf = os.read(fd, length)
-            length -= len(buf)
-            msg += buf
-        except OSError,e:
-          if e.errno != EINTR:
-              raise
-    return msg.decode('utf-8')
+            return cls()
+        except ImportError:
+            if name is not None:
+                raise
+    raise ValueError('unknown json codec %s' % name)
+
+
+def SetNonBlocking(fd):
+    fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | os.O_NONBLOCK)
+
+
+class RequestFuture(object):
+    """Pending response of a request, resolved by the reader thread."""
+
+    def __init__(self, request):
+        self.request = request
+        # when it was sent, only kept while statistics are recorded
+        self.sent = None
+        # (method, supersede) of a request that can be superseded
+        self.key = None
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._event.set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError(ETIME, 'request %s timed out after %ss' %
+                               (self.request['method'], timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
 
 class JsonRPCClient:
-    def __init__(self, request_observer, input_fd, output_fd):
+    def __init__(self, request_observer, input_fd, output_fd, codec=None):
         self._input_fd = input_fd
         self._output_fd = output_fd
+        SetNonBlocking(input_fd)
+        self._writer = MessageWriter(input_fd)
+        self._InitState(request_observer, FrameBuffer(output_fd), codec)
+        self._reader = threading.Thread(target=self._ReadLoop,
+                                        name='jsonrpc-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _InitState(self, request_observer, recv_buffer, codec=None):
+        self._codec = codec or GetCodec()
+        log.info('json codec: %s' % self._codec.name)
         self._no = 0
         self._requests = {}
+        # (method, key) -> future of the newest request of that kind
+        self._inflight = {}
+        self._cancelled = set()
+        self.cancelled = 0
+        self._lock = threading.Lock()
+        self._notifications = Queue()
         self._observer = request_observer
+        self._recv_buffer = recv_buffer
+        self._reader_error = None
+        self._server_down_reported = False
+        self._stats = None
+        self._recorder = None
+
+    def setStats(self, stats):
+        """Records the traffic into a rpc_stats.RpcStats, None stops."""
+        self._stats = stats
+
+    def setRecorder(self, recorder):
+        """Appends every message to a traffic_recorder.TrafficRecorder,
+        None stops."""
+        self._recorder = recorder
 
-    def sendRequest(self, method, params={}, nullResponse=False):
-        Id = self._no
-        self._no = self._no + 1
+    def sendRequestAsync(self, method, params={}, supersede=None):
+        """supersede names the request within method, e.g. by its uri. A
+        newer request with the same method and supersede cancels this one
+        if it is still pending, even after waitRequest() gave up on it."""
+        if supersede is not None:
+            previous = self._inflight.pop((method, supersede), None)
+            if previous is not None:
+                self.cancelRequest(previous)
+        with self._lock:
+            Id = self._no
+            self._no = self._no + 1
+            future = RequestFuture({'method': method, 'id': Id})
+            if self._reader_error is not None:
+                future.set_error(self._reader_error)
+                return future
+            # register before sending, the response may arrive immediately
+            self._requests[Id] = future
+        if self._stats is not None:
+            future.sent = time()
         try:
             r = self.SendMsg(method, params, Id=Id)
         except OSError:
-            self._observer.onServerDown()
+            with self._lock:
+                self._requests.pop(Id, None)
+            self._ReportServerDown()
             raise
+        future.request = r
+        if supersede is not None:
+            future.key = (method, supersede)
+            self._inflight[future.key] = future
         log.debug('send request: %s' % r)
+        return future
+
+    def cancelRequest(self, future):
+        """Asks the server to drop the request, its response is ignored."""
+        Id = future.request.get('id')
+        with self._lock:
+            if self._requests.pop(Id, None) is None:
+                # answered already
+                return
+            if len(self._cancelled) >= MAX_CANCELLED_IDS:
+                self._cancelled.clear()
+            self._cancelled.add(Id)
+        self.cancelled += 1
+        future.set_error(RequestCancelledError(
+            RequestCancelled, 'request %s cancelled' %
+            future.request['method']))
+        self.sendNotification(CancelRequest_NOTIFICATION, {'id': Id})
+
+    def sendRequest(self, method, params={}, nullResponse=False,
+                    timeout=DEFAULT_REQUEST_TIMEOUT, supersede=None):
+        # the budget covers the whole round trip, including the write
+        deadline = Deadline(timeout)
+        future = self.sendRequestAsync(method, params, supersede)
         if nullResponse:
             return None
-        while True:
-            try:
-                rr = self.RecvMsg()
-            except OSError:
-                self._observer.onServerDown()
-                raise
-            if 'id' in rr and rr['id'] == Id:
-                if 'error' in rr:
-                    raise Exception('bad error_code %d' % rr['error'])
-                return rr['result']
-        return None
+        return self._WaitResponse(future, deadline)
+
+    def waitRequest(self, future, timeout=DEFAULT_REQUEST_TIMEOUT):
+        """Waits for the response to a sendRequestAsync() future. A request
+        that timed out is not cancelled, its late answer still resolves the
+        future unless a newer request supersedes it."""
+        return self._WaitResponse(future, Deadline(timeout))
+
+    def _WaitResponse(self, future, deadline):
+        try:
+            return self._WaitFor(future, deadline)
+        except TimeoutError:
+            log.warn('request %s timed out' % future.request['method'])
+            raise
+        except OSError:
+            self._ReportServerDown()
+            raise
+        finally:
+            if (future.done() and future.key is not None and
+                    self._inflight.get(future.key) is future):
+                del self._inflight[future.key]
 
-    def sendNotification(self, method, params={}):
+    def sendNotification(self, method, params={}, queue_key=None,
+                         replace_queued=False):
+        """With replace_queued, notifications with the same queue_key that
+        still wait in the write queue are dropped, this one supersedes
+        them."""
         try:
-            r= self.SendMsg(method, params)
+            r = self.SendMsg(method, params, queue_key=queue_key,
+                             replace_queued=replace_queued)
         except OSError:
-            self._observer.onServerDown()
+            self._ReportServerDown()
             raise
         log.debug('send notifications: %s' % r)
 
     def handleRecv(self):
-        while EstimateUnreadBytes(self._output_fd) > 0:
+        # dispatch queued notifications on the caller (ui) thread
+        while True:
             try:
-                self.RecvMsg()
-            except OSError:
-                self._observer.onServerDown()
-                raise
+                rr = self._notifications.get_nowait()
+            except Empty:
+                break
+            if rr is None:
+                self._ReportServerDown()
+                continue
+            if not 'id' in rr:
+                self.OnNotification(rr)
+            else:
+                self.OnRequest(rr)
+
+    def _WaitFor(self, future, deadline):
+        return future.result(deadline.remaining())
 
-    def SendMsg(self, method, params={}, Id=None):
+    def isReaderAlive(self):
+        return self._reader.is_alive()
+
+    def flush(self, timeout=None):
+        """Waits until queued messages are written."""
+        return self._writer.flush(timeout)
+
+    def closeWriter(self, timeout=None):
+        self._writer.close()
+        self._writer.join(timeout)
+
+    def joinReader(self, timeout=None):
+        self._reader.join(timeout)
+
+    def SendMsg(self, method, params={}, Id=None, queue_key=None,
+                replace_queued=False):
         r = {}
         r['jsonrpc'] = '2.0'
         r['method'] = str(method)
         r['params'] = params
         if Id is not None:
             r['id'] = Id
-            self._requests[Id] = r
-        request = json.dumps(r, separators=(',',':'), sort_keys=True)
-        write_utf8(self._input_fd, u'Content-Length: %d\r\n\r\n' % len(request))
-        write_utf8(self._input_fd, request)
+        stats = self._stats
+        if stats is not None:
+            start = time()
+        body = self._codec.dumps(r)
+        header = ('Content-Length: %d\r\n\r\n' % len(body)).encode('ascii')
+        if stats is not None:
+            stats.Sent(r['method'], len(header) + len(body),
+                       (time() - start) * 1000)
+        if self._recorder is not None:
+            self._recorder.Record('>', body)
+        self._Write(header, body, queue_key, replace_queued)
         return r
 
+    def _Write(self, header, body, queue_key, replace_queued):
+        self._writer.send(header, body, queue_key, replace_queued,
+                          timeout=WRITE_TIMEOUT)
+
     def RecvMsg(self):
-        msg_length = self.RecvMsgHeader()
-        msg = read_utf8(self._output_fd, msg_length)
-
-        rr = json.loads(msg)
-        if not 'id' in rr:
-            self.OnNotification(rr)
-        elif not rr['id'] in self._requests:
-            self.OnRequest(rr)
-        else:
-            self.OnResponse(self._requests[rr['id']], rr)
-            self._requests.pop(rr['id'])
+        frame = self._recv_buffer.NextFrame()
+        while frame is None:
+            if not self._recv_buffer.ReadFrom():
+                raise OSError(EPIPE, 'connection closed by server')
+            frame = self._recv_buffer.NextFrame()
+        return self._Dispatch(frame)
+
+    def _Dispatch(self, frame):
+        if self._recorder is not None:
+            self._recorder.Record('<', frame)
+        stats = self._stats
+        if stats is not None:
+            start = time()
+        # decode straight from the receive buffer
+        rr = self._codec.loads(frame)
+        if stats is not None:
+            decode_ms = (time() - start) * 1000
+        if not 'id' in rr or 'method' in rr:
+            if stats is not None:
+                stats.Received(rr.get('method'), len(frame), decode_ms)
+            self._notifications.put(rr)
+            return rr
+        with self._lock:
+            future = self._requests.pop(rr['id'], None)
+            if future is None and rr['id'] in self._cancelled:
+                # late answer to a cancelled request
+                self._cancelled.discard(rr['id'])
+                return rr
+        if future is None:
+            log.warn('recv response for unknown request: %s' % rr['id'])
+            return rr
+        if stats is not None and future.sent is not None:
+            stats.Received(future.request['method'], len(frame), decode_ms,
+                           (time() - future.sent) * 1000)
+        self.OnResponse(future, rr)
         return rr
 
-    def RecvMsgHeader(self):
-        read_utf8(self._output_fd, len('Content-Length: '))
-        msg = u''
-        msg += read_utf8(self._output_fd, 4)
-        while True:
-            if msg.endswith('\r\n\r\n'):
-                break
-            if len(msg) >= 23:  # sys.maxint + 4
-                raise Exception('bad protocol')
-            msg += read_utf8(self._output_fd, 1)
+    def _ReadLoop(self):
+        try:
+            while True:
+                self.RecvMsg()
+        except Exception as e:
+            if isinstance(e, OSError):
+                error = e
+            else:
+                log.exception('jsonrpc reader failed')
+                error = OSError(EPIPE, str(e))
+        with self._lock:
+            self._reader_error = error
+            pending = list(self._requests.values())
+            self._requests.clear()
+        for future in pending:
+            future.set_error(error)
+        log.info('jsonrpc reader stopped: %s' % error)
+        self._notifications.put(None)
 
-        msg = msg[:-4]
-        length = int(msg)
-        return length
+    def _ReportServerDown(self):
+        if self._server_down_reported:
+            return
+        self._server_down_reported = True
+        self._observer.onServerDown()
 
     def OnNotification(self, request):
         log.debug('recv notification: %s' % request)
@@ -147,6 +414,84 @@ class JsonRPCClient:
         log.debug('recv request: %s' % request)
         self._observer.onRequest(request['method'], request['params'])
 
-    def OnResponse(self, request, response):
+    # called on the reader thread
+    def OnResponse(self, future, response):
         log.debug('recv response: %s' % response)
-        self._observer.onResponse(request, response['result'])
+        if 'error' in response:
+            future.set_error(ErrorFromResponse(response['error']))
+        else:
+            future.set_result(response.get('result'))
+        self._observer.onResponse(future.request, response.get('result'))
+
+
+class ChannelJsonRPCClient(JsonRPCClient):
+    """Client for a server whose output is delivered by someone else, e.g.
+    a vim channel callback, instead of a reader thread. Everything runs on
+    the caller (ui) thread.
+
+    channel needs send(data) and read(timeout_ms), read returns the output
+    as bytes, an empty string if there was none for timeout_ms and None
+    once the channel is closed."""
+
+    def __init__(self, request_observer, channel, codec=None):
+        self._channel = channel
+        self._InitState(request_observer, FrameBuffer(), codec)
+
+    def feed(self, data):
+        """Takes server output, answers pending requests and queues
+        notifications for handleRecv()."""
+        if isinstance(data, type(u'')):
+            data = data.encode('utf-8')
+        self._recv_buffer.Feed(data)
+        while True:
+            frame = self._recv_buffer.NextFrame()
+            if frame is None:
+                break
+            self._Dispatch(frame)
+
+    def close(self, error=None):
+        """The channel is gone, fails pending requests."""
+        if error is None:
+            error = OSError(EPIPE, 'connection closed by server')
+        with self._lock:
+            if self._reader_error is not None:
+                return
+            self._reader_error = error
+            pending = list(self._requests.values())
+            self._requests.clear()
+        for future in pending:
+            future.set_error(error)
+        self._notifications.put(None)
+
+    def _Write(self, header, body, queue_key, replace_queued):
+        # vim queues what the pipe does not take
+        self._channel.send(header + body)
+
+    def _WaitFor(self, future, deadline):
+        # nobody else reads while we block, pull the output ourselves
+        while not future.done() and not deadline.expired():
+            remaining = deadline.remaining()
+            # -1 waits until there is output
+            timeout_ms = -1 if remaining is None else max(
+                int(remaining * 1000), 1)
+            data = self._channel.read(timeout_ms)
+            if data is None:
+                self.close()
+            elif data:
+                self.feed(data)
+        if not future.done():
+            raise TimeoutError(ETIME, 'request %s timed out' %
+                               future.request['method'])
+        return future.result()
+
+    def isReaderAlive(self):
+        return self._reader_error is None
+
+    def joinReader(self, timeout=None):
+        pass
+
+    def flush(self, timeout=None):
+        return True
+
+    def closeWriter(self, timeout=None):
+        pass
@@ -1,23 +1,31 @@
 from vimsupport import EchoMessage
+import startup_report
 import vim
 import os
 
 try:
+  startup_report.Start('log')
   import glog as log
   log_level = str(vim.eval('g:clangd#log_level'))
   log_path = os.path.expanduser(str(vim.eval('g:clangd#log_path')))
   if not os.path.exists(log_path):
       os.makedirs(log_path)
   log.init(log_level, log_path + '/vim-clangd.log')
+  startup_report.Finish('log')
 except Exception as e:
   EchoMessage(str(e))
   raise
 
 try:
+  startup_report.Start('imports')
   from clangd_manager import ClangdManager
   from event_dispatcher import EventDispatcher
+  startup_report.Finish('imports')
+  # includes spawning clangd with g:clangd#autostart
+  startup_report.Start('manager')
   manager = ClangdManager()
   handler = EventDispatcher(manager)
+  startup_report.Finish('manager')
 except Exception as e:
   EchoMessage(str(e))
   log.exception(e)
@@ -1,6 +1,6 @@
 # LSP Client
 # https://github.com/Microsoft/language-server-protocol/blob/master/protocol.md
-from jsonrpc import JsonRPCClient
+from jsonrpc import JsonRPCClient, ChannelJsonRPCClient
 from subprocess import check_output, CalledProcessError, Popen
 from signal import signal, SIGCHLD, SIG_IGN
 import glog as log
@@ -20,64 +20,243 @@ DidCloseTextDocument_NOTIFICATION = 'textDocument/didClose'
 
 PublishDiagnostics_NOTIFICATION = 'textDocument/publishDiagnostics'
 
-def StartProcess(name, clangd_log_path = None):
-    from os import pipe, devnull
+# TextDocumentSyncKind
+TextDocumentSyncKind_None = 0
+TextDocumentSyncKind_Full = 1
+TextDocumentSyncKind_Incremental = 2
+
+# budgets for blocking requests in milliseconds, None waits forever
+REQUEST_TIMEOUTS_MS = {
+    Initialize_REQUEST: 5000,
+    Shutdown_REQUEST: 1000,
+    Completion_REQUEST: 150,
+}
+DEFAULT_REQUEST_TIMEOUT_MS = 5000
+
+# clients watching for their clangd to exit, SIGCHLD is process wide
+_sigchld_clients = []
+
+
+def _OnSigChld(signum, frame):
+    for client in list(_sigchld_clients):
+        client.OnSigChld()
+
+
+def ServerLogPath(clangd_log_path):
+    # clangd's own log is only kept when we log at debug level too
     if not clangd_log_path or not log.logger.isEnabledFor(log.DEBUG):
-        clangd_log_path = devnull
-    fdClangd = open(clangd_log_path, 'w+')
+        return os.devnull
+    return clangd_log_path
+
+
+def StartProcess(name, clangd_log_path = None):
+    from os import pipe
+    fdClangd = open(ServerLogPath(clangd_log_path), 'w+')
     fdInRead, fdInWrite = pipe()
     fdOutRead, fdOutWrite = pipe()
     clangd = Popen(name, stdin=fdInRead, stdout=fdOutWrite, stderr=fdClangd)
+    # the child owns these ends now, keeping them open here would hide EOF
+    # from the reader thread when clangd goes away
+    os.close(fdInRead)
+    os.close(fdOutWrite)
     return clangd, fdInWrite, fdOutRead, fdClangd
 
 
+def Utf16Length(line):
+    # lsp positions count utf-16 code units
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    return len(line.encode('utf-16-le')) // 2
+
+
+def DiffLines(old_lines, new_lines):
+    """Returns the number of common leading and trailing lines as
+    (prefix, suffix), or None if both are equal. Lines old[prefix:-suffix]
+    were replaced by new[prefix:-suffix]."""
+    old_len = len(old_lines)
+    new_len = len(new_lines)
+    limit = min(old_len, new_len)
+    prefix = 0
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    if prefix == old_len and prefix == new_len:
+        return None
+    suffix = 0
+    limit -= prefix
+    while (suffix < limit and
+           old_lines[old_len - 1 - suffix] == new_lines[new_len - 1 - suffix]):
+        suffix += 1
+    return prefix, suffix
+
+
+def ComputeContentChanges(old_lines, new_lines, diff=None):
+    """Returns incremental contentChanges turning old_lines into new_lines
+    as one ranged edit over the lines in between their common prefix and
+    suffix, or [] if both are equal."""
+    if diff is None:
+        diff = DiffLines(old_lines, new_lines)
+    if diff is None:
+        return []
+    prefix, suffix = diff
+    old_len = len(old_lines)
+    new_len = len(new_lines)
+
+    inserted = new_lines[prefix:new_len - suffix]
+    if suffix:
+        # replace whole lines, the range ends at the first common line
+        start = (prefix, 0)
+        end = (old_len - suffix, 0)
+        text = ''.join(line + '\n' for line in inserted)
+    elif prefix:
+        # the edit runs to the end of the document which has no trailing
+        # newline, start right after the last common line instead
+        start = (prefix - 1, Utf16Length(old_lines[prefix - 1]))
+        end = (old_len - 1, Utf16Length(old_lines[-1]))
+        text = ''.join('\n' + line for line in inserted)
+    else:
+        start = (0, 0)
+        end = (max(old_len - 1, 0),
+               Utf16Length(old_lines[-1]) if old_lines else 0)
+        text = '\n'.join(inserted)
+    return [{
+        'range': {
+            'start': {'line': start[0], 'character': start[1]},
+            'end': {'line': end[0], 'character': end[1]}
+        },
+        'text': text
+    }]
+
+
 class LSPClient():
-    def __init__(self, clangd_executable, clangd_log_path, manager):
+    def __init__(self, clangd_executable, clangd_log_path, manager,
+                 use_job=False, root=None):
+        self._is_alive = True
+        self._manager = manager
+        # project directory sent as rootUri
+        self._root = root or os.getcwd()
+        self._timeouts = dict(REQUEST_TIMEOUTS_MS)
+        self._sync_kind = TextDocumentSyncKind_Full
+        self._initialize = None
+        self._recorder = None
+        if use_job:
+            # output is pushed to feedOutput() by vim, no reader thread
+            from job_channel import JobChannel
+            clangd = JobChannel([clangd_executable],
+                                ServerLogPath(clangd_log_path))
+            self._clangd = clangd
+            self._channel_id = clangd.id
+            self._input_fd = self._output_fd = self._clangd_logfd = None
+            self._rpcclient = ChannelJsonRPCClient(self, clangd)
+            log.info('clangd started as vim job, pid %d' % clangd.pid)
+            return
         clangd, fdRead, fdWrite, fdClangd = StartProcess(
             clangd_executable, clangd_log_path)
         log.info('clangd started, pid %d' % clangd.pid)
         self._clangd = clangd
+        self._channel_id = None
         self._input_fd = fdRead
         self._output_fd = fdWrite
         self._clangd_logfd = fdClangd
         self._rpcclient = JsonRPCClient(self, fdRead, fdWrite)
-        self._is_alive = True
-        self._manager = manager
         self.RegisterSignalHandler()
 
     def RegisterSignalHandler(self):
-        signal(SIGCHLD, lambda signal, frname: self.OnSigChld())
+        if not _sigchld_clients:
+            signal(SIGCHLD, _OnSigChld)
+        _sigchld_clients.append(self)
 
     def DeregisterSignalHandler(self):
-        signal(SIGCHLD, SIG_IGN)
+        if self in _sigchld_clients:
+            _sigchld_clients.remove(self)
+        if not _sigchld_clients:
+            signal(SIGCHLD, SIG_IGN)
 
     def OnSigChld(self):
         if not self._is_alive:
             return
         # we have lots child processes to spawn and exit with vim
-        # it is saving our live to detect clangd process here
-        try:
-            os.kill(self._clangd.pid, 0)
-        except OSError:
+        # it is saving our live to detect clangd process here, a zombie
+        # still answers kill(pid, 0) so reap it
+        if self._clangd.poll() is not None:
             self.onServerDown()
 
     def CleanUp(self):
-        self.DeregisterSignalHandler()
+        if self._channel_id is None:
+            self.DeregisterSignalHandler()
         if self._clangd.poll() == None:
             self._clangd.terminate()
         if self._clangd.poll() == None:
             self._clangd.kill()
         log.info('clangd stopped, pid %d' % self._clangd.pid)
-        self._clangd_logfd.close()
-        os.close(self._input_fd)
-        os.close(self._output_fd)
+        # clangd is gone, the reader thread sees EOF and exits
+        self._rpcclient.closeWriter(1)
+        self._rpcclient.joinReader(1)
+        if self._recorder:
+            self._recorder.Close()
+        if self._channel_id is None:
+            self._clangd_logfd.close()
+            os.close(self._input_fd)
+            os.close(self._output_fd)
+
+    def pid(self):
+        return self._clangd.pid
+
+    def setManager(self, manager):
+        """Reports to another manager, e.g. once a standby is taken."""
+        self._manager = manager
+
+    def channelId(self):
+        """vim channel id of a job started server, None otherwise"""
+        return self._channel_id
+
+    def feedOutput(self, data):
+        self._rpcclient.feed(data)
+        self._rpcclient.handleRecv()
+
+    def onJobExit(self, status):
+        log.info('clangd job exited with %d' % status)
+        self._clangd.exited(status)
+        self._rpcclient.close()
+        # reports the server down once, like the reader thread does
+        self._rpcclient.handleRecv()
+
+    def setRequestTimeout(self, method, timeout_ms):
+        self._timeouts[method] = timeout_ms
+
+    def requestTimeout(self, method):
+        """Budget of method in milliseconds, None waits forever."""
+        return self._timeouts.get(method, DEFAULT_REQUEST_TIMEOUT_MS)
+
+    def setStats(self, stats):
+        self._rpcclient.setStats(stats)
+
+    def setRecorder(self, recorder):
+        self._recorder = recorder
+        self._rpcclient.setRecorder(recorder)
+
+    def sendRequest(self, method, params={}, nullResponse=False,
+                    supersede=None):
+        timeout_ms = self.requestTimeout(method)
+        timeout = None if timeout_ms is None else timeout_ms / 1000.0
+        return self._rpcclient.sendRequest(method, params,
+                                           nullResponse=nullResponse,
+                                           timeout=timeout,
+                                           supersede=supersede)
+
+    def waitRequest(self, future):
+        """Waits for a request sent asynchronously, within the budget of
+        its method."""
+        timeout_ms = self.requestTimeout(future.request['method'])
+        timeout = None if timeout_ms is None else timeout_ms / 1000.0
+        return self._rpcclient.waitRequest(future, timeout)
 
     def isAlive(self):
         return self._is_alive and self._clangd.poll() == None
 
     def onNotification(self, method, params):
         if method == PublishDiagnostics_NOTIFICATION:
-            self.onDiagnostics(params['uri'], params['diagnostics'])
+            self.onDiagnostics(params['uri'], params['diagnostics'],
+                               params.get('version'))
         pass
 
     def onRequest(self, method, params):
@@ -88,28 +267,65 @@ class LSPClient():
 
     def onServerDown(self):
         self._is_alive = False
-        self._manager.on_server_down()
+        self._manager.on_server_down(self)
 
-    def initialize(self):
-        rr = self._rpcclient.sendRequest(Initialize_REQUEST, {
+    def _InitializeParams(self):
+        return {
             'processId': os.getpid(),
-            'rootUri': 'file://' + os.getcwd(),
-            'capabilities': {},
+            'rootUri': 'file://' + self._root,
+            'capabilities': {
+                'textDocument': {
+                    'synchronization': {
+                        'dynamicRegistration': False,
+                        'didSave': True
+                    }
+                }
+            },
             'trace': 'off'
-        })
-        log.info('clangd connected with piped fd')
-        log.info('clangd capabilities: %s' % rr['capabilities'])
-        self._manager.on_server_connected()
+        }
+
+    def initialize(self):
+        rr = self.sendRequest(Initialize_REQUEST, self._InitializeParams())
+        self._OnInitializeResult(rr)
+        self._manager.on_server_connected(self)
         return rr
 
+    def initializeAsync(self):
+        """Sends initialize without waiting for the answer, pollInitialize()
+        tells when it came. on_server_connected is not called."""
+        self._initialize = self._rpcclient.sendRequestAsync(
+            Initialize_REQUEST, self._InitializeParams())
+
+    def pollInitialize(self):
+        """Returns whether the server answered initialize, raises the error
+        it answered with."""
+        if not self._initialize.done():
+            return False
+        self._OnInitializeResult(self._initialize.result())
+        return True
+
+    def _OnInitializeResult(self, rr):
+        log.info('clangd connected with %s' %
+                 ('piped fd' if self._channel_id is None else 'vim job'))
+        log.info('clangd capabilities: %s' % rr['capabilities'])
+        sync_kind = rr['capabilities'].get('textDocumentSync')
+        if isinstance(sync_kind, dict):
+            sync_kind = sync_kind.get('change')
+        self._sync_kind = sync_kind or TextDocumentSyncKind_None
+
+    def supportsIncrementalSync(self):
+        return self._sync_kind == TextDocumentSyncKind_Incremental
+
     def onInitialized(self):
         return self._rpcclient.sendNotification(Initialized_NOTIFICATION)
 
     def shutdown(self):
-        return self._rpcclient.sendRequest(Shutdown_REQUEST, nullResponse=True)
+        return self.sendRequest(Shutdown_REQUEST, nullResponse=True)
 
     def exit(self):
         self._rpcclient.sendNotification(Exit_NOTIFICATION)
+        # give clangd the chance to exit on its own
+        self._rpcclient.flush(1)
         self.CleanUp()
 
     def handleClientRequests(self):
@@ -130,17 +346,23 @@ class LSPClient():
                 }
             })
 
-    def didChangeTestDocument(self, uri, version, content):
+    def didChangeTestDocument(self, uri, version, content, changes=None):
+        # ranged changes are only sent if the server asked for them,
+        # otherwise the full content is
+        full_text = changes is None or not self.supportsIncrementalSync()
+        if full_text:
+            changes = [{'text': content}]
+        # the full text makes queued changes of the document obsolete
         return self._rpcclient.sendNotification(
             DidChangeTextDocument_NOTIFICATION, {
                 'textDocument': {
                     'uri': uri,
                     'version': version
                 },
-                'contentChanges': [{
-                    'text': content
-                }]
-            })
+                'contentChanges': changes
+            },
+            queue_key=(DidChangeTextDocument_NOTIFICATION, uri),
+            replace_queued=full_text)
 
     def didCloseTestDocument(self, uri):
         return self._rpcclient.sendNotification(
@@ -154,11 +376,15 @@ class LSPClient():
                 'uri': uri
             }})
 
-    def onDiagnostics(self, uri, diagnostics):
-        self._manager.onDiagnostics(uri, diagnostics)
+    def onDiagnostics(self, uri, diagnostics, version=None):
+        self._manager.onDiagnostics(uri, diagnostics, version)
 
     def completeAt(self, uri, line, character):
-        return self._rpcclient.sendRequest(Completion_REQUEST, {
+        return self.waitRequest(self.completeAtAsync(uri, line, character))
+
+    def completeAtAsync(self, uri, line, character):
+        # a newer completion in the same document makes this one stale
+        return self._rpcclient.sendRequestAsync(Completion_REQUEST, {
             'textDocument': {
                 'uri': uri,
             },
@@ -166,4 +392,4 @@ class LSPClient():
                 'line': line,
                 'character': character
             }
-        })
+        }, supersede=uri)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# Outgoing message queue drained by a writer thread.
+#
+# Senders only queue the encoded header and body and return, so a server
+# busy parsing with a full pipe no longer freezes vim. The writer thread
+# writes header and body with one writev(2) on the non-blocking fd and
+# waits for it to become writable in between. Queued messages sharing a
+# key can be replaced by a newer one before they are written, e.g. a full
+# text didChange makes earlier queued changes of that document pointless.
+import errno
+import os
+import threading
+import glog as log
+from collections import deque
+from timeout import Deadline, TimeoutError, WaitWritable
+
+# senders wait once this much is queued, the server is not reading
+MAX_QUEUED_BYTES = 16 * 1024 * 1024
+# how often a writer waiting for a writable fd checks for close()
+_WAKEUP_INTERVAL = 0.5
+
+
+def _WriteV(fd, buffers):
+    return os.writev(fd, buffers)
+
+
+def _WriteFirst(fd, buffers):
+    # no writev before python 3.3
+    return os.write(fd, buffers[0])
+
+
+WriteBuffers = _WriteV if hasattr(os, 'writev') else _WriteFirst
+
+
+class _Message(object):
+    __slots__ = ('buffers', 'size', 'key')
+
+    def __init__(self, buffers, key):
+        self.buffers = buffers
+        self.size = sum(len(buf) for buf in buffers)
+        self.key = key
+
+
+class MessageWriter(object):
+    def __init__(self, fd):
+        self._fd = fd
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._queued_bytes = 0
+        # the message being written, it can no longer be replaced
+        self._writing = None
+        self._error = None
+        self._closed = False
+        self.messages = 0
+        self.replaced = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._WriteLoop,
+                                        name='jsonrpc-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, header, body, key=None, replace=False, timeout=None):
+        """Queues header and body (bytes). With replace, queued messages
+        with the same key that are not being written yet are dropped. Waits
+        up to timeout for the queue to drain below MAX_QUEUED_BYTES."""
+        message = _Message([memoryview(header), memoryview(body)], key)
+        deadline = Deadline(timeout)
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                raise OSError(errno.EPIPE, 'writer closed')
+            if replace and key is not None:
+                self._DropQueued(key)
+            while (self._queued_bytes and
+                   self._queued_bytes + message.size > MAX_QUEUED_BYTES):
+                if deadline.expired():
+                    raise TimeoutError(errno.ETIME,
+                                       'server is not reading its input')
+                self._cond.wait(deadline.remaining())
+                if self._error is not None:
+                    raise self._error
+            self._queue.append(message)
+            self._queued_bytes += message.size
+            self.messages += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until everything queued is written, returns whether it
+        was."""
+        deadline = Deadline(timeout)
+        with self._cond:
+            while ((self._queue or self._writing) and self._error is None
+                   and not deadline.expired()):
+                self._cond.wait(deadline.remaining())
+            return not self._queue and not self._writing
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _DropQueued(self, key):
+        kept = deque()
+        for message in self._queue:
+            if message.key == key:
+                self._queued_bytes -= message.size
+                self.replaced += 1
+            else:
+                kept.append(message)
+        self._queue = kept
+
+    def _WriteLoop(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and not self._closed:
+                        self._cond.wait()
+                    if not self._queue:
+                        return
+                    message = self._writing = self._queue.popleft()
+                self._Write(message.buffers)
+                with self._cond:
+                    self._writing = None
+                    self._queued_bytes -= message.size
+                    self._cond.notify_all()
+        except Exception as e:
+            if isinstance(e, OSError):
+                error = e
+            else:
+                log.exception('jsonrpc writer failed')
+                error = OSError(errno.EPIPE, str(e))
+            log.info('jsonrpc writer stopped: %s' % error)
+            with self._cond:
+                self._error = error
+                self._writing = None
+                self._cond.notify_all()
+
+    def _Write(self, buffers):
+        while buffers:
+            try:
+                written = WriteBuffers(self._fd, buffers)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    self._WaitWritable()
+                    continue
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            self.writes += 1
+            # skip what was written without copying the rest
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and written:
+                buffers[0] = buffers[0][written:]
+
+    def _WaitWritable(self):
+        while True:
+            try:
+                WaitWritable(self._fd, Deadline(_WAKEUP_INTERVAL))
+                return
+            except TimeoutError:
+                with self._cond:
+                    if self._closed:
+                        raise OSError(errno.EPIPE, 'writer closed')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Per method statistics of the LSP traffic, for :ClangdStats.
+#
+# Times go into histograms with fixed buckets, so recording is a bisect and
+# an increment and the memory used does not grow with the traffic:
+#
+#   encode  serializing an outgoing message
+#   decode  parsing an incoming one
+#   wait    from sending a request to its response being parsed
+#   render  turning the result into what vim shows
+#
+# Nothing is recorded unless the clients were given a RpcStats, see
+# JsonRPCClient.setStats().
+import json
+import threading
+from bisect import bisect_left
+
+# upper bounds of the buckets in milliseconds, the last one is unbounded
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+              1000, 2500, 5000)
+TIMES = ('encode', 'decode', 'wait', 'render')
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def Add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def Percentile(self, p):
+        """Upper bound of the bucket holding the p-th sample, the largest
+        sample for the unbounded bucket."""
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def Mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def ToJson(self):
+        return {'count': self.count, 'total_ms': self.total,
+                'max_ms': self.max, 'buckets': self.counts}
+
+
+class MethodStats:
+    def __init__(self):
+        # requests or notifications sent, notifications received
+        self.sent = 0
+        self.received = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.times = dict((name, Histogram()) for name in TIMES)
+
+    def ToJson(self):
+        stats = {'sent': self.sent, 'received': self.received,
+                 'bytes_out': self.bytes_out, 'bytes_in': self.bytes_in}
+        for name, histogram in self.times.items():
+            stats[name] = histogram.ToJson()
+        return stats
+
+
+class RpcStats:
+    def __init__(self):
+        # method -> MethodStats
+        self.methods = {}
+        # the reader thread records too
+        self._lock = threading.Lock()
+
+    def _Method(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        return stats
+
+    def Sent(self, method, size, encode_ms):
+        with self._lock:
+            stats = self._Method(method)
+            stats.sent += 1
+            stats.bytes_out += size
+            stats.times['encode'].Add(encode_ms)
+
+    def Received(self, method, size, decode_ms, wait_ms=None):
+        """A message came in, wait_ms is given for responses."""
+        with self._lock:
+            stats = self._Method(method)
+            stats.bytes_in += size
+            stats.times['decode'].Add(decode_ms)
+            if wait_ms is None:
+                stats.received += 1
+            else:
+                stats.times['wait'].Add(wait_ms)
+
+    def Rendered(self, method, render_ms):
+        with self._lock:
+            self._Method(method).times['render'].Add(render_ms)
+
+    def Reset(self):
+        with self._lock:
+            self.methods = {}
+
+    def ToJson(self):
+        with self._lock:
+            return {'buckets_ms': list(BUCKETS_MS),
+                    'methods': dict((method, stats.ToJson()) for method, stats
+                                    in self.methods.items())}
+
+    def Dump(self, path, extra=None):
+        """extra maps section names to more statistics written along."""
+        stats = self.ToJson()
+        stats.update(extra or {})
+        with open(path, 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+
+    def Report(self):
+        """A line per method, most sent first. Times are mean/p99 in
+        milliseconds, p99 is the upper bound of its bucket."""
+        with self._lock:
+            methods = sorted(self.methods.items(),
+                             key=lambda item: -(item[1].sent +
+                                                item[1].received))
+            lines = ['%-34s %6s %6s %9s %9s %13s %13s %13s %13s' % (
+                'method', 'sent', 'recv', 'KB out', 'KB in', 'encode',
+                'decode', 'wait', 'render')]
+            for method, stats in methods:
+                times = []
+                for name in TIMES:
+                    histogram = stats.times[name]
+                    times.append('%6.2f/%6.2f' % (
+                        histogram.Mean(), histogram.Percentile(0.99))
+                        if histogram.count else '-')
+                lines.append('%-34s %6d %6d %9.1f %9.1f %13s %13s %13s %13s'
+                             % ((method[:34], stats.sent, stats.received,
+                                 stats.bytes_out / 1024.0,
+                                 stats.bytes_in / 1024.0) + tuple(times)))
+        return '\n'.join(lines)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Waits for the initialize answer of freshly started servers without
+# blocking vim.
+#
+# initialize is sent with LSPClient.initializeAsync(), a timer then polls
+# every HANDSHAKE_POLL_MS until the server answered. Documents are not sent
+# to a server in its handshake, the manager opens the buffers of its project
+# once connected() is called, with whatever was typed in the meantime. A
+# server which did not answer within the initialize budget of its client
+# failed, like initialize() would have timed out.
+import errno
+
+from event_dispatcher import OneShotTimer
+from lsp_client import Initialize_REQUEST
+from timeout import Deadline, TimeoutError
+
+HANDSHAKE_POLL_MS = 20
+
+
+class ServerHandshake:
+    def __init__(self, connected, failed, native_timer):
+        """connected(client) is called once a client answered initialize,
+        failed(client) if it answered with an error, went down or took too
+        long."""
+        self._connected = connected
+        self._failed = failed
+        self._clients = []
+        # client -> Deadline of its answer
+        self._deadlines = {}
+        self._timer = OneShotTimer('handshake', self.OnTimerCallback,
+                                   native_timer)
+
+    def Start(self, client):
+        timeout_ms = client.requestTimeout(Initialize_REQUEST)
+        client.initializeAsync()
+        self._clients.append(client)
+        self._deadlines[client] = Deadline(
+            None if timeout_ms is None else timeout_ms / 1000.0)
+        self._Arm()
+
+    def isPending(self, client):
+        return client in self._clients
+
+    def Forget(self, client):
+        if client in self._clients:
+            self._clients.remove(client)
+            del self._deadlines[client]
+        if not self._clients:
+            self.Stop()
+
+    def Check(self):
+        """Connects the clients which answered, e.g. as soon as a vim job
+        delivered the answer, fails the ones out of time."""
+        for client in list(self._clients):
+            try:
+                ready = client.pollInitialize()
+                if not ready and self._deadlines[client].expired():
+                    raise TimeoutError(errno.ETIME,
+                                       'clangd did not answer initialize')
+            except:
+                self.Forget(client)
+                self._failed(client)
+                continue
+            if ready:
+                self.Forget(client)
+                self._connected(client)
+
+    def Stop(self):
+        self._timer.Stop()
+
+    def OnTimerCallback(self):
+        for client in list(self._clients):
+            # reads a piped answer, notices a server that went down
+            client.handleClientRequests()
+            if not client.isAlive():
+                self.Forget(client)
+        self.Check()
+        if self._clients:
+            self._Arm()
+
+    def _Arm(self):
+        if not self._timer.isArmed():
+            self._timer.Start(HANDSHAKE_POLL_MS)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# One clangd per project, keyed by the project root of the files.
+#
+# The root of a file is the nearest directory above it holding a
+# compile_commands.json or a .git, files outside of any project share the
+# server of the working directory. Servers are kept in least recently used
+# order so the manager can stop idle ones once there are too many.
+import os
+from collections import OrderedDict
+
+ROOT_MARKERS = ('compile_commands.json', '.git')
+
+
+class ServerPool:
+    def __init__(self, max_servers):
+        self._max_servers = max_servers
+        # root -> client, least recently used first
+        self._servers = OrderedDict()
+        # directory -> root, directories are looked up once
+        self._roots = {}
+
+    def __len__(self):
+        return len(self._servers)
+
+    def RootFor(self, file_name):
+        return self.RootForDirectory(
+            os.path.dirname(os.path.realpath(file_name)))
+
+    def RootForDirectory(self, directory):
+        root = self._roots.get(directory)
+        if root is not None:
+            return root
+        path = directory
+        while True:
+            if any(os.path.exists(os.path.join(path, marker))
+                   for marker in ROOT_MARKERS):
+                root = path
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                root = os.getcwd()
+                break
+            path = parent
+        self._roots[directory] = root
+        return root
+
+    def Get(self, root):
+        """The server of root, which becomes the most recently used."""
+        client = self._servers.pop(root, None)
+        if client is not None:
+            self._servers[root] = client
+        return client
+
+    def Peek(self, root):
+        """The server of root, leaving the order alone."""
+        return self._servers.get(root)
+
+    def Add(self, root, client):
+        self._servers.pop(root, None)
+        self._servers[root] = client
+
+    def Remove(self, root):
+        return self._servers.pop(root, None)
+
+    def RootOf(self, client):
+        for root, server in self._servers.items():
+            if server is client:
+                return root
+        return None
+
+    def Roots(self):
+        """least recently used first"""
+        return list(self._servers.keys())
+
+    def Clients(self):
+        return list(self._servers.values())
+
+    def isFull(self):
+        """Whether a server has to go before another one is added, a limit
+        of 0 means no limit."""
+        return 0 < self._max_servers <= len(self._servers)
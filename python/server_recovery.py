@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Restarts clangd after it went down unexpectedly.
+#
+# Restarts are delayed with exponential backoff over the crashes seen in the
+# last CRASH_LOOP_WINDOW seconds. Once CRASH_LOOP_LIMIT crashes happen within
+# that window clangd is left down until it is started by hand.
+import glog as log
+from event_dispatcher import OneShotTimer
+
+from collections import deque
+from time import time
+
+INITIAL_BACKOFF_MS = 250
+MAX_BACKOFF_MS = 16000
+CRASH_LOOP_WINDOW = 120
+CRASH_LOOP_LIMIT = 5
+
+
+class ServerRecovery:
+    def __init__(self, restart, native_timer):
+        """restart() starts the server again, a restart that fails is
+        reported with ServerDown() like a crash."""
+        self._restart = restart
+        self._crashes = deque()
+        # when the server went down, None while it is up
+        self._down_since = None
+        self._timer = OneShotTimer('recovery', self.OnTimerCallback,
+                                   native_timer)
+        self.gave_up = False
+        self.restarts = 0
+        self.recoveries = 0
+
+    def isPending(self):
+        return self._timer.isArmed()
+
+    def ServerDown(self):
+        """Schedules a restart, returns False if clangd is crash looping
+        and will not be restarted."""
+        now = time()
+        if self._down_since is None:
+            self._down_since = now
+        self._crashes.append(now)
+        while self._crashes and self._crashes[0] < now - CRASH_LOOP_WINDOW:
+            self._crashes.popleft()
+        if len(self._crashes) >= CRASH_LOOP_LIMIT:
+            log.error('clangd went down %d times in %ds, not restarting' %
+                      (len(self._crashes), CRASH_LOOP_WINDOW))
+            self.gave_up = True
+            self.Stop()
+            return False
+        delay = min(INITIAL_BACKOFF_MS * 2 ** (len(self._crashes) - 1),
+                    MAX_BACKOFF_MS)
+        log.info('restarting clangd in %dms' % delay)
+        self._Arm(delay)
+        return True
+
+    def Recovered(self, documents):
+        """The restarted server is initialized and has the documents."""
+        if self._down_since is None:
+            return
+        self.recoveries += 1
+        log.warn('clangd recovered %.0fms after going down, %d documents '
+                 'reopened' % ((time() - self._down_since) * 1000, documents))
+        self._down_since = None
+
+    def Reset(self):
+        """Forgets earlier crashes, e.g. when clangd is started by hand."""
+        self.Stop()
+        self._crashes.clear()
+        self._down_since = None
+        self.gave_up = False
+
+    def Stop(self):
+        self._timer.Stop()
+
+    def OnTimerCallback(self):
+        self.restarts += 1
+        try:
+            self._restart()
+        except:
+            log.exception('failed to restart clangd')
+            self.ServerDown()
+
+    def _Arm(self, delay_ms):
+        self._timer.Start(delay_ms)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# A second clangd kept initialized and idle to take over from the active one.
+#
+# The standby is spawned from a timer and its initialize handshake runs in
+# the background, so restarting after a crash or by hand only swaps the
+# client and replays the open documents. No standby is kept while the active
+# clangd uses more memory than the configured limit.
+import glog as log
+from event_dispatcher import OneShotTimer
+
+# after the active server was started or replaced
+REFILL_DELAY_MS = 2000
+# while the standby waits for its initialize response
+INITIALIZE_POLL_MS = 100
+# the memory limit is checked this often once the standby is ready
+CHECK_INTERVAL_MS = 30000
+# standbys going down before use, in a row, before giving up on them
+MAX_FAILURES = 3
+
+
+def ResidentSetSize(pid):
+    """Resident memory of a process in bytes, None where /proc has no
+    answer."""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class StandbyServer:
+    def __init__(self, spawn, active_pid, memory_limit_mb, native_timer):
+        """spawn(observer, root) starts a clangd client for the project
+        reporting to observer, active_pid(root) is the pid of the active
+        clangd of the project or None."""
+        self._spawn = spawn
+        self._active_pid = active_pid
+        self._memory_limit = memory_limit_mb * 1024 * 1024
+        # project of the last server started, the standby is for it
+        self._root = None
+        self._client = None
+        self._client_root = None
+        self._ready = False
+        self._failures = 0
+        self._timer = OneShotTimer('standby', self.OnTimerCallback,
+                                   native_timer)
+        self.spawned = 0
+        self.taken = 0
+
+    def ClientForChannel(self, channel_id):
+        if self._client and self._client.channelId() == channel_id:
+            return self._client
+        return None
+
+    def Take(self, root):
+        """Hands over the initialized standby client of the project, None
+        if there is none. The caller becomes its observer."""
+        if (not self._ready or self._client_root != root or
+                not self._client.isAlive()):
+            return None
+        client = self._client
+        self._client = None
+        self._ready = False
+        self.taken += 1
+        log.info('standby clangd taken over, pid %d' % client.pid())
+        return client
+
+    def Refill(self, root=None, delay_ms=REFILL_DELAY_MS):
+        """Spawns a standby for root later unless one is there already,
+        without root for the project it was last refilled for."""
+        if root is not None:
+            self._root = root
+        if self._failures < MAX_FAILURES and self._root is not None:
+            self._Arm(delay_ms)
+
+    def Stop(self):
+        self._timer.Stop()
+        self._Discard()
+
+    def OnTimerCallback(self):
+        try:
+            self._Check()
+        except:
+            log.exception('failed to keep a standby clangd')
+            self._failures += 1
+            self._Discard()
+            self.Refill()
+
+    def _Check(self):
+        if self._OverMemoryLimit():
+            self._Discard()
+            self._Arm(CHECK_INTERVAL_MS)
+            return
+        if self._client and self._client_root != self._root:
+            # the standby is for another project by now
+            self._Discard()
+        if not self._client:
+            self.spawned += 1
+            self._client_root = self._root
+            self._client = self._spawn(self, self._root)
+            self._client.initializeAsync()
+            log.info('standby clangd started, pid %d' % self._client.pid())
+        self._client.handleClientRequests()
+        if not self._client:
+            # went down, on_server_down refills
+            return
+        if not self._ready:
+            self._ready = self._client.pollInitialize()
+            if not self._ready:
+                self._Arm(INITIALIZE_POLL_MS)
+                return
+            self._failures = 0
+            log.info('standby clangd ready, pid %d' % self._client.pid())
+        self._Arm(CHECK_INTERVAL_MS)
+
+    def _OverMemoryLimit(self):
+        pid = self._active_pid(self._root)
+        if pid is None or self._memory_limit <= 0:
+            return False
+        rss = ResidentSetSize(pid)
+        if rss is None or rss <= self._memory_limit:
+            return False
+        if self._client:
+            log.info('clangd uses %dMB, no standby above %dMB' %
+                     (rss // (1024 * 1024),
+                      self._memory_limit // (1024 * 1024)))
+        return True
+
+    def _Discard(self):
+        client = self._client
+        self._client = None
+        self._ready = False
+        if not client:
+            return
+        try:
+            if client.isAlive():
+                client.shutdown()
+                client.exit()
+            else:
+                client.CleanUp()
+        except:
+            log.exception('failed to stop standby clangd')
+
+    def _Arm(self, delay_ms):
+        self._timer.Start(delay_ms)
+
+    # observer of the standby client
+    def on_server_connected(self, client):
+        pass
+
+    def on_server_down(self, client):
+        if client is not self._client or client.isAlive():
+            return
+        self._failures += 1
+        log.warn('standby clangd went down, pid %d' % self._client.pid())
+        self._Discard()
+        self.Refill()
+
+    def onDiagnostics(self, uri, diagnostics, version=None):
+        pass
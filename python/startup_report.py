@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# Wall time of the phases of the plugin startup.
+#
+# Only the first time a phase happens is recorded, restarts of clangd later
+# on are not startup. Phases may overlap, e.g. spawn is part of manager when
+# clangd is started by the ClangdManager constructor, and handshake runs in
+# the background.
+from time import time
+
+# [phase, seconds] in the order they finished
+_phases = []
+# phase -> time it started
+_started = {}
+
+
+def Add(phase, seconds):
+    if not _Recorded(phase):
+        _phases.append([phase, seconds])
+
+
+def Start(phase):
+    if not _Recorded(phase) and phase not in _started:
+        _started[phase] = time()
+
+
+def Finish(phase):
+    start = _started.pop(phase, None)
+    if start is not None:
+        Add(phase, time() - start)
+
+
+def _Recorded(phase):
+    return any(name == phase for name, _ in _phases)
+
+
+def Phases():
+    """[(phase, milliseconds)] in the order they finished"""
+    return [(phase, seconds * 1000) for phase, seconds in _phases]
+
+
+def Summary():
+    if not _phases:
+        return 'clangd plugin not started'
+    return 'startup: ' + ', '.join('%s %.1fms' % phase for phase in Phases())
@@ -1,25 +1,66 @@
-from functools import wraps
+# deadline aware waits for a file descriptor to become writable
+#
+# Unlike signal.alarm, a Deadline has sub-second precision, costs no extra
+# syscalls when the fd is ready, leaves vim's signal handlers alone and
+# works on any thread.
 import errno
+import math
 import os
-import signal
+import select
+from time import time
+
+try:
+    from time import monotonic as _now
+except ImportError:
+    _now = time
+
+_POLLOUT = getattr(select, 'POLLOUT', 4)
+
 
 class TimeoutError(OSError):
     pass
 
-def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
-    def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise TimeoutError(error_message)
 
-        def wrapper(*args, **kwargs):
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
+class Deadline(object):
+    """A point in time an operation must finish by, None never expires."""
+
+    def __init__(self, seconds=None):
+        if seconds is None:
+            self._expires = None
+        else:
+            self._expires = _now() + seconds
+
+    def remaining(self):
+        if self._expires is None:
+            return None
+        return max(0.0, self._expires - _now())
+
+    def expired(self):
+        return self._expires is not None and _now() >= self._expires
+
+
+def _PollWritable(fd, timeout_ms):
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(fd, _POLLOUT)
+        return bool(poller.poll(timeout_ms))
+    # no poll(2) on this platform
+    timeout = None if timeout_ms is None else timeout_ms / 1000.0
+    return any(select.select([], [fd], [fd], timeout))
 
-        return wraps(func)(wrapper)
 
-    return decorator
+def WaitWritable(fd, deadline=None,
+                 error_message=os.strerror(errno.ETIME)):
+    while True:
+        remaining = deadline.remaining() if deadline else None
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError(errno.ETIME, error_message)
+        timeout_ms = None
+        if remaining is not None:
+            timeout_ms = int(math.ceil(remaining * 1000))
+        try:
+            if _PollWritable(fd, timeout_ms):
+                return
+        except (OSError, select.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Records the LSP traffic of a server to disk, for bench/replay_trace.py.
+#
+# A trace holds the messages in the order they were sent or received, framed
+# like on the wire with an extra header giving the direction and the time:
+#
+#   Content-Length: 52\r\n
+#   X-Trace: > 1700000000.123456\r\n
+#   \r\n
+#   {"jsonrpc":"2.0","id":3,"method":"textDocument/completion",...}
+#
+# '>' went to the server, '<' came from it. Other tools reading framed
+# messages ignore the extra header, e.g. bench/bench_json_codec.py. Once a
+# trace reaches max_bytes it is rotated to FILE.1, FILE.1 to FILE.2 and so
+# on, keeping `keep` old ones.
+import os
+import threading
+from time import time
+
+import glog as log
+
+TRACE_HEADER = 'X-Trace'
+# buffered records are written at least this often
+FLUSH_INTERVAL = 1.0
+
+
+class TrafficRecorder:
+    def __init__(self, path, max_bytes, keep=2):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._keep = keep
+        # the reader thread records too
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._last_flush = time()
+        # a failed write stops the recording
+        self._broken = False
+        self.records = 0
+        self.rotations = 0
+
+    def path(self):
+        return self._path
+
+    def Record(self, direction, body):
+        """Appends a message, direction is '>' for sent and '<' for
+        received. body is its encoded json."""
+        header = ('Content-Length: %d\r\n%s: %s %.6f\r\n\r\n' % (
+            len(body), TRACE_HEADER, direction, time())).encode('ascii')
+        size = len(header) + len(body)
+        with self._lock:
+            if self._broken:
+                return
+            try:
+                if self._file is None:
+                    self._Open()
+                elif self._size + size > self._max_bytes > 0:
+                    self._Rotate()
+                self._file.write(header)
+                self._file.write(body)
+            except (IOError, OSError):
+                log.exception('failed to record traffic to %s' % self._path)
+                self._broken = True
+                self._Close()
+                return
+            self._size += size
+            self.records += 1
+            now = time()
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def Close(self):
+        with self._lock:
+            self._Close()
+
+    def _Close(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        except (IOError, OSError):
+            log.exception('failed to close %s' % self._path)
+        self._file = None
+
+    def _Open(self):
+        self._file = open(self._path, 'ab')
+        self._size = self._file.tell()
+
+    def _Rotate(self):
+        self._Close()
+        for i in range(self._keep, 0, -1):
+            older = '%s.%d' % (self._path, i)
+            newer = '%s.%d' % (self._path, i - 1) if i > 1 else self._path
+            if os.path.exists(newer):
+                os.rename(newer, older)
+        if self._keep <= 0:
+            os.remove(self._path)
+        self.rotations += 1
+        self._Open()
+
+
+def ReadTrace(path):
+    """Yields (direction, time, body) of the messages in a trace."""
+    with open(path, 'rb') as f:
+        while True:
+            length = None
+            direction = None
+            timestamp = None
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                line = line.strip()
+                if not line:
+                    break
+                name, _, value = line.decode('ascii').partition(':')
+                name = name.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == TRACE_HEADER.lower():
+                    direction, timestamp = value.split()
+            body = f.read(length)
+            if len(body) < length:
+                # cut off by a crash
+                return
+            yield direction, float(timestamp), body
@@ -2,12 +2,103 @@
 import vim
 import os
 import glog as log
+from contextlib import contextmanager
 
 
 def PyVersion():
   from sys import version_info
   return version_info.major
 
+# vim.command/vim.eval calls made through this module
+_round_trips = 0
+# work deferred by the outermost Batched() block, None outside of one
+_batch = None
+
+# matchaddpos() takes at most this many positions per call
+MAX_MATCH_POSITIONS = 8
+
+
+def RoundTrips():
+    return _round_trips
+
+
+def Command(command):
+    global _round_trips
+    _round_trips += 1
+    vim.command(command)
+
+
+def Eval(expression):
+    global _round_trips
+    _round_trips += 1
+    return vim.eval(expression)
+
+
+def Call(function, *args):
+    """Calls a vim function with python values as arguments, strings in
+    the result come back as bytes."""
+    global _round_trips
+    _round_trips += 1
+    return vim.Function(function)(*args)
+
+
+def EvalMany(expressions):
+    """Evaluates several expressions in one round trip."""
+    return Eval('[%s]' % ', '.join(expressions))
+
+
+def DeferCommand(command):
+    """Runs command when the current Batched() block ends, or right away
+    outside of one. Only for commands nothing reads back in between."""
+    if _batch is None:
+        Command(command)
+    else:
+        _batch.commands.append(command)
+
+
+class _Batch:
+    def __init__(self):
+        self.commands = []
+        # sign_placelist()/sign_unplacelist() entries
+        self.placed_signs = []
+        self.unplaced_signs = []
+
+
+@contextmanager
+def Batched():
+    """Gathers deferred commands, sign and match updates and sends them to
+    vim in a single command when the outermost block exits, also when it
+    exits with an exception."""
+    global _batch
+    if _batch is not None:
+        yield
+        return
+    _batch = _Batch()
+    try:
+        yield
+    finally:
+        batch = _batch
+        _batch = None
+        _FlushBatch(batch)
+
+
+def _FlushBatch(batch):
+    commands = []
+    if batch.unplaced_signs:
+        commands.append('silent! call sign_unplacelist([%s])' %
+                        ','.join(batch.unplaced_signs))
+    if batch.placed_signs:
+        commands.append('silent! call sign_placelist([%s])' %
+                        ','.join(batch.placed_signs))
+    commands.extend(batch.commands)
+    if not commands:
+        return
+    try:
+        Command(' | '.join("exe '%s'" % EscapeForVim(command)
+                           for command in commands))
+    except vim.error:
+        log.exception('failed to run %d batched commands' % len(commands))
+
 # Given an object, returns a str object that's utf-8 encoded.
 def ToUtf8IfNeeded(value):
     if PyVersion() < 3 and isinstance(value, unicode):
@@ -18,7 +109,7 @@ def ToUtf8IfNeeded(value):
 
 
 def PresentYesOrNoDialog(message):
-    return int(vim.eval('confirm("%s", "&Yes\n&No")' % message)) == 1
+    return int(Eval('confirm("%s", "&Yes\n&No")' % message)) == 1
 
 
 def CurrentLineAndColumn():
@@ -45,28 +136,19 @@ def CurrentBufferFileName():
 
 
 def CurrentFileTypes():
-    return vim.eval("&filetype").split('.')
+    return Eval("&filetype").split('.')
 
-def GetBufferByName(file_name):
-    for buf in vim.buffers:
-        if buf.name == file_name:
-            return buf
-    return None
-
-def ExtractUTF8Text(buf):
+def ExtractUTF8Lines(buf):
     if PyVersion() >= 3:
-        return '\n'.join(buf)
+        return buf[:]
 
     enc = buf.options['fileencoding']
-    if enc:
-        decoded_textbody = []
-        for chunk in buf:
-            decoded_textbody.append(chunk.decode(enc))
-        decoded_textbody = u'\n'.join(decoded_textbody)
-    else:
-        decoded_textbody = '\n'.join(buf).decode('utf-8')
-    textbody = decoded_textbody.encode('utf-8')
-    return textbody
+    if enc and enc != 'utf-8':
+        return [line.decode(enc).encode('utf-8') for line in buf]
+    return buf[:]
+
+def ExtractUTF8Text(buf):
+    return '\n'.join(ExtractUTF8Lines(buf))
 
 #TODO refine this
 def EscapeForVim(text):
@@ -85,59 +167,104 @@ def GetBufferOption(buffer_object, option):
 
 
 def GetVariableValue(variable):
-    return vim.eval(variable)
+    return Eval(variable)
 
 
 def GetBoolValue(variable):
-    return bool(int(vim.eval(variable)))
+    return bool(int(Eval(variable)))
 
 
 def GetIntValue(variable):
-    return int(vim.eval(variable))
+    return int(Eval(variable))
 
 
-def GetBufferNumberForFilename(filename, open_file_if_needed=True):
-    return GetIntValue(u"bufnr('{0}', {1})".format(
-        EscapeForVim(os.path.realpath(filename)), int(open_file_if_needed)))
+def StartTimer(delay_ms, name):
+    """Starts a vim timer calling clangd#OnTimer with name."""
+    return GetIntValue("timer_start({0}, function('clangd#OnTimer', "
+                       "['{1}']))".format(delay_ms, name))
 
 
-# clean all signs for existing buffer
-# FIXME clean clangdSigns only
-def UnplaceAllSigns():
-    buffer_num = vim.current.buffer.number
-    vim.command('sign unplace * buffer=%d' % buffer_num)
+def StopTimer(timer_id):
+    DeferCommand('call timer_stop({0})'.format(timer_id))
 
 
-def PlaceSignForErrorMessage(buffer_num, index, diagnostic):
-    if diagnostic['severity'] >= 3:
-        sign_name = 'clangdError'
-    else:
-        sign_name = 'clangdWarning'
+def IsBufferVisible(bufnr):
+    """Whether a window of the current tab shows the buffer."""
+    return GetIntValue('bufwinnr({0})'.format(bufnr)) != -1
 
-    try:
-        vim.command('sign place %d line=%d name=%s buffer=%d' %
-                    (index, diagnostic['lnum'], sign_name, buffer_num))
-    except:
-        log.exception('sign place %d line=%d name=%s buffer=%d' %
-                    (index, diagnostic['lnum'], sign_name, buffer_num))
+
+def StartJob(argv, stderr_path):
+    """Starts argv as a vim job talking raw over its stdin/stdout, returns
+    (channel id, pid), the channel id is -1 if it did not start."""
+    channel_id, pid = Call('clangd#JobStart', argv, stderr_path)
+    return int(channel_id), int(pid)
+
+
+def JobSend(channel_id, data):
+    Call('clangd#JobSend', channel_id, data)
+
+
+def JobRead(channel_id, timeout_ms):
+    """Returns output of the job, empty if there was none within
+    timeout_ms and None if its channel is closed."""
+    is_open, data = Call('clangd#JobRead', channel_id, timeout_ms)
+    if not int(is_open):
+        return None
+    return data
 
 
-def PlaceSignForErrorMessageArray(diagnostics):
-    buffer_num = vim.current.buffer.number
+def JobStop(channel_id, how):
+    Call('clangd#JobStop', channel_id, how)
 
-    index = 1
-    for line_num in diagnostics:
-        # FIXME we should show most severity error
-        PlaceSignForErrorMessage(buffer_num, index, diagnostics[line_num][0])
-        index += 1
 
+_features = {}
 
-def ConvertDiagnosticsToQfList(file_name, diagnostics):
+def HasFeature(expression):
+    """Evaluates a has()/exists() style expression once per session."""
+    if expression not in _features:
+        _features[expression] = GetBoolValue(expression)
+    return _features[expression]
+
+
+def CurrentWindowId():
+    if HasFeature("exists('*win_getid')"):
+        return GetIntValue('win_getid()')
+    return (vim.current.tabpage.number, vim.current.window.number)
+
+
+def GetBufferNumberForFilename(filename, open_file_if_needed=True):
+    return GetIntValue(u"bufnr('{0}', {1})".format(
+        EscapeForVim(os.path.realpath(filename)), int(open_file_if_needed)))
+
+
+def PlaceSign(sign_id, line_num, sign_name, buffer_num):
+    if _batch is not None and HasFeature("exists('*sign_placelist')"):
+        _batch.placed_signs.append(
+            "{'id':%d,'lnum':%d,'name':'%s','buffer':%d}" %
+            (sign_id, line_num, sign_name, buffer_num))
+        return
+    DeferCommand('silent! sign place %d line=%d name=%s buffer=%d' %
+                 (sign_id, line_num, sign_name, buffer_num))
+
+
+def UnplaceSign(sign_id, buffer_num):
+    # silent, the buffer may be gone or somebody else removed the sign
+    if _batch is not None and HasFeature("exists('*sign_unplacelist')"):
+        _batch.unplaced_signs.append("{'id':%d,'buffer':%d}" %
+                                     (sign_id, buffer_num))
+        return
+    DeferCommand('silent! sign unplace %d buffer=%d' % (sign_id, buffer_num))
+
+
+def ConvertDiagnosticsToQfList(file_name, diagnostics, bufnr=None):
+    if bufnr is None:
+        bufnr = GetBufferNumberForFilename(file_name)
     retval = []
     for diagnostic in diagnostics:
         location = diagnostic['range']['start']
         line = location['line'] + 1
         column = location['character']
+        end = diagnostic['range']['end']
         severity = diagnostic['severity']
         msg = diagnostic['message']
 
@@ -146,9 +273,11 @@ def ConvertDiagnosticsToQfList(file_name, diagnostics):
             continue
 
         retval.append({
-            'bufnr': GetBufferNumberForFilename(file_name),
+            'bufnr': bufnr,
             'lnum': line,
             'col': column,
+            'end_lnum': end['line'] + 1,
+            'end_col': end['character'],
             'text': ToUtf8IfNeeded(msg),
             'full_text': ToUtf8IfNeeded(msg),
             'type': 1,
@@ -161,67 +290,66 @@ def ConvertDiagnosticsToQfList(file_name, diagnostics):
 
 def EchoMessage(text):
     for line in str(text).split('\n'):
-        vim.command('{0} \'{1}\''.format('echom', EscapeForVim(line)))
+        DeferCommand('{0} \'{1}\''.format('echom', EscapeForVim(line)))
 
 
 def EchoText(text):
     for line in str(text).split('\n'):
-        vim.command('{0} \'{1}\''.format('echo', EscapeForVim(line)))
+        DeferCommand('{0} \'{1}\''.format('echo', EscapeForVim(line)))
 
 
 def EchoTextH(text):
     for line in str(text).split('\n'):
-        vim.command('{0} \'{1}\''.format('echoh', EscapeForVim(line)))
+        DeferCommand('{0} \'{1}\''.format('echoh', EscapeForVim(line)))
 
 def EchoErrors(text):
-    vim.command('{0} \'{1}\''.format('echoerr', EscapeForVim(text)))
+    Command('{0} \'{1}\''.format('echoerr', EscapeForVim(text)))
 
 
 def EchoTruncatedText(text):
-    width = int(vim.eval('&columns')) - 3
+    columns, saved_ruler, saved_showcmd = EvalMany(
+        ['&columns', '&ruler', '&showcmd'])
+    width = int(columns) - 3
     if width <= 0:
         return
-    saved_ruler = vim.eval('&ruler')
-    saved_showcmd = vim.eval('&showcmd')
-    vim.command('set noruler noshowcmd')
+    DeferCommand('set noruler noshowcmd')
 
     truncated = str(text)[:width]
     EchoText(truncated)
 
-    saved_ruler = vim.eval('&ruler')
-    saved_showcmd = vim.eval('&showcmd')
-    vim.command('let &ruler = %s' % saved_ruler)
-    vim.command('let &showcmd = %s' % saved_showcmd)
+    DeferCommand('let &ruler = %s' % saved_ruler)
+    DeferCommand('let &showcmd = %s' % saved_showcmd)
 
 
-def ClearClangdSyntaxMatches():
-    matches = vim.eval('getmatches()')
-    for match in matches:
-        if match['group'].startswith('clangd'):
-            vim.eval('matchdelete({0})'.format(match['id']))
+def DeleteMatch(match_id, window_id=None):
+    # window_id None is the current window, silent as the match may have
+    # been cleared by clearmatches() or the window closed
+    if window_id is None:
+        DeferCommand('silent! call matchdelete({0})'.format(match_id))
+    elif HasFeature("has('patch-8.1.1084')"):
+        DeferCommand('silent! call matchdelete({0}, {1})'.format(
+            match_id, window_id))
 
 
-def AddDiagnosticSyntaxMatch(line_num,
-                             column_num,
-                             line_end_num=None,
-                             column_end_num=None,
-                             is_error=True):
+def AddDiagnosticMatches(match_id, positions, is_error=True):
+    """Highlights up to MAX_MATCH_POSITIONS (line, column) positions of the
+    current buffer under one match id in the current window."""
     group = 'clangdErrorSection' if is_error else 'clangdWarningSection'
-
-    if not line_end_num:
-        line_end_num = line_num
-
-    line_num, column_num = LineAndColumnNumbersClamped(line_num, column_num)
-    line_end_num, column_end_num = LineAndColumnNumbersClamped(
-        line_end_num, column_end_num)
-
-    if not column_end_num:
-        return GetIntValue("matchadd('{0}', '\%{1}l\%{2}c')".format(
-            group, line_num, column_num))
+    clamped = []
+    for line_num, column_num in positions:
+        line_num, column_num = LineAndColumnNumbersClamped(line_num,
+                                                           column_num)
+        # column 0 would highlight the whole line
+        clamped.append((line_num, max(column_num, 1)))
+    if HasFeature("exists('*matchaddpos')"):
+        DeferCommand("silent! call matchaddpos('{0}', [{1}], 10, {2})".format(
+            group, ','.join('[%d,%d]' % position for position in clamped),
+            match_id))
     else:
-        return GetIntValue(
-            "matchadd('{0}', '\%{1}l\%{2}c\_.\\{{-}}\%{3}l\%{4}c')".format(
-                group, line_num, column_num, line_end_num, column_end_num))
+        pattern = '\\|'.join('\\%{0}l\\%{1}c'.format(*position)
+                              for position in clamped)
+        DeferCommand("silent! call matchadd('{0}', '{1}', 10, {2})".format(
+            group, pattern, match_id))
 
 
 def LineAndColumnNumbersClamped(line_num, column_num):
@@ -239,7 +367,16 @@ def LineAndColumnNumbersClamped(line_num, column_num):
     return new_line_num, new_column_num
 
 
-def GotoOpenedBuffer(filename, line, column):
+def GotoOpenedBuffer(filename, line, column, bufnr=None, window_ids=()):
+    # windows the buffer was seen in, they may show another one by now
+    if bufnr is not None and HasFeature("exists('*win_gotoid')"):
+        for window_id in window_ids:
+            if (GetIntValue('winbufnr(%d)' % window_id) == bufnr and
+                    GetIntValue('win_gotoid(%d)' % window_id)):
+                vim.current.window.cursor = (line, column - 1)
+                Command('normal! zz')
+                return True
+
     filepath = os.path.realpath(filename)
 
     for tab in vim.tabpages:
@@ -250,18 +387,18 @@ def GotoOpenedBuffer(filename, line, column):
                 vim.current.window.cursor = (line, column - 1)
 
                 # Center the screen on the jumped-to location
-                vim.command('normal! zz')
+                Command('normal! zz')
                 return True
 
     return False
 
 
-def GotoBuffer(filename, line, column):
+def GotoBuffer(filename, line, column, bufnr=None, window_ids=()):
     # Add an entry to the jumplist
-    vim.command("normal! m'")
+    Command("normal! m'")
 
     if filename != CurrentBufferFileName():
-        if GotoOpenedBuffer(filename, line, column):
+        if GotoOpenedBuffer(filename, line, column, bufnr, window_ids):
             return
 
         buf = vim.current.buffer
@@ -270,9 +407,9 @@ def GotoBuffer(filename, line, column):
             command = 'edit'
         else:
             command = 'split'
-        vim.command(
+        Command(
             'keepjumps {0} {1}'.format(command, filename.replace(' ', r'\ ')))
     vim.current.window.cursor = (line, column - 1)
 
     # Center the screen on the jumped-to location
-    vim.command('normal! zz')
+    Command('normal! zz')